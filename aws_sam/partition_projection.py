@@ -0,0 +1,195 @@
+# Generates Athena partition projection properties for the Glue tables in a SAM
+# template and validates them against a listing of the objects Firehose wrote.
+#
+# Firehose writes each table under {table location}/YYYY/MM/DD/HH/ (UTC), which is
+# exactly what the year/month/day/hour partition keys describe. With projection
+# enabled Athena computes the partitions from the table properties, so queries
+# need no catalog partition lookups and new data is queryable without the
+# addAthenaPartitions Lambda.
+#
+#   python partition_projection.py generate services/pipeline_deploy.yaml
+#   aws s3 ls --recursive s3://dev-cf-data/bball-user/ > listing.txt
+#   python partition_projection.py validate services/pipeline_deploy.yaml --listing listing.txt
+
+import argparse
+import re
+import sys
+from collections import OrderedDict
+
+import yaml
+
+PARTITION_KEYS = ['year', 'month', 'day', 'hour']
+DIGITS = {'year': 4, 'month': 2, 'day': 2, 'hour': 2}
+START_YEAR = 2018
+END_YEAR = 2030
+# Appended to the table location, matches the Firehose YYYY/MM/DD/HH/ prefix
+LOCATION_SUFFIX = '${year}/${month}/${day}/${hour}/'
+
+
+class CfnLoader(yaml.SafeLoader):
+    """Loads the CloudFormation short form tags (!Ref, !Sub, ...) as their long form."""
+
+
+def construct_cfn_tag(loader, suffix, node):
+    if isinstance(node, yaml.ScalarNode):
+        value = loader.construct_scalar(node)
+    elif isinstance(node, yaml.SequenceNode):
+        value = loader.construct_sequence(node, deep=True)
+    else:
+        value = loader.construct_mapping(node, deep=True)
+    if suffix == 'Ref':
+        return {'Ref': value}
+    if suffix == 'GetAtt' and isinstance(value, str):
+        value = value.split('.')
+    return {'Fn::' + suffix: value}
+
+CfnLoader.add_multi_constructor('!', construct_cfn_tag)
+
+
+def load_template(path):
+    with open(path) as f:
+        return yaml.load(f, Loader=CfnLoader)
+
+
+def template_parameters(template, overrides=None):
+    params = dict((name, str(p.get('Default', ''))) for name, p in (template.get('Parameters') or {}).items())
+    params.update(overrides or {})
+    return params
+
+
+def resolve(value, params):
+    """Resolves the Ref, Fn::Sub and Fn::Join functions used in table locations."""
+    if isinstance(value, str):
+        return value
+    if 'Ref' in value:
+        return params.get(value['Ref'], '${' + value['Ref'] + '}')
+    if 'Fn::Sub' in value:
+        text = value['Fn::Sub']
+        if isinstance(text, list):
+            text, variables = text[0], dict(params, **dict((k, resolve(v, params)) for k, v in text[1].items()))
+        else:
+            variables = params
+        return re.sub(r'\$\{([^}!]+)\}', lambda m: variables.get(m.group(1), m.group(0)), text)
+    if 'Fn::Join' in value:
+        delimiter, parts = value['Fn::Join']
+        return delimiter.join(resolve(part, params) for part in parts)
+    raise ValueError('Unsupported intrinsic function: {}'.format(value))
+
+
+def projected_tables(template):
+    """Yields (resource name, TableInput) for Glue tables partitioned by year/month/day/hour."""
+    for name, resource in (template.get('Resources') or {}).items():
+        if resource.get('Type') != 'AWS::Glue::Table':
+            continue
+        table_input = resource['Properties']['TableInput']
+        keys = [k['Name'] for k in table_input.get('PartitionKeys') or []]
+        if keys == PARTITION_KEYS:
+            yield name, table_input
+
+
+def location_template(location):
+    """The table location with the partition keys appended, keeping CloudFormation functions."""
+    if isinstance(location, str):
+        return location.rstrip('/') + '/' + LOCATION_SUFFIX
+    if 'Fn::Join' in location and location['Fn::Join'][0] == '/':
+        return {'Fn::Join': ['/', list(location['Fn::Join'][1]) + [LOCATION_SUFFIX]]}
+    return {'Fn::Join': ['', [location, '/' + LOCATION_SUFFIX]]}
+
+
+def projection_parameters(table_input, start_year=START_YEAR, end_year=END_YEAR):
+    """The table Parameters with partition projection enabled."""
+    params = OrderedDict(table_input.get('Parameters') or {})
+    params['projection.enabled'] = 'true'
+    ranges = {'year': (start_year, end_year), 'month': (1, 12), 'day': (1, 31), 'hour': (0, 23)}
+    for key in PARTITION_KEYS:
+        params['projection.{}.type'.format(key)] = 'integer'
+        params['projection.{}.range'.format(key)] = '{},{}'.format(*ranges[key])
+        params['projection.{}.digits'.format(key)] = str(DIGITS[key])
+    params['storage.location.template'] = location_template(table_input['StorageDescriptor']['Location'])
+    return params
+
+
+yaml.SafeDumper.add_representer(OrderedDict, lambda dumper, data: dumper.represent_dict(data.items()))
+
+
+def generate(args):
+    template = load_template(args.template)
+    params = template_parameters(template)
+    for name, table_input in projected_tables(template):
+        table_params = projection_parameters(table_input, args.start_year, args.end_year)
+        print('# {} ({}): TableInput.Parameters'.format(name, resolve(table_input['Name'], params)))
+        print(yaml.safe_dump({'Parameters': table_params}, default_flow_style=False, sort_keys=False))
+
+
+def location_regex(location):
+    bucket, _, prefix = location.replace('s3://', '', 1).partition('/')
+    pattern = re.escape(prefix)
+    for key in PARTITION_KEYS:
+        pattern = pattern.replace(re.escape('${' + key + '}'), r'(?P<{}>\d{{{}}})'.format(key, DIGITS[key]))
+    return bucket, re.compile('^' + pattern + r'[^/]+$')
+
+
+def listing_keys(path):
+    # Accepts plain keys or `aws s3 ls --recursive` output, where the key is the last column
+    with open(path) as f:
+        for line in f:
+            if line.strip() and not line.rstrip().endswith('/'):
+                yield line.split()[-1]
+
+
+def validate(args):
+    template = load_template(args.template)
+    params = template_parameters(template, dict(p.split('=', 1) for p in args.param))
+    ranges = {'year': (args.start_year, args.end_year), 'month': (1, 12), 'day': (1, 31), 'hour': (0, 23)}
+    keys = list(listing_keys(args.listing))
+    failed = False
+    for name, table_input in projected_tables(template):
+        table_name = resolve(table_input['Name'], params)
+        if args.table and table_name not in args.table and name not in args.table:
+            continue
+        location = resolve(projection_parameters(table_input)['storage.location.template'], params)
+        bucket, regex = location_regex(location)
+        table_prefix = location.replace('s3://{}/'.format(bucket), '', 1).split('$', 1)[0]
+        table_keys = [k for k in keys if k.startswith(table_prefix)]
+        partitions = set()
+        unmatched = []
+        for key in table_keys:
+            match = regex.match(key)
+            if match and all(ranges[k][0] <= int(match.group(k)) <= ranges[k][1] for k in PARTITION_KEYS):
+                partitions.add(tuple(match.group(k) for k in PARTITION_KEYS))
+            else:
+                unmatched.append(key)
+        print('{} ({}): {}'.format(name, table_name, location))
+        print('  objects:     {}'.format(len(table_keys)))
+        print('  partitions:  {}'.format(len(partitions)))
+        print('  unmatched:   {}'.format(len(unmatched)))
+        for key in unmatched[:10]:
+            print('    {}'.format(key))
+        failed = failed or bool(unmatched)
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Athena partition projection for the Glue tables in a SAM template.')
+    parser.add_argument('--start-year', type=int, default=START_YEAR)
+    parser.add_argument('--end-year', type=int, default=END_YEAR)
+    subparsers = parser.add_subparsers(dest='command')
+    generate_parser = subparsers.add_parser('generate', help='print the projection Parameters for each table')
+    generate_parser.add_argument('template')
+    validate_parser = subparsers.add_parser('validate', help='check projected paths against an S3 listing')
+    validate_parser.add_argument('template')
+    validate_parser.add_argument('--listing', required=True, help='file of object keys or `aws s3 ls --recursive` output')
+    validate_parser.add_argument('--table', action='append', default=[], help='only validate these tables')
+    validate_parser.add_argument('--param', action='append', default=[], help='template parameter override, Name=Value')
+    args = parser.parse_args(argv)
+    if args.command == 'generate':
+        generate(args)
+        return 0
+    if args.command == 'validate':
+        return validate(args)
+    parser.print_help()
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,64 @@
+import os
+
+import partition_projection
+
+TEMPLATE = os.path.join(os.path.dirname(__file__), '..', '..', 'services', 'pipeline_deploy.yaml')
+
+
+def write_listing(tmp_path, keys):
+    # `aws s3 ls --recursive` format, plus a directory marker that is ignored
+    path = tmp_path / 'listing.txt'
+    lines = ['2018-12-01 10:00:00      12345 {}'.format(key) for key in keys] + ['2018-12-01 10:00:00 0 bball-user/']
+    path.write_text('\n'.join(lines) + '\n')
+    return str(path)
+
+
+def validate(tmp_path, keys, *args):
+    return partition_projection.main(['validate', TEMPLATE, '--listing', write_listing(tmp_path, keys)] + list(args))
+
+
+def test_validate_accepts_firehose_paths(tmp_path, capsys):
+    keys = [
+        'bball-user/2018/12/01/00/bball-user-1-2018-12-01-00-00-00-abc.parquet',
+        'bball-user/2018/12/01/00/bball-user-1-2018-12-01-00-15-00-def.parquet',
+        'bball-user/2018/12/31/23/bball-user-1-2018-12-31-23-59-00-ghi.parquet',
+        'bball-user-raw/2018/12/01/00/bball-user-raw-1-2018-12-01-00-00-00-abc.gz',
+    ]
+    assert validate(tmp_path, keys) == 0
+    out = capsys.readouterr().out
+    assert 'ParquetDataTable (bball_user): s3://dev-cf-data/bball-user/${year}/${month}/${day}/${hour}/' in out
+    assert out.count('objects:     ') == 2
+    assert '  objects:     3\n  partitions:  2\n  unmatched:   0' in out
+    assert '  objects:     1\n  partitions:  1\n  unmatched:   0' in out
+
+
+def test_validate_reports_paths_outside_the_projection(tmp_path, capsys):
+    bad_keys = [
+        'bball-user/2018/12/01/24/hour-out-of-range.parquet',
+        'bball-user/2018/12/01/no-hour.parquet',
+        'bball-user/2018/1/01/00/one-digit-month.parquet',
+        'bball-user/2017/12/01/00/before-start-year.parquet',
+        'bball-user/2018/12/01/00/extra/nested.parquet',
+    ]
+    assert validate(tmp_path, ['bball-user/2018/12/01/00/ok.parquet'] + bad_keys, '--table', 'bball_user') == 1
+    out = capsys.readouterr().out
+    assert 'RawDataTable' not in out
+    assert '  unmatched:   5' in out
+    for key in bad_keys:
+        assert '    {}\n'.format(key) in out
+
+
+def test_validate_with_parameter_overrides(tmp_path, capsys):
+    keys = ['user-stream/2019/01/01/05/object.parquet']
+    assert validate(tmp_path, keys, '--table', 'ParquetDataTable', '--param', 'S3BucketKeyPrefix=user-stream',
+                    '--param', 'EnvStageName=prod') == 0
+    out = capsys.readouterr().out
+    assert 's3://prod-cf-data/user-stream/${year}/${month}/${day}/${hour}/' in out
+    assert '  partitions:  1' in out
+
+
+def test_generate_prints_projection_parameters(capsys):
+    assert partition_projection.main(['generate', TEMPLATE]) == 0
+    out = capsys.readouterr().out
+    assert '# ParquetDataTable (bball_user): TableInput.Parameters' in out
+    assert "projection.hour.range: 0,23" in out
@@ -3,54 +3,122 @@
 
 import boto3
 import json
+import time
 import logging
+from collections import OrderedDict
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+from lambda_runtime import TimeBudget, invoke_continuation
+
+athena = boto3.client('athena')
+lambda_client = boto3.client('lambda')
+
+# Keeps each statement well under Athena's query string limit
+MAX_PARTITIONS_PER_QUERY = 100
+# Partitions this container already added, Firehose writes many objects per hour
+# so most events only contain partitions that exist already
+registered_partitions = set()
+MAX_REGISTERED_PARTITIONS = 10000
+QUERY_POLL_SECONDS = 0.5
+# compactPartitions writes under this prefix of the same bucket, its files are
+# not a table and its partitions already exist
+COMPACTED_PREFIX = 'compacted/'
+# Left over when starting another query, the default is sized for much longer
+# running functions than this one
+SAFETY_MARGIN_MILLIS = 3000
+
+def get_s3_records(event):
+    # Continuations carry the records a previous invocation didn't get to
+    if 'continuation' in event:
+        return event['continuation']['records']
+    records = []
+    for sns_event in event['Records']:
+        records.extend(json.loads(sns_event['Sns']['Message'])['Records'])
+    return records
+
+def get_partition(rcd):
+    bucket = rcd['s3']['bucket']['name']
+    # The Glue database name MUST match the bucket name except replacing dashes with underscores
+    database_name = bucket.replace('-','_')
+    object = rcd['s3']['object']['key']
+    # The Glue table name MUST match the first obect key except replacing dashes with underscores
+    object_keys = object.split('/')
+    table_key = object_keys[0]
+    table_name = table_key.replace('-', '_')
+    year = object_keys[-5]
+    month = object_keys[-4]
+    day = object_keys[-3]
+    hour = object_keys[-2]
+    return (database_name, table_name, bucket, table_key, year, month, day, hour)
+
+def get_partitions_by_table(records):
+    """Groups the distinct partitions of the records by (database, table)."""
+    partitions_by_table = OrderedDict()
+    for rcd in records:
+        if rcd['s3']['object']['key'].startswith(COMPACTED_PREFIX):
+            continue
+        partition = get_partition(rcd)
+        if partition in registered_partitions:
+            continue
+        partitions = partitions_by_table.setdefault(partition[:2], [])
+        if partition not in partitions:
+            partitions.append(partition)
+    return partitions_by_table
+
+def add_partitions_query(database_name, table_name, partitions):
+    partition_specs = '\n                '.join(
+        'partition (year="{year}", month="{month}", day="{day}", hour="{hour}") '
+        'location "s3://{s3_bucket}/{table_key}/{year}/{month}/{day}/{hour}/"'.format(
+            s3_bucket=bucket, table_key=table_key, year=year, month=month, day=day, hour=hour)
+        for _, _, bucket, table_key, year, month, day, hour in partitions)
+    return ''' ALTER TABLE {database_name}.{table_name}
+                add if not exists
+                {partition_specs};
+    '''.format(database_name=database_name, table_name=table_name, partition_specs=partition_specs)
+
+def wait_for_query(query_id):
+    while True:
+        status = athena.get_query_execution(QueryExecutionId=query_id)['QueryExecution']['Status']
+        if status['State'] not in ('QUEUED', 'RUNNING'):
+            return status
+        time.sleep(QUERY_POLL_SECONDS)
+
+def add_partitions(database_name, table_name, partitions):
+    query = add_partitions_query(database_name, table_name, partitions)
+    logger.info('Executing query:')
+    logger.info(query)
+    response = athena.start_query_execution(
+        QueryString=query,
+        ResultConfiguration={
+            'OutputLocation': "s3://aws-athena-query-results-652741540129-us-west-2"
+        }
+    )
+    status = wait_for_query(response['QueryExecutionId'])
+    if status['State'] != 'SUCCEEDED':
+        raise RuntimeError('Adding partitions to {}.{} {}: {}'.format(
+            database_name, table_name, status['State'], status.get('StateChangeReason', '')))
+    # Only remembered once they exist, so a failed query is retried by the next event
+    if len(registered_partitions) > MAX_REGISTERED_PARTITIONS:
+        registered_partitions.clear()
+    registered_partitions.update(partitions)
+
 def lambda_handler(event, context):
-    athena = boto3.client('athena')
     logger.info(event)
-    for sns_event in event['Records']:
-        for rcd in json.loads(sns_event['Sns']['Message'])['Records']:
-            bucket = rcd['s3']['bucket']['name']
-            # The Glue database name MUST match the bucket name except replacing dashes with underscores
-            database_name = bucket.replace('-','_')
-            object = rcd['s3']['object']['key']
-            # The Glue table name MUST match the first obect key except replacing dashes with underscores
-            object_keys = object.split('/')
-            table_key = object_keys[0]
-            table_name = table_key.replace('-', '_')
-            year = object_keys[-5]
-            month = object_keys[-4]
-            day = object_keys[-3]
-            hour = object_keys[-2]
-
-            query_dict = {
-                'year': year,
-                'month': month,
-                'day': day,
-                'hour': hour,
-                'database_name': database_name,
-                'table_name': table_name,
-                'table_key': table_key,
-                's3_bucket': bucket,
-            }
-
-            query = ''' ALTER TABLE {database_name}.{table_name}
-                        add if not exists partition (year="{year}", month="{month}", day="{day}", hour="{hour}")
-                        location "s3://{s3_bucket}/{table_key}/{year}/{month}/{day}/{hour}/";
-            '''.format(**query_dict)
-            logger.info('Executing query:')
-            logger.info(query)
-            athena.start_query_execution(
-                QueryString=query,
-                ResultConfiguration={
-                    'OutputLocation': "s3://aws-athena-query-results-652741540129-us-west-2"
-                }
-            )
-            athena.start_query_execution(
-                QueryString="msck repair table {database_name}.{table_name}".format(**query_dict),
-                ResultConfiguration={
-                    'OutputLocation': "s3://aws-athena-query-results-652741540129-us-west-2"
-                }
-            )
+    budget = TimeBudget(context, SAFETY_MARGIN_MILLIS)
+    records = get_s3_records(event)
+    statements = []
+    for (database_name, table_name), partitions in get_partitions_by_table(records).items():
+        for start in range(0, len(partitions), MAX_PARTITIONS_PER_QUERY):
+            statements.append((database_name, table_name, partitions[start:start + MAX_PARTITIONS_PER_QUERY]))
+    logger.info('Adding {} partitions for {} records in {} queries'.format(
+        sum(len(p) for _, _, p in statements), len(records), len(statements)))
+    for i, (database_name, table_name, partitions) in enumerate(statements):
+        if budget.exhausted('query'):
+            # Adding partitions is idempotent (if not exists), so the continuation
+            # just gets the records whose partitions are still missing
+            remaining = set(p for _, _, ps in statements[i:] for p in ps)
+            invoke_continuation(lambda_client, context, [r for r in records if get_partition(r) in remaining], event)
+            return
+        with budget.track('query'):
+            add_partitions(database_name, table_name, partitions)
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The handler creates its boto3 clients at import time
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+
+# lambda_runtime comes from the shared layer
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'shared', 'python'))
@@ -0,0 +1,116 @@
+import json
+
+import pytest
+
+import addAthenaPartitions as handler
+
+
+class FakeAthenaClient(object):
+    def __init__(self):
+        self.queries = []
+
+    def start_query_execution(self, QueryString, ResultConfiguration):
+        self.queries.append(QueryString)
+        return {'QueryExecutionId': str(len(self.queries))}
+
+    def get_query_execution(self, QueryExecutionId):
+        return {'QueryExecution': {'Status': {'State': 'SUCCEEDED'}}}
+
+
+class FakeLambdaClient(object):
+    def __init__(self):
+        self.invocations = []
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        self.invocations.append(json.loads(Payload.decode('utf-8')))
+
+
+class FakeContext(object):
+    """A 10s function, each query takes millis_per_query of it."""
+    invoked_function_arn = 'arn:aws:lambda:us-west-2:123456789012:function:update-partitions'
+
+    def __init__(self, athena, remaining_millis=9900, millis_per_query=0):
+        self.athena = athena
+        self.remaining_millis = remaining_millis
+        self.millis_per_query = millis_per_query
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_millis - self.millis_per_query * len(self.athena.queries)
+
+
+@pytest.fixture
+def lambda_client(monkeypatch):
+    client = FakeLambdaClient()
+    monkeypatch.setattr(handler, 'lambda_client', client)
+    return client
+
+
+@pytest.fixture
+def athena(monkeypatch):
+    client = FakeAthenaClient()
+    monkeypatch.setattr(handler, 'athena', client)
+    monkeypatch.setattr(handler, 'registered_partitions', set())
+    return client
+
+
+def s3_record(bucket, key):
+    return {'s3': {'bucket': {'name': bucket}, 'object': {'key': key}}}
+
+
+def hourly_records(table_key, num_hours, objects_per_hour=2):
+    return [s3_record('bball-data', '{}/2018/12/{:02d}/{:02d}/object-{}'.format(table_key, 1 + h // 24, h % 24, n))
+            for h in range(num_hours) for n in range(objects_per_hour)]
+
+
+def query_partitions(query):
+    return query.count('partition (')
+
+
+def test_partitions_are_added_in_batches_of_100(athena):
+    records = hourly_records('bball-user', 250) + hourly_records('bball-tweet', 3)
+    handler.lambda_handler({'continuation': {'depth': 0, 'records': records}}, None)
+
+    assert [query_partitions(q) for q in athena.queries] == [100, 100, 50, 3]
+    assert all('ALTER TABLE bball_data.bball_user' in q for q in athena.queries[:3])
+    assert 'ALTER TABLE bball_data.bball_tweet' in athena.queries[3]
+    assert 'location "s3://bball-data/bball-user/2018/12/01/00/"' in athena.queries[0]
+
+
+def test_registered_partitions_are_not_added_again(athena):
+    records = hourly_records('bball-user', 150)
+    handler.lambda_handler({'continuation': {'depth': 0, 'records': records}}, None)
+    handler.lambda_handler({'continuation': {'depth': 0, 'records': records + hourly_records('bball-tweet', 1)}}, None)
+
+    assert [query_partitions(q) for q in athena.queries] == [100, 50, 1]
+
+
+def test_compacted_objects_are_skipped(athena):
+    records = hourly_records('bball-user', 1) + [
+        s3_record('bball-data', 'compacted/bball-user/2018/12/01/00/0123abcd/part-00000.parquet'),
+        s3_record('bball-data', 'compacted/bball-user/2018/12/01/00/manifest.json'),
+    ]
+    handler.lambda_handler({'continuation': {'depth': 0, 'records': records}}, None)
+
+    assert [query_partitions(q) for q in athena.queries] == [1]
+    assert 'compacted' not in athena.queries[0]
+
+
+def test_partitions_are_added_within_a_10s_timeout(athena, lambda_client):
+    records = hourly_records('bball-user', 250)
+    handler.lambda_handler({'continuation': {'depth': 0, 'records': records}}, FakeContext(athena))
+
+    assert [query_partitions(q) for q in athena.queries] == [100, 100, 50]
+    assert lambda_client.invocations == []
+
+
+def test_remaining_partitions_go_to_a_continuation(athena, lambda_client):
+    records = hourly_records('bball-user', 250)
+    context = FakeContext(athena, millis_per_query=3500)
+    handler.lambda_handler({'continuation': {'depth': 0, 'records': records}}, context)
+
+    # 9.9s left, then 6.4s, then 2.9s which is less than the 3s margin
+    assert [query_partitions(q) for q in athena.queries] == [100, 100]
+    assert len(lambda_client.invocations) == 1
+    continuation = lambda_client.invocations[0]['continuation']
+    assert continuation['depth'] == 1
+    assert continuation['records'] == records[400:]
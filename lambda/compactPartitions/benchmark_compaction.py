@@ -0,0 +1,69 @@
+# Compacts synthetic Firehose-sized Parquet files of tweet users locally and
+# compares scanning the small files with scanning the compacted output.
+#
+#   python benchmark_compaction.py [num_files] [rows_per_file]
+
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from compactPartitions import compact, iter_row_groups
+
+WORDS = np.array(['hoops', 'fan', 'Lebron', 'NBA', 'News', 'Now', 'ball', 'is', 'life', 'Kobe', 'dunk'])
+LOCATIONS = np.array(['New York', 'Chicago', 'Miami', 'Los Angeles', 'Seattle', 'Paris', 'earth', ''])
+
+
+def synthetic_tweets(num_rows, rng):
+    names = [' '.join(rng.choice(WORDS, n)) + str(rng.randint(1000)) for n in rng.randint(1, 4, size=num_rows)]
+    return pa.table({
+        'tz': pa.array(rng.choice(['EST', 'PST', 'CST'], num_rows)),
+        'name': pa.array(names),
+        'created_at': pa.array(['2018-11-22 16:{:02d}:00'.format(m) for m in rng.randint(60, size=num_rows)]),
+        'location': pa.array(rng.choice(LOCATIONS, num_rows)),
+        'user_age_at_post': pa.array(rng.randint(0, 4000, size=num_rows).astype(np.int32)),
+        'verified': pa.array(rng.rand(num_rows) < 0.05),
+    })
+
+
+def scan(paths, name):
+    # A name lookup, as predictUserVerified's tweet counts do
+    return sum(pq.read_table(path, filters=[('name', '=', name)]).num_rows for path in paths)
+
+
+if __name__ == '__main__':
+    num_files = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    rows_per_file = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    rng = np.random.RandomState(0)
+    work_dir = tempfile.mkdtemp()
+    try:
+        small = []
+        for n in range(num_files):
+            small.append(os.path.join(work_dir, 'small-{:05d}.parquet'.format(n)))
+            pq.write_table(synthetic_tweets(rows_per_file, rng), small[-1])
+        output_path = lambda n: os.path.join(work_dir, 'part-{:05d}.parquet'.format(n))
+
+        start = timeit.default_timer()
+        compacted = compact(iter_row_groups(small), output_path)
+        compact_secs = timeit.default_timer() - start
+
+        name = pq.read_table(small[0]).column('name')[0].as_py()
+        assert scan(small, name) == scan(compacted, name)
+        small_secs = min(timeit.repeat(lambda: scan(small, name), number=1, repeat=3))
+        compacted_secs = min(timeit.repeat(lambda: scan(compacted, name), number=1, repeat=3))
+        row_groups = sum(pq.ParquetFile(path).num_row_groups for path in compacted)
+
+        print('rows:              {}'.format(num_files * rows_per_file))
+        print('small files:       {}'.format(len(small)))
+        print('compacted files:   {} ({} row groups)'.format(len(compacted), row_groups))
+        print('compaction:        {:.3f}s'.format(compact_secs))
+        print('scan small files:  {:.3f}s'.format(small_secs))
+        print('scan compacted:    {:.3f}s'.format(compacted_secs))
+        print('speedup:           {:.1f}x'.format(small_secs / compacted_secs))
+    finally:
+        shutil.rmtree(work_dir)
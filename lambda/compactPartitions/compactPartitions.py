@@ -0,0 +1,288 @@
+# Compacts the small Parquet files Firehose writes every minute into a few large
+# files per hour partition, each sorted by user name with large row groups,
+# statistics and a bloom filter on name, and then points the Glue partition at
+# them.
+#
+# Source files are read one row group at a time and rows are only held until an
+# output file is full, so memory is bounded by ROWS_PER_FILE, not the partition.
+# The compacted files are written to a new prefix and the partition is switched
+# with a single ALTER TABLE ... SET LOCATION, so queries see either the old or
+# the new files, never a mix. The original objects are left in place (expire
+# them, and superseded compacted/ runs, with a lifecycle rule). Tables using
+# partition projection (aws_sam/partition_projection.py) can't point single
+# partitions elsewhere, so compaction is for tables with catalog partitions.
+#
+# The bucket's ObjectCreated notification has no prefix filter, so compacted/
+# objects reach addAthenaPartitions and predictUserVerified too, which skip them.
+#
+# Firehose can deliver into an hour after its location was switched, and those
+# objects would be invisible to queries. A manifest of the compacted source keys
+# is kept next to the runs (outside any partition location), and an hour is
+# compacted again whenever its prefix holds keys the manifest doesn't list.
+#
+# As a Lambda it runs on a schedule and compacts the last closed hour, and
+# re-checks the hours before it for late objects. As a CLI:
+#
+#   python compactPartitions.py dev-cf-data bball-user 2018 11 22 16
+
+import datetime
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+import logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+import boto3
+import pyarrow as pa
+import pyarrow.parquet as pq
+from botocore.exceptions import ClientError
+
+s3 = boto3.client('s3')
+athena = boto3.client('athena')
+
+QUERY_OUTPUT_LOCATION = 's3://aws-athena-query-results-652741540129-us-west-2'
+DEFAULT_BUCKET = os.environ.get('COMPACT_BUCKET', 'dev-cf-data')
+DEFAULT_TABLE_KEY = os.environ.get('COMPACT_TABLE_KEY', 'bball-user')
+
+# Rows per compacted file and per row group. Large row groups keep the number
+# of S3 requests per query low, sorting by name makes the row group statistics
+# selective for name lookups.
+ROWS_PER_FILE = 1000000
+ROW_GROUP_ROWS = 128 * 1024
+SORT_COLUMN = 'name'
+BLOOM_FILTER_FPP = 0.05
+# Firehose can still deliver an hour's data a few minutes after it ends
+CLOSED_AFTER_MINUTES = 15
+# Earlier hours re-checked for late objects on every scheduled run
+RECHECK_HOURS = 3
+# Compactions of one hour per run while new objects keep arriving
+MAX_COMPACTION_PASSES = 3
+QUERY_POLL_SECONDS = 0.5
+
+COMPACTED_PREFIX = 'compacted/'
+MANIFEST_NAME = 'manifest.json'
+
+
+def iter_row_groups(paths):
+    """Yields each row group of the local Parquet files as a Table."""
+    schema = None
+    for path in paths:
+        parquet_file = pq.ParquetFile(path)
+        schema = schema or parquet_file.schema_arrow
+        for i in range(parquet_file.num_row_groups):
+            yield parquet_file.read_row_group(i).cast(schema)
+
+
+def write_sorted(tables, path, sort_column=SORT_COLUMN, row_group_rows=ROW_GROUP_ROWS):
+    """
+    Writes the rows sorted by sort_column with min/max statistics, a page index
+    and a bloom filter on it, so readers can skip row groups and pages that
+    can't contain the values they look for.
+    """
+    table = pa.concat_tables(tables)
+    options = {'row_group_size': row_group_rows, 'compression': 'snappy', 'write_statistics': True}
+    if sort_column in table.column_names:
+        table = table.sort_by(sort_column)
+        options.update({
+            'write_page_index': True,
+            'bloom_filter_options': {sort_column: {'ndv': max(table.num_rows, 1), 'fpp': BLOOM_FILTER_FPP}},
+        })
+        if hasattr(pq, 'SortingColumn'):
+            options['sorting_columns'] = [pq.SortingColumn(table.column_names.index(sort_column))]
+    try:
+        pq.write_table(table, path, **options)
+    except TypeError:
+        # Older pyarrow can't write bloom filters or page indexes, the sorted rows
+        # and row group statistics still let readers skip most row groups
+        for option in ('bloom_filter_options', 'write_page_index', 'sorting_columns'):
+            options.pop(option, None)
+        pq.write_table(table, path, **options)
+    return table.num_rows
+
+
+def compact(row_groups, output_path, rows_per_file=ROWS_PER_FILE, sort_column=SORT_COLUMN,
+            row_group_rows=ROW_GROUP_ROWS):
+    """
+    Writes the row groups to files of at most rows_per_file rows, each sorted by
+    sort_column. output_path(n) gives the path of the n-th file. Returns the
+    paths written.
+    """
+    paths = []
+    pending = []
+    pending_rows = 0
+    for table in row_groups:
+        while table.num_rows:
+            take = min(table.num_rows, rows_per_file - pending_rows)
+            pending.append(table.slice(0, take))
+            pending_rows += take
+            table = table.slice(take)
+            if pending_rows == rows_per_file:
+                paths.append(output_path(len(paths)))
+                write_sorted(pending, paths[-1], sort_column, row_group_rows)
+                pending = []
+                pending_rows = 0
+    if pending_rows:
+        paths.append(output_path(len(paths)))
+        write_sorted(pending, paths[-1], sort_column, row_group_rows)
+    return paths
+
+
+def partition_prefix(table_key, year, month, day, hour):
+    return '{}/{:04d}/{:02d}/{:02d}/{:02d}/'.format(table_key, int(year), int(month), int(day), int(hour))
+
+
+def list_objects(bucket, prefix):
+    keys = []
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix, Delimiter='/'):
+        keys.extend(o['Key'] for o in page.get('Contents', []) if not o['Key'].endswith('/'))
+    return keys
+
+
+def iter_s3_row_groups(bucket, keys, work_dir):
+    # Downloads one source object at a time so /tmp only holds a single small file
+    for key in keys:
+        path = os.path.join(work_dir, 'source.parquet')
+        s3.download_file(bucket, key, path)
+        for table in iter_row_groups([path]):
+            yield table
+        os.remove(path)
+
+
+def wait_for_query(query_id):
+    while True:
+        status = athena.get_query_execution(QueryExecutionId=query_id)['QueryExecution']['Status']
+        if status['State'] not in ('QUEUED', 'RUNNING'):
+            return status
+        time.sleep(QUERY_POLL_SECONDS)
+
+
+def set_partition_location(bucket, table_key, year, month, day, hour, location):
+    # Same zero padded values as addAthenaPartitions uses when adding the partition
+    database_name = bucket.replace('-', '_')
+    table_name = table_key.replace('-', '_')
+    query = ''' ALTER TABLE {database_name}.{table_name}
+                partition (year="{year}", month="{month}", day="{day}", hour="{hour}")
+                set location "{location}";
+    '''.format(database_name=database_name, table_name=table_name, year='{:04d}'.format(int(year)),
+               month='{:02d}'.format(int(month)), day='{:02d}'.format(int(day)), hour='{:02d}'.format(int(hour)),
+               location=location)
+    logger.info('Executing query:')
+    logger.info(query)
+    response = athena.start_query_execution(QueryString=query,
+                                            ResultConfiguration={'OutputLocation': QUERY_OUTPUT_LOCATION})
+    status = wait_for_query(response['QueryExecutionId'])
+    if status['State'] != 'SUCCEEDED':
+        raise RuntimeError('Setting location of {}.{} {}: {}'.format(
+            database_name, table_name, status['State'], status.get('StateChangeReason', '')))
+
+
+def manifest_key(prefix):
+    return COMPACTED_PREFIX + prefix + MANIFEST_NAME
+
+
+def read_manifest(bucket, prefix):
+    """The location and source keys of the last compaction of prefix, or None."""
+    try:
+        body = s3.get_object(Bucket=bucket, Key=manifest_key(prefix))['Body'].read()
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+            raise
+        return None
+    return json.loads(body.decode('utf-8'))
+
+
+def write_manifest(bucket, prefix, location, keys):
+    body = json.dumps({'location': location, 'keys': keys}).encode('utf-8')
+    s3.put_object(Bucket=bucket, Key=manifest_key(prefix), Body=body)
+
+
+def compact_keys(bucket, prefix, keys):
+    """Compacts the objects into a new run prefix and returns its location."""
+    run_prefix = '{}{}{}/'.format(COMPACTED_PREFIX, prefix, uuid.uuid4().hex)
+    work_dir = tempfile.mkdtemp(dir='/tmp' if os.path.isdir('/tmp') else None)
+    try:
+        output_path = lambda n: os.path.join(work_dir, 'part-{:05d}.parquet'.format(n))
+        paths = compact(iter_s3_row_groups(bucket, keys, work_dir), output_path)
+        for path in paths:
+            s3.upload_file(path, bucket, run_prefix + os.path.basename(path))
+            os.remove(path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    location = 's3://{}/{}'.format(bucket, run_prefix)
+    logger.info('Compacted {} objects in s3://{}/{} into {} files at {}'.format(
+        len(keys), bucket, prefix, len(paths), location))
+    return location
+
+
+def compact_partition(bucket, table_key, year, month, day, hour, max_passes=MAX_COMPACTION_PASSES):
+    """
+    Compacts one hour partition and switches the table to the compacted files.
+    The prefix is listed again after each switch and compacted again if
+    Firehose delivered more objects in the meantime. Returns the partition's
+    compacted location, or None if it was never compacted.
+    """
+    prefix = partition_prefix(table_key, year, month, day, hour)
+    manifest = read_manifest(bucket, prefix)
+    location = manifest['location'] if manifest else None
+    compacted_keys = set(manifest['keys']) if manifest else set()
+    passes = 0
+    while True:
+        keys = list_objects(bucket, prefix)
+        new_keys = [key for key in keys if key not in compacted_keys]
+        if not new_keys:
+            return location
+        if location is None and len(keys) <= 1:
+            logger.info('Nothing to compact in s3://{}/{}'.format(bucket, prefix))
+            return None
+        if passes == max_passes:
+            logger.warning('{} new objects in s3://{}/{} after {} passes, leaving them for the next run'.format(
+                len(new_keys), bucket, prefix, passes))
+            return location
+        if location is not None:
+            logger.info('{} objects arrived in s3://{}/{} after it was compacted'.format(len(new_keys), bucket, prefix))
+        location = compact_keys(bucket, prefix, keys)
+        set_partition_location(bucket, table_key, year, month, day, hour, location)
+        # Written after the switch, without it the next run just compacts again
+        write_manifest(bucket, prefix, location, keys)
+        compacted_keys = set(keys)
+        passes += 1
+
+
+def last_closed_hour(now=None):
+    now = now or datetime.datetime.utcnow()
+    hour = (now - datetime.timedelta(minutes=CLOSED_AFTER_MINUTES)).replace(minute=0, second=0, microsecond=0)
+    return hour - datetime.timedelta(hours=1)
+
+
+def lambda_handler(event, context):
+    """
+    Runs on a schedule and compacts the last closed hour and the RECHECK_HOURS
+    before it, or the partition given in the event as
+    {"bucket", "table_key", "year", "month", "day", "hour"}.
+    """
+    logger.info(event)
+    if 'hour' in event:
+        partitions = [(event['year'], event['month'], event['day'], event['hour'])]
+    else:
+        closed = last_closed_hour()
+        hours = [closed - datetime.timedelta(hours=n) for n in range(RECHECK_HOURS, -1, -1)]
+        partitions = [(h.year, h.month, h.day, h.hour) for h in hours]
+    locations = {}
+    for partition in partitions:
+        location = compact_partition(event.get('bucket', DEFAULT_BUCKET), event.get('table_key', DEFAULT_TABLE_KEY),
+                                     *partition)
+        locations['{:04d}/{:02d}/{:02d}/{:02d}'.format(*[int(p) for p in partition])] = location
+    return {'locations': locations}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 7:
+        print('usage: python compactPartitions.py <bucket> <table_key> <year> <month> <day> <hour>')
+        sys.exit(2)
+    logging.basicConfig()
+    print(compact_partition(*sys.argv[1:]))
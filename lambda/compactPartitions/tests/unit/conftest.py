@@ -0,0 +1,4 @@
+import os
+
+# The handler creates its boto3 clients at import time
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
@@ -0,0 +1,142 @@
+import io
+import json
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from botocore.exceptions import ClientError
+
+import compactPartitions as handler
+
+BUCKET = 'dev-cf-data'
+PREFIX = 'bball-user/2018/11/22/16/'
+
+
+class FakeS3Client(object):
+    def __init__(self):
+        self.objects = {}
+
+    def put_parquet(self, key, names):
+        sink = io.BytesIO()
+        pq.write_table(pa.table({'name': names}), sink)
+        self.objects[key] = sink.getvalue()
+
+    def get_paginator(self, operation):
+        fake = self
+
+        class Paginator(object):
+            def paginate(self, Bucket, Prefix, Delimiter):
+                keys = sorted(k for k in fake.objects if k.startswith(Prefix) and Delimiter not in k[len(Prefix):])
+                return [{'Contents': [{'Key': k} for k in keys]}]
+        return Paginator()
+
+    def download_file(self, bucket, key, path):
+        with open(path, 'wb') as f:
+            f.write(self.objects[key])
+
+    def upload_file(self, path, bucket, key):
+        with open(path, 'rb') as f:
+            self.objects[key] = f.read()
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[Key] = Body
+
+    def rows(self, location):
+        prefix = location.replace('s3://{}/'.format(BUCKET), '', 1)
+        return sorted(name for key, body in self.objects.items() if key.startswith(prefix)
+                      for name in pq.read_table(io.BytesIO(body)).column('name').to_pylist())
+
+
+class FakeAthenaClient(object):
+    def __init__(self, on_query=None):
+        self.locations = []
+        self.on_query = on_query
+
+    def start_query_execution(self, QueryString, ResultConfiguration):
+        self.locations.append(QueryString.split('set location "')[1].split('"')[0])
+        if self.on_query:
+            self.on_query(len(self.locations))
+        return {'QueryExecutionId': str(len(self.locations))}
+
+    def get_query_execution(self, QueryExecutionId):
+        return {'QueryExecution': {'Status': {'State': 'SUCCEEDED'}}}
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    client = FakeS3Client()
+    monkeypatch.setattr(handler, 's3', client)
+    return client
+
+
+def use_athena(monkeypatch, on_query=None):
+    client = FakeAthenaClient(on_query)
+    monkeypatch.setattr(handler, 'athena', client)
+    return client
+
+
+def test_compacts_and_records_a_manifest(s3, monkeypatch):
+    athena = use_athena(monkeypatch)
+    s3.put_parquet(PREFIX + 'a.parquet', ['b', 'a'])
+    s3.put_parquet(PREFIX + 'b.parquet', ['c'])
+
+    location = handler.compact_partition(BUCKET, 'bball-user', 2018, 11, 22, 16)
+
+    assert athena.locations == [location]
+    assert location.startswith('s3://dev-cf-data/compacted/' + PREFIX)
+    assert s3.rows(location) == ['a', 'b', 'c']
+    manifest = json.loads(s3.objects['compacted/' + PREFIX + 'manifest.json'].decode('utf-8'))
+    assert manifest == {'location': location, 'keys': [PREFIX + 'a.parquet', PREFIX + 'b.parquet']}
+    # The manifest is outside the partition location
+    assert not ('s3://dev-cf-data/compacted/' + PREFIX + 'manifest.json').startswith(location)
+
+    # Nothing new, nothing to do
+    assert handler.compact_partition(BUCKET, 'bball-user', 2018, 11, 22, 16) == location
+    assert len(athena.locations) == 1
+
+
+def test_objects_delivered_after_the_switch_are_compacted_again(s3, monkeypatch):
+    def late_delivery(num_queries):
+        if num_queries == 1:
+            s3.put_parquet(PREFIX + 'late.parquet', ['d'])
+
+    athena = use_athena(monkeypatch, late_delivery)
+    s3.put_parquet(PREFIX + 'a.parquet', ['a'])
+    s3.put_parquet(PREFIX + 'b.parquet', ['b'])
+
+    location = handler.compact_partition(BUCKET, 'bball-user', 2018, 11, 22, 16)
+
+    assert len(athena.locations) == 2 and athena.locations[-1] == location
+    assert s3.rows(location) == ['a', 'b', 'd']
+
+    # A later run picks up objects that arrive after that
+    s3.put_parquet(PREFIX + 'later.parquet', ['e'])
+    location = handler.compact_partition(BUCKET, 'bball-user', 2018, 11, 22, 16)
+    assert s3.rows(location) == ['a', 'b', 'd', 'e']
+
+
+def test_compaction_passes_are_bounded(s3, monkeypatch):
+    def keep_delivering(num_queries):
+        s3.put_parquet(PREFIX + 'late-{}.parquet'.format(num_queries), ['x'])
+
+    athena = use_athena(monkeypatch, keep_delivering)
+    s3.put_parquet(PREFIX + 'a.parquet', ['a'])
+    s3.put_parquet(PREFIX + 'b.parquet', ['b'])
+
+    handler.compact_partition(BUCKET, 'bball-user', 2018, 11, 22, 16, max_passes=2)
+    assert len(athena.locations) == 2
+
+
+def test_scheduled_run_rechecks_earlier_hours(s3, monkeypatch):
+    use_athena(monkeypatch)
+    compacted = []
+    monkeypatch.setattr(handler, 'compact_partition', lambda bucket, table_key, *hour: compacted.append(hour))
+    monkeypatch.setattr(handler, 'last_closed_hour', lambda: handler.datetime.datetime(2018, 11, 23, 1))
+
+    handler.lambda_handler({}, None)
+    assert compacted == [(2018, 11, 22, 22), (2018, 11, 22, 23), (2018, 11, 23, 0), (2018, 11, 23, 1)]
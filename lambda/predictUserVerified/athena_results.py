@@ -0,0 +1,69 @@
+# Athena query results read straight from the CSV Athena writes to S3.
+#
+# The query state is polled with GetQueryExecution (with backoff) rather than
+# waiting for the result object to appear, so failed queries are reported
+# immediately. The CSV is then streamed into typed DataFrames in chunks, which is
+# far faster than paging GetQueryResults 1000 rows at a time.
+
+import random
+import time
+import logging
+logger = logging.getLogger()
+
+import pandas as pd
+
+# Rows per DataFrame when streaming the result CSV
+RESULT_CHUNK_ROWS = 100000
+MAX_QUERY_WAIT_SECONDS = 300
+POLL_BASE_SECONDS = 0.2
+POLL_MAX_SECONDS = 5.0
+
+RUNNING_STATES = ('QUEUED', 'RUNNING')
+
+# Column types of the queries run by the Lambda, anything else is read as a string
+RESULT_DTYPES = {'path': str, 'name': str, 'num_tweets': 'int64'}
+
+
+def split_s3_uri(uri):
+    bucket, _, key = uri.replace('s3://', '', 1).partition('/')
+    return bucket, key
+
+
+def wait_for_query_execution(athena_client, query_id, max_wait_secs=MAX_QUERY_WAIT_SECONDS):
+    """
+    Polls the query state until it finishes and returns the S3 location of the
+    result CSV. Raises RuntimeError if the query fails, is cancelled or does
+    not finish within max_wait_secs.
+    """
+    deadline = time.time() + max_wait_secs
+    attempt = 0
+    while True:
+        execution = athena_client.get_query_execution(QueryExecutionId=query_id)['QueryExecution']
+        state = execution['Status']['State']
+        if state == 'SUCCEEDED':
+            return execution['ResultConfiguration']['OutputLocation']
+        if state not in RUNNING_STATES:
+            raise RuntimeError('Query {} {}: {}'.format(
+                query_id, state, execution['Status'].get('StateChangeReason', '')))
+        if time.time() >= deadline:
+            raise RuntimeError('Query {} still {} after {}s'.format(query_id, state, max_wait_secs))
+        # Full jitter keeps concurrent invocations from polling in lock step
+        delay = random.uniform(0, min(POLL_MAX_SECONDS, POLL_BASE_SECONDS * 2 ** attempt))
+        time.sleep(min(delay, max(deadline - time.time(), 0)))
+        attempt += 1
+
+
+def iter_result_chunks(s3_client, output_location, dtypes=RESULT_DTYPES, chunk_rows=RESULT_CHUNK_ROWS):
+    """Yields the result CSV as DataFrames of at most chunk_rows rows."""
+    bucket, key = split_s3_uri(output_location)
+    body = s3_client.get_object(Bucket=bucket, Key=key)['Body']
+    # keep_default_na=False so names like 'NA' or 'null' stay strings
+    for chunk in pd.read_csv(body, dtype=dtypes, chunksize=chunk_rows, keep_default_na=False):
+        yield chunk
+
+
+def read_results(s3_client, output_location, dtypes=RESULT_DTYPES):
+    chunks = list(iter_result_chunks(s3_client, output_location, dtypes))
+    if not chunks:
+        return pd.DataFrame(dict((column, pd.Series(dtype=dtype)) for column, dtype in dtypes.items()))
+    return pd.concat(chunks, ignore_index=True)
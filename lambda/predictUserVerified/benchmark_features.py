@@ -0,0 +1,58 @@
+# Compares the vectorized feature definitions in features.py with the original
+# row-wise DataFrame.apply implementation on synthetic Firehose user records.
+#
+#   python benchmark_features.py [num_rows]
+
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from features import MAJOR_CITIES, add_features
+
+
+def location_is_major_city(row):
+    location = (row['location'] or 'n/a').lower()
+    major_cities = ['new york', 'chicago', 'miami', 'los angeles', 'boston', 'charlotte', 'dallas', 'houston']
+    return int(location in major_cities)
+
+def name_has_multiple_spaces(row):
+    name = row['name']
+    if ' ' in name:
+        return len(name.split(' ')) - 1
+    else:
+        return 0
+
+def add_features_rowwise(df):
+    df['loc_is_major_city'] = df.apply(location_is_major_city, axis=1)
+    df['num_spacs_in_name'] = df.apply(name_has_multiple_spaces, axis=1)
+    return df
+
+def synthetic_users(num_rows, seed=0):
+    rng = np.random.RandomState(seed)
+    words = np.array(['hoops', 'fan', 'Lebron', 'NBA', 'News', 'Now', 'ball', 'is', 'life'])
+    locations = np.array([c.title() for c in MAJOR_CITIES] + ['Seattle', 'Paris', 'earth', ''], dtype=object)
+    num_words = rng.randint(1, 5, size=num_rows)
+    return pd.DataFrame({
+        'name': [' '.join(rng.choice(words, n)) for n in num_words],
+        'location': rng.choice(locations, num_rows),
+        'user_age_at_post': rng.randint(0, 4000, size=num_rows),
+    })
+
+
+if __name__ == '__main__':
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    df = synthetic_users(num_rows)
+
+    rowwise = add_features_rowwise(df.copy())
+    vectorized = add_features(df.copy())
+    for column in ['loc_is_major_city', 'num_spacs_in_name']:
+        assert (rowwise[column].values == vectorized[column].values).all(), column
+
+    rowwise_secs = min(timeit.repeat(lambda: add_features_rowwise(df.copy()), number=1, repeat=3))
+    vectorized_secs = min(timeit.repeat(lambda: add_features(df.copy()), number=1, repeat=3))
+    print('rows:       {}'.format(num_rows))
+    print('row-wise:   {:.3f}s'.format(rowwise_secs))
+    print('vectorized: {:.3f}s'.format(vectorized_secs))
+    print('speedup:    {:.1f}x'.format(rowwise_secs / vectorized_secs))
@@ -0,0 +1,58 @@
+# One-time export of a model trained with SageMaker's built-in XGBoost to the
+# JSON format read by xgboost_model.py. The training job's model.tar.gz holds a
+# single 'xgboost-model' file, a pickled Booster (or the binary model format on
+# older containers), which can't be read without the xgboost package.
+#
+# Needs xgboost >= 1.0 (for JSON support) and is run once outside the Lambda:
+#
+#   python export_model.py <model.tar.gz path or s3:// uri> <output .json path or s3:// uri>
+
+import os
+import pickle
+import sys
+import tarfile
+import tempfile
+
+import boto3
+import xgboost
+
+SAGEMAKER_MODEL_FILE = 'xgboost-model'
+
+
+def split_s3_uri(uri):
+    bucket, _, key = uri.replace('s3://', '', 1).partition('/')
+    return bucket, key
+
+
+def load_booster(path):
+    """Loads a pickled Booster, falling back to the binary model format."""
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except (pickle.UnpicklingError, EOFError, ValueError):
+        return xgboost.Booster(model_file=path)
+
+
+def export_model(artifact_path, output_path, s3_client=None):
+    work_dir = tempfile.mkdtemp()
+    if artifact_path.startswith('s3://'):
+        local_path = os.path.join(work_dir, 'model.tar.gz')
+        s3_client.download_file(*(split_s3_uri(artifact_path) + (local_path,)))
+        artifact_path = local_path
+    if artifact_path.endswith('.tar.gz'):
+        with tarfile.open(artifact_path) as tar:
+            tar.extract(SAGEMAKER_MODEL_FILE, work_dir)
+        artifact_path = os.path.join(work_dir, SAGEMAKER_MODEL_FILE)
+
+    booster = load_booster(artifact_path)
+    json_path = os.path.join(work_dir, 'model.json')
+    booster.save_model(json_path)
+    if output_path.startswith('s3://'):
+        s3_client.upload_file(*((json_path,) + split_s3_uri(output_path)))
+    else:
+        os.rename(json_path, output_path)
+    print('Exported {} trees to {}'.format(len(booster.get_dump()), output_path))
+
+
+if __name__ == '__main__':
+    export_model(sys.argv[1], sys.argv[2], boto3.client('s3'))
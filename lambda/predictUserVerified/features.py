@@ -0,0 +1,53 @@
+# Feature definitions for the verified user model. Each feature is a vectorized
+# function of the user DataFrame registered under the column name it produces,
+# so the Lambda and the offline exploration code (other_aws_examples/boto_ex.py)
+# build exactly the same features.
+
+from collections import OrderedDict
+
+MAJOR_CITIES = ['new york', 'chicago', 'miami', 'los angeles', 'boston', 'charlotte', 'dallas', 'houston']
+
+# Order of the columns the model was trained on
+MODEL_FEATURES = ['user_age_at_post', 'loc_is_major_city', 'num_spacs_in_name', 'num_tweets']
+
+# Columns of the raw user records the features are computed from
+SOURCE_COLUMNS = ['name', 'location', 'user_age_at_post']
+
+# Columns read from the user records: the feature inputs plus the fields passed
+# through to the pred_verified_users stream
+RECORD_COLUMNS = ['name', 'location', 'verified', 'created_at', 'user_age_at_post', 'tz']
+
+FEATURES = OrderedDict()
+
+
+def feature(name):
+    def register(func):
+        FEATURES[name] = func
+        return func
+    return register
+
+
+@feature('loc_is_major_city')
+def loc_is_major_city(df):
+    return df['location'].fillna('n/a').str.lower().isin(MAJOR_CITIES).astype(int)
+
+
+@feature('num_spacs_in_name')
+def num_spacs_in_name(df):
+    return df['name'].fillna('').str.count(' ').astype(int)
+
+
+def add_features(df):
+    for name, func in FEATURES.items():
+        df[name] = func(df)
+    return df
+
+
+def build_features(df, results_df):
+    """
+    Adds every registered feature to df, joins the per user tweet counts and
+    returns the model's feature matrix.
+    """
+    add_features(df)
+    features = df.merge(results_df, on='name', how='left').fillna(0)
+    return features[MODEL_FEATURES]
@@ -0,0 +1,41 @@
+# Checks that the in-process scoring backend matches the SageMaker endpoint on
+# the same synthetic feature matrix.
+#
+#   python parity_check.py <model path or s3:// uri> [endpoint_name] [num_rows]
+
+import sys
+
+import boto3
+import numpy as np
+import pandas as pd
+
+from benchmark_features import synthetic_users
+from features import build_features
+from sagemaker_predict import SageMakerPredictor
+from xgboost_model import LocalXGBoostPredictor
+
+DEFAULT_ENDPOINT = 'DEMO-XGBoostEndpoint-2018-11-22-16-21-28'
+# Endpoint scores come back as text, allow for float32 rounding
+TOLERANCE = 1e-6
+
+
+if __name__ == '__main__':
+    model_path = sys.argv[1]
+    endpoint_name = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_ENDPOINT
+    num_rows = int(sys.argv[3]) if len(sys.argv) > 3 else 10000
+
+    df = synthetic_users(num_rows)
+    names = df['name'].unique()
+    counts = pd.DataFrame({'name': names,
+                           'num_tweets': np.random.RandomState(1).randint(1, 500, size=len(names))})
+    features = build_features(df, counts).values
+
+    local = LocalXGBoostPredictor(model_path, boto3.client('s3')).predict(features)
+    remote = SageMakerPredictor(boto3.client('runtime.sagemaker', region_name='us-west-2'),
+                                endpoint_name).predict(features)
+
+    diff = np.abs(local - remote)
+    print('rows:          {}'.format(num_rows))
+    print('max abs diff:  {:.2e}'.format(diff.max()))
+    print('mismatches:    {}'.format(int((diff > TOLERANCE).sum())))
+    assert (diff <= TOLERANCE).all(), 'local and endpoint predictions differ'
@@ -0,0 +1,98 @@
+# Pipelined processing of the S3 objects in one Lambda event. A loader thread
+# streams the chunks of the objects, in order, into a small bounded queue while
+# the current chunk is scored, so at most a few chunks are held in memory no
+# matter how large the objects are. No new object is started once the time
+# budget says it is unlikely to finish; the objects that were not finished are
+# returned so the caller can hand them off.
+
+import threading
+import logging
+logger = logging.getLogger()
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+PREFETCH_CHUNKS = 2
+POLL_SECONDS = 0.5
+
+# Queued after the last chunk of each item
+END_OF_ITEM = object()
+
+
+class ChunkLoader(object):
+    """Background thread putting (chunk, error) pairs for every item on a bounded queue."""
+    def __init__(self, items, load, max_chunks=PREFETCH_CHUNKS):
+        self.items = items
+        self.load = load
+        self.queue = queue.Queue(maxsize=max(max_chunks, 1))
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='chunk-loader')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _put(self, entry):
+        # Gives up once the consumer has stopped, rather than blocking forever
+        while not self.stopping.is_set():
+            try:
+                self.queue.put(entry, timeout=POLL_SECONDS)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _run(self):
+        for item in self.items:
+            try:
+                for chunk in self.load(item):
+                    if not self._put((chunk, None)):
+                        return
+            except Exception as e:
+                self._put((None, e))
+                return
+            if not self._put((END_OF_ITEM, None)):
+                return
+
+    def chunks(self):
+        """Yields the chunks of the next item, raising any error loading it."""
+        while True:
+            chunk, error = self.queue.get()
+            if error is not None:
+                raise error
+            if chunk is END_OF_ITEM:
+                return
+            yield chunk
+
+    def stop(self):
+        self.stopping.set()
+
+
+def run_pipelined(items, load, process, budget=None, prefetch=PREFETCH_CHUNKS):
+    """
+    Calls process(item, chunks) for each item in order, where chunks iterates
+    over load(item) as it is read in the background, at most prefetch chunks
+    ahead. process returns False if it stopped part way through an item.
+    Returns the items that were not finished.
+    """
+    loader = ChunkLoader(items, load, prefetch)
+    try:
+        for i, item in enumerate(items):
+            if budget is not None and budget.exhausted('item'):
+                logger.info('{}ms left, stopping with {} of {} items unprocessed.'.format(
+                    budget.remaining_millis(), len(items) - i, len(items)))
+                return items[i:]
+            chunks = loader.chunks()
+            if budget is not None:
+                with budget.track('item'):
+                    finished = process(item, chunks)
+            else:
+                finished = process(item, chunks)
+            if finished is False:
+                return items[i:]
+            # Skip whatever process didn't read to get to the next item
+            for _ in chunks:
+                pass
+        return []
+    finally:
+        loader.stop()
@@ -1,4 +1,4 @@
-import io
+import os
 import sys
 import json
 import logging
@@ -9,38 +9,68 @@ import boto3
 import pandas as pd
 import numpy as np
 
+from athena_results import iter_result_chunks, read_results, wait_for_query_execution
+from features import RECORD_COLUMNS, build_features
+from lambda_runtime import CheckpointStore, TimeBudget, invoke_continuation
+from pipeline import run_pipelined
+from readers import iter_object_chunks
+from sagemaker_predict import SageMakerPredictor
+from stream_writer import StreamWriter
+from tweet_count_index import TweetCountIndex
+from xgboost_model import LocalXGBoostPredictor
+
 
 s3 = boto3.client('s3')
 athena = boto3.client('athena', region_name='us-west-2')
 sagemaker = boto3.client('runtime.sagemaker', region_name='us-west-2')
 kinesis = boto3.client('kinesis', region_name='us-west-2')
+lambda_client = boto3.client('lambda', region_name='us-west-2')
 
 
 QUERY_OUTPUT_BUCKET = 'aws-athena-query-results-652741540129-us-west-2'
 ENDPOINT_NAME = 'DEMO-XGBoostEndpoint-2018-11-22-16-21-28'
 OUTPUT_STREAM = 'pred_verified_users'
+SAGEMAKER_MAX_IN_FLIGHT = int(os.environ.get('SAGEMAKER_MAX_IN_FLIGHT', 4))
+KINESIS_MAX_IN_FLIGHT = int(os.environ.get('KINESIS_MAX_IN_FLIGHT', 4))
+# Chunks read ahead of the one being scored, objects are never held in memory whole
+PREFETCH_CHUNKS = int(os.environ.get('PREFETCH_CHUNKS', 2))
+
+# Per object progress, so retries and continuations resume where they stopped
+CHECKPOINT_BUCKET = os.environ.get('CHECKPOINT_BUCKET', QUERY_OUTPUT_BUCKET)
+CHECKPOINT_PREFIX = 'checkpoints/predictUserVerified'
+checkpoints = CheckpointStore(s3, CHECKPOINT_BUCKET, CHECKPOINT_PREFIX)
+
+stream_writer = StreamWriter(kinesis, OUTPUT_STREAM, max_in_flight=KINESIS_MAX_IN_FLIGHT)
+
+# 'sagemaker' scores on ENDPOINT_NAME, 'local' scores in-process with the model
+# JSON at MODEL_PATH (a local path or s3:// URI, optionally a model.tar.gz),
+# exported from the SageMaker training artifact with export_model.py
+SCORING_BACKEND = os.environ.get('SCORING_BACKEND', 'sagemaker')
+MODEL_PATH = os.environ.get('MODEL_PATH')
 
+if SCORING_BACKEND == 'local':
+    predictor = LocalXGBoostPredictor(MODEL_PATH, s3)
+elif SCORING_BACKEND == 'sagemaker':
+    predictor = SageMakerPredictor(sagemaker, ENDPOINT_NAME, max_in_flight=SAGEMAKER_MAX_IN_FLIGHT)
+else:
+    raise ValueError('Unknown SCORING_BACKEND: {}'.format(SCORING_BACKEND))
+
+# num_tweets is looked up in a local index kept in S3, Athena is only queried to
+# backfill the index the first time it is created.
+USE_TWEET_COUNT_INDEX = os.environ.get('USE_TWEET_COUNT_INDEX', 'true').lower() == 'true'
+TWEET_COUNT_INDEX_BUCKET = os.environ.get('TWEET_COUNT_INDEX_BUCKET', QUERY_OUTPUT_BUCKET)
+TWEET_COUNT_INDEX_KEY = 'tweet-count-index/{database}/bball_user.sqlite'
+TWEET_COUNT_INDEX_PATH = '/tmp/tweet_count_index_{database}.sqlite'
+# Only objects of the bball_user table are counted, like the backfill. Firehose
+# also backs the raw records up to bball-user-raw/ in the same bucket.
+COUNTED_TABLE_PREFIX = 'bball-user/'
+
+# Kept across warm invocations so an unchanged index isn't downloaded again
+tweet_count_indexes = {}
+
+# compactPartitions rewrites scored hours under this prefix of the same bucket
+COMPACTED_PREFIX = 'compacted/'
 
-def parquet_object_to_df(bucket, obj):
-    logger.info('Collecting object: {} from bucket: {}'.format(obj, bucket))
-    bucket = boto3.resource('s3').Bucket(bucket)
-    s3_obj = bucket.Object(obj)
-
-    if obj.endswith('.parquet'):
-        logger.info('Reading parquet object.')
-        buffer = io.BytesIO()
-        s3_obj.download_fileobj(buffer)
-        logger.info('Object downloaded. Converting to Parquet.')
-        df = pd.read_parquet(buffer)
-        logger.info('Object converted to parquet.')
-        return df
-    elif obj.endswith('.gz'):
-        logger.info('Reading compressed object.')
-        stream_str = io.BytesIO(s3_obj.get()['Body'].read())
-        logger.info('Object downloaded. Reading as JSON.')
-        # TODO: Should be able to determine the type of data and handle here
-        df = pd.read_json(stream_str, compression='gzip', lines=True)
-    return df
 
 def get_query_from_df(df):
     logger.info('Generating query string.')
@@ -74,121 +104,189 @@ def begin_query(query, database):
     return query_exec_id
 
 def wait_for_query(query_id):
-    logger.info('Waiting for object to be created.')
-    s3_waiter = s3.get_waiter('object_exists')
-    s3_waiter.wait(Bucket=QUERY_OUTPUT_BUCKET,
-                   Key=query_id + '.csv',
-                   WaiterConfig={
-                        'Delay': 1,
-                        'MaxAttempts': 200
-                   }
-    )
+    logger.info('Waiting for query {} to finish.'.format(query_id))
+    return wait_for_query_execution(athena, query_id)
 
-def get_query_results(query_id):
-    logger.info('Retrieving query results.')
-    results = athena.get_query_results(
-        QueryExecutionId=query_id,
-        # NextToken='string',
-        MaxResults=5
-    )
-    logger.info('Query results retrieved.')
-    return results
-
-def results_to_df(results):
-    logger.info('Converting query results to DataFrame.')
-    rows =  results['ResultSet']['Rows']
-    header = [c['VarCharValue'] for c in rows[0]['Data']]
-    data = [[n['VarCharValue'] for n in v['Data']] for v in rows[1:]]
-    df = pd.DataFrame(data, columns=header)
-    logger.info('Query results successfully converted to DataFrame.')
-    return df
+def get_query_results(output_location):
+    logger.info('Retrieving query results from {}.'.format(output_location))
+    results_df = read_results(s3, output_location)
+    logger.info('Retrieved {} query result rows.'.format(len(results_df)))
+    return results_df
 
 def create_features(orig_df, results_df):
     logger.info('Creating final features for scoring.')
-    def _location_is_major_city(row):
-        location = (row['location'] or 'n/a').lower()
-        major_cities = ['new york', 'chicago', 'miami', 'los angeles', 'boston', 'charlotte', 'dallas', 'houston']
-        return int(location in major_cities)
-    def _name_has_multiple_spaces(row):
-        name = row['name']
-        if ' ' in name:
-            return len(name.split(' ')) - 1
-        else:
-            return 0
-    orig_df['loc_is_major_city'] = orig_df.apply(_location_is_major_city, axis=1)
-    orig_df['num_spacs_in_name'] = orig_df.apply(_name_has_multiple_spaces, axis=1)
-    features = orig_df.merge(results_df, on='name', how='left').fillna(0)
-    features = features[['user_age_at_post', 'loc_is_major_city', 'num_spacs_in_name', 'num_tweets']]
-    return features
-
-# Function to convert matrix to csv format for predictions
-def np2csv(arr):
-    return '\n'.join([','.join([str(s) for s in y ]) for y in arr])
-
-# Function to generate prediction through sample data
-def do_predict(data, endpoint_name, content_type):
-    payload = np2csv(data)
-    response = sagemaker.invoke_endpoint(EndpointName=endpoint_name,
-                                         ContentType=content_type,
-                                         Body=payload)
-    result = response['Body'].read()
-    result = result.decode("utf-8")
-    result = result.split(',')
-    preds = [float((num)) for num in result]
-    return preds
-
-# Function to iterate through a larger data set and generate batch predictions
-def batch_predict(data, batch_size, endpoint_name, content_type):
-    logger.info('Predicting score for records.')
-    items = len(data)
-    arrs = []
-    for offset in range(0, items, batch_size):
-        if offset+batch_size < items:
-            datav = data[offset:(offset+batch_size),:]
-            results = do_predict(datav, endpoint_name, content_type)
-            arrs.extend(results)
-        else:
-            datav = data[offset:items,:]
-            arrs.extend(do_predict(datav, endpoint_name, content_type))
-    logger.info('Predictions complete.')
-    return(arrs)
+    return build_features(orig_df, results_df)
 
 def send_high_prob_to_stream(df, prob_col='pred', prob_thresh=.1):
     logger.info('Sending predictions to {} Kinesis stream.'.format(OUTPUT_STREAM))
     high_probs = df[df[prob_col] >= prob_thresh]
-    print(len(high_probs))
-    rcds_sent = 0
-    for n in range(len(high_probs)):
+    rcds_sent, rcds_failed = stream_writer.put_df(high_probs)
+    logger.info('Sent {} records to stream {}, {} failed'.format(rcds_sent, OUTPUT_STREAM, rcds_failed))
+
+def load_tweet_count_index(database):
+    """Loads (and on first use backfills) an index, once per invocation."""
+    if database not in tweet_count_indexes:
+        tweet_count_indexes[database] = TweetCountIndex(
+            s3, TWEET_COUNT_INDEX_BUCKET, TWEET_COUNT_INDEX_KEY.format(database=database),
+            path=TWEET_COUNT_INDEX_PATH.format(database=database))
+    index = tweet_count_indexes[database]
+    if index.pending:
+        # A previous invocation failed before syncing, start again from S3
+        index.reset()
+    index.load()
+    if index.etag is None:
+        backfill_tweet_count_index(index, database)
+    return index
+
+def backfill_tweet_count_index(index, database):
+    logger.info('Backfilling tweet count index for {} from Athena.'.format(database))
+    # Counted per object so objects already in S3 aren't counted again when scored
+    query = 'SELECT "$path" AS path, name, count(*) num_tweets FROM {}.bball_user GROUP BY 1, 2'.format(database)
+    query_exec_id = begin_query(query, database)
+    output_location = wait_for_query(query_exec_id)
+    for n, counts_df in enumerate(iter_result_chunks(s3, output_location)):
+        index.load_backfill('backfill/{}/{}'.format(query_exec_id, n), counts_df)
+
+def sync_tweet_count_indexes():
+    """Uploads each index changed by this invocation once."""
+    for index in tweet_count_indexes.values():
+        if index.pending:
+            index.sync()
+
+def get_tweet_counts_from_athena(df, database):
+    query = get_query_from_df(df)
+    query_exec_id = begin_query(query, database)
+    output_location = wait_for_query(query_exec_id)
+    return get_query_results(output_location)
+
+def score_chunk(df, results_df):
+    features = create_features(df, results_df)
+    preds = predictor.predict(features.values)
+    df['pred'] = preds
+    send_high_prob_to_stream(df)
+
+def get_s3_records(event):
+    """
+    Returns every S3 record in the SNS event, or those left by a previous
+    invocation. Compacted copies of objects that were already scored are left
+    out so their rows aren't sent again.
+    """
+    if 'continuation' in event:
+        return event['continuation']['records']
+    records = []
+    for sns_event in event['Records']:
+        records.extend(rcd for rcd in json.loads(sns_event['Sns']['Message'])['Records']
+                       if not rcd['s3']['object']['key'].startswith(COMPACTED_PREFIX))
+    return records
+
+def get_database(rcd):
+    return rcd['s3']['bucket']['name'].replace('-', '_')
+
+def get_work_id(rcd):
+    return '{}/{}'.format(rcd['s3']['bucket']['name'], rcd['s3']['object']['key'])
+
+def read_record(rcd, columns=RECORD_COLUMNS):
+    return iter_object_chunks(s3, rcd['s3']['bucket']['name'], rcd['s3']['object']['key'], columns)
+
+def get_combined_tweet_counts(records, states):
+    """
+    Runs a single Athena query per database for the users in every object,
+    reading only the name column in a first pass over the objects. Chunks
+    that were already scored are skipped.
+    """
+    names_by_database = {}
+    for rcd, state in zip(records, states):
+        names = names_by_database.setdefault(get_database(rcd), [])
+        for n, df in enumerate(read_record(rcd, columns=['name'])):
+            if n >= state.get('chunks_done', 0):
+                names.append(pd.Series(df['name'].unique()))
+    return dict((database, get_tweet_counts_from_athena(pd.DataFrame({'name': pd.concat(names)}), database))
+                for database, names in names_by_database.items() if names)
+
+def process_record(rcd, chunks, state, budget, counts_by_database=None, completed=None):
+    """
+    Scores the chunks of one object, checkpointing after each chunk so a
+    retry or continuation resumes after the last chunk sent to the stream.
+    Returns False if the time budget ran out part way through. Checkpoints are
+    only deleted by the handler once the counts are synced, so chunks that were
+    sent are re-counted (idempotently) but never re-sent on a retry.
+    """
+    bucket = rcd['s3']['bucket']['name']
+    obj = rcd['s3']['object']['key']
+    work_id = get_work_id(rcd)
+    chunks_done = state.get('chunks_done', 0)
+    rows_done = state.get('rows_done', 0)
+    logger.info('Scoring object: {} from bucket: {} from chunk {}'.format(obj, bucket, chunks_done + 1))
+
+    database = get_database(rcd)
+    index = tweet_count_indexes[database] if USE_TWEET_COUNT_INDEX else None
+    counted = index is not None and obj.startswith(COUNTED_TABLE_PREFIX)
+    for n, df in enumerate(chunks):
+        source = '{}/{}'.format(work_id, n)
+        if n < chunks_done:
+            # Already scored, make sure its counts reached the index (a no-op if they did)
+            if counted:
+                index.add_counts(source, df['name'], object_source=work_id)
+            continue
+        if budget.exhausted('chunk'):
+            logger.info('{}ms left, stopping after {} chunks of {}'.format(budget.remaining_millis(), n, obj))
+            return False
+        with budget.track('chunk'):
+            logger.info('Scoring chunk {} of {} rows'.format(n + 1, len(df)))
+            if index is not None:
+                if counted:
+                    index.add_counts(source, df['name'], object_source=work_id)
+                results_df = index.lookup(df['name'])
+            else:
+                results_df = counts_by_database[database]
+            score_chunk(df, results_df)
+            rows_done += len(df)
+            checkpoints.put(work_id, {'chunks_done': n + 1, 'rows_done': rows_done})
+    if completed is not None:
+        completed.append(work_id)
+    return True
+
+def delete_checkpoints(work_ids):
+    """
+    Best effort, a checkpoint left behind only means a duplicate event for its
+    object reads it again without sending anything.
+    """
+    for work_id in work_ids:
         try:
-            kinesis.put_record(
-                    StreamName=OUTPUT_STREAM,
-                    Data=high_probs.iloc[n].to_json() + '\n',
-                    PartitionKey='location'
-            )
-            rcds_sent += 1
+            checkpoints.delete(work_id)
         except Exception as e:
-            logger.error('Error writing to stream: {}, error: {}'.format(OUTPUT_STREAM, str(e)))
-    logger.info('Sent {} records to stream {}'.format(rcds_sent, OUTPUT_STREAM))
-    print('Sent {} records to stream {}'.format(rcds_sent, OUTPUT_STREAM))
+            logger.warning('Unable to delete checkpoint for {}: {}'.format(work_id, e))
 
 def lambda_handler(event, context):
     """
-    Currently reads from an SNS event.
+    Reads from an SNS event, or a continuation event from a previous
+    invocation. Chunks are read ahead while the current one is scored, and
+    whatever can't be finished before the Lambda times out is handed to a
+    continuation invocation.
     """
     logger.info('Received event to score new predictions:\n {}'.format(event))
-    for sns_event in event['Records']:
-        for i, rcd in  enumerate(json.loads(sns_event['Sns']['Message'])['Records']):
-            logger.info('Beginning to process record {}'.format(i + 1))
-            bucket = rcd['s3']['bucket']['name']
-            obj = rcd['s3']['object']['key']
-            database = bucket.replace('-', '_')
-            df = parquet_object_to_df(bucket, obj)
-            query = get_query_from_df(df)
-            query_exec_id = begin_query(query, database)
-            wait_for_query(query_exec_id)
-            query_results = get_query_results(query_exec_id)
-            results_df = results_to_df(query_results)
-            features = create_features(df, results_df)
-            preds = batch_predict(features.values, 1000, ENDPOINT_NAME, 'text/csv')
-            df['pred'] = preds
-            send_high_prob_to_stream(df)
+    budget = TimeBudget(context)
+    records = get_s3_records(event)
+    items = list(range(len(records)))
+    states = [checkpoints.get(get_work_id(rcd)) for rcd in records]
+    completed = []
+    counts_by_database = None
+    if USE_TWEET_COUNT_INDEX:
+        for database in set(get_database(rcd) for rcd in records):
+            load_tweet_count_index(database)
+    else:
+        if budget.exhausted('query'):
+            logger.info('{}ms left, handing every record to a continuation.'.format(budget.remaining_millis()))
+            invoke_continuation(lambda_client, context, records, event)
+            return
+        # One Athena query covering every object instead of one per object
+        with budget.track('query'):
+            counts_by_database = get_combined_tweet_counts(records, states)
+    load = lambda n: read_record(records[n])
+    process = lambda n, chunks: process_record(records[n], chunks, states[n], budget, counts_by_database, completed)
+    unprocessed = run_pipelined(items, load, process, budget, prefetch=PREFETCH_CHUNKS)
+    # Once per invocation rather than per object, before any checkpoint is deleted
+    sync_tweet_count_indexes()
+    if unprocessed:
+        invoke_continuation(lambda_client, context, [records[n] for n in unprocessed], event)
+    delete_checkpoints(completed)
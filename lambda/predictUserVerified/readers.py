@@ -0,0 +1,114 @@
+# Streaming readers for the Firehose output in S3. Objects are read as a series
+# of bounded-size DataFrames holding only the requested columns, so memory use
+# does not grow with the size of the object.
+
+import gzip
+import io
+import logging
+logger = logging.getLogger()
+
+import pandas as pd
+
+# Rows per DataFrame handed to the scoring pipeline
+CHUNK_ROWS = 50000
+# Size of each ranged GET against the object
+READ_BLOCK_BYTES = 8 * 1024 * 1024
+
+
+class S3RangeReader(io.RawIOBase):
+    """
+    Seekable, read-only file object over an S3 object that fetches data with
+    ranged GETs. Parquet readers only touch the footer and the column chunks
+    they need, so unread columns are never downloaded.
+    """
+    def __init__(self, s3_client, bucket, key, block_bytes=READ_BLOCK_BYTES):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.block_bytes = block_bytes
+        self.size = s3_client.head_object(Bucket=bucket, Key=key)['ContentLength']
+        self.position = 0
+        self.block_start = 0
+        self.block = b''
+        self.bytes_fetched = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        elif whence == io.SEEK_END:
+            self.position = self.size + offset
+        return self.position
+
+    def _fetch(self, start, end):
+        response = self.s3.get_object(Bucket=self.bucket, Key=self.key,
+                                      Range='bytes={}-{}'.format(start, end - 1))
+        data = response['Body'].read()
+        self.bytes_fetched += len(data)
+        return data
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size - self.position
+        end = min(self.position + size, self.size)
+        if end <= self.position:
+            return b''
+        block_end = self.block_start + len(self.block)
+        if self.position >= self.block_start and end <= block_end:
+            data = self.block[self.position - self.block_start:end - self.block_start]
+        elif end - self.position >= self.block_bytes:
+            # Large reads (whole column chunks) bypass the block cache
+            data = self._fetch(self.position, end)
+        else:
+            self.block_start = self.position
+            self.block = self._fetch(self.position, min(self.position + self.block_bytes, self.size))
+            data = self.block[:end - self.position]
+        self.position += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def iter_parquet_chunks(s3_client, bucket, key, columns, chunk_rows=CHUNK_ROWS):
+    import pyarrow.parquet as pq
+
+    reader = S3RangeReader(s3_client, bucket, key)
+    parquet_file = pq.ParquetFile(reader)
+    logger.info('Reading {} rows in {} row groups from {}'.format(
+        parquet_file.metadata.num_rows, parquet_file.num_row_groups, key))
+    for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=columns):
+        yield batch.to_pandas()
+    logger.info('Fetched {} of {} bytes from {}'.format(reader.bytes_fetched, reader.size, key))
+
+
+def iter_json_chunks(s3_client, bucket, key, columns, chunk_rows=CHUNK_ROWS):
+    body = s3_client.get_object(Bucket=bucket, Key=key)['Body']
+    stream = gzip.GzipFile(fileobj=body) if key.endswith('.gz') else body
+    for chunk in pd.read_json(stream, lines=True, chunksize=chunk_rows):
+        yield chunk.reindex(columns=columns)
+
+
+def iter_object_chunks(s3_client, bucket, key, columns, chunk_rows=CHUNK_ROWS):
+    """
+    Yields DataFrames of at most chunk_rows rows holding only columns, reading
+    Parquet row groups or gzipped JSON lines as they are downloaded.
+    """
+    logger.info('Streaming object: {} from bucket: {}'.format(key, bucket))
+    if key.endswith('.parquet'):
+        return iter_parquet_chunks(s3_client, bucket, key, columns, chunk_rows)
+    elif key.endswith('.gz'):
+        return iter_json_chunks(s3_client, bucket, key, columns, chunk_rows)
+    raise ValueError('Unsupported object type: {}'.format(key))
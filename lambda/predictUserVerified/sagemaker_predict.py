@@ -0,0 +1,85 @@
+# Batch predictions against a SageMaker endpoint. The feature matrix is
+# serialized to CSV in a single pass, cut into payloads that stay under
+# the invoke_endpoint size limit and sent on a thread pool, so several requests
+# are in flight at once. Shared by the Lambda and other_aws_examples/boto_ex.py.
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+logger = logging.getLogger()
+
+import numpy as np
+
+# invoke_endpoint rejects payloads over 6 MB, leave some headroom
+MAX_PAYLOAD_BYTES = 5 * 1024 * 1024
+MAX_IN_FLIGHT = 4
+# XGBoost scores float32 features, 9 significant digits round trip any float32
+CSV_FORMAT = '%.9g'
+
+
+def serialize_csv(data):
+    """Returns one CSV encoded line (without the newline) per row of data."""
+    data = np.asarray(data, dtype=np.float64)
+    # One format string per row is much faster than joining str() of every value
+    row_format = ','.join([CSV_FORMAT] * data.shape[1])
+    return [(row_format % tuple(row)).encode('ascii') for row in data.tolist()]
+
+
+def parse_predictions(body):
+    # The XGBoost container returns comma (or newline) separated scores
+    text = body.decode('utf-8').replace('\n', ',').strip(',')
+    return np.fromstring(text, dtype=np.float64, sep=',')
+
+
+def payload_batches(lines, max_payload_bytes=MAX_PAYLOAD_BYTES, max_batch_rows=None):
+    """
+    Groups CSV lines into (start, end) row ranges whose joined payload is at
+    most max_payload_bytes, so wide or long rows shrink the batch size.
+    """
+    # Every line is followed by a newline except the last line of a payload
+    ends = np.cumsum([len(line) + 1 for line in lines])
+    batches = []
+    start = 0
+    while start < len(lines):
+        offset = ends[start - 1] if start else 0
+        end = int(np.searchsorted(ends, offset + max_payload_bytes + 1, side='right'))
+        end = max(end, start + 1)
+        if max_batch_rows:
+            end = min(end, start + max_batch_rows)
+        batches.append((start, end))
+        start = end
+    return batches
+
+
+class SageMakerPredictor(object):
+    def __init__(self, client, endpoint_name, max_in_flight=MAX_IN_FLIGHT,
+                 max_payload_bytes=MAX_PAYLOAD_BYTES, max_batch_rows=None):
+        self.client = client
+        self.endpoint_name = endpoint_name
+        self.max_in_flight = max_in_flight
+        self.max_payload_bytes = max_payload_bytes
+        self.max_batch_rows = max_batch_rows
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight)
+
+    def invoke(self, payload, num_rows):
+        response = self.client.invoke_endpoint(EndpointName=self.endpoint_name,
+                                               ContentType='text/csv',
+                                               Body=payload)
+        preds = parse_predictions(response['Body'].read())
+        if len(preds) != num_rows:
+            raise ValueError('Endpoint {} returned {} predictions for {} rows'.format(
+                self.endpoint_name, len(preds), num_rows))
+        return preds
+
+    def predict(self, data):
+        """Returns an array with one prediction per row of data, in order."""
+        lines = serialize_csv(data)
+        batches = payload_batches(lines, self.max_payload_bytes, self.max_batch_rows)
+        logger.info('Predicting {} rows in {} requests, {} in flight.'.format(
+            len(lines), len(batches), self.max_in_flight))
+        futures = [self.executor.submit(self.invoke, b'\n'.join(lines[start:end]), end - start)
+                   for start, end in batches]
+        results = [future.result() for future in futures]
+        return np.concatenate(results) if results else np.array([], dtype=np.float64)
+
+    def close(self):
+        self.executor.shutdown()
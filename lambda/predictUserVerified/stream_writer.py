@@ -0,0 +1,89 @@
+# Bulk writes of DataFrame rows to a Kinesis stream. Rows are serialized in one
+# to_json call, grouped into PutRecords requests within the API limits and sent
+# concurrently. Records that fail inside a request (throttling or internal
+# errors) are retried on their own with the same jittered backoff as the
+# producers in python-lib/kinesis.
+
+import time
+import uuid
+import logging
+from concurrent.futures import ThreadPoolExecutor
+logger = logging.getLogger()
+
+from kinesis.throttling import PutRetries, failed_entries
+
+# PutRecords limits
+MAX_BATCH_RECORDS = 500
+MAX_BATCH_BYTES = 5 * 1024 * 1024
+MAX_IN_FLIGHT = 4
+MAX_PUT_RETRIES = 5
+
+
+def df_to_records(df, partition_key_col='name'):
+    """
+    Returns a list of PutRecords entries, one JSON line per row, keyed by
+    partition_key_col so records spread across every shard of the stream.
+    """
+    if df.empty:
+        return []
+    lines = df.to_json(orient='records', lines=True).rstrip('\n').split('\n')
+    # Keys must be 1-256 characters, rows without one get a random key
+    keys = df[partition_key_col].fillna('').astype(str).str.slice(0, 256).tolist()
+    return [{'Data': (line + '\n').encode('utf-8'), 'PartitionKey': key or uuid.uuid4().hex}
+            for line, key in zip(lines, keys)]
+
+
+def record_batches(records, max_records=MAX_BATCH_RECORDS, max_bytes=MAX_BATCH_BYTES):
+    batch = []
+    batch_bytes = 0
+    for record in records:
+        size = len(record['Data']) + len(record['PartitionKey'].encode('utf-8'))
+        if batch and (len(batch) == max_records or batch_bytes + size > max_bytes):
+            yield batch
+            batch = []
+            batch_bytes = 0
+        batch.append(record)
+        batch_bytes += size
+    if batch:
+        yield batch
+
+
+class StreamWriter(object):
+    def __init__(self, client, stream_name, max_in_flight=MAX_IN_FLIGHT, max_retries=MAX_PUT_RETRIES):
+        self.client = client
+        self.stream_name = stream_name
+        self.max_retries = max_retries
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight)
+
+    def put_batch(self, records):
+        """
+        Sends one PutRecords request, retrying the records that failed.
+        Returns the number of records that could not be written.
+        """
+        retries = PutRetries(records, max_retries=self.max_retries)
+        while retries.entries:
+            records = retries.entries
+            try:
+                response = self.client.put_records(StreamName=self.stream_name, Records=records)
+            except Exception as e:
+                logger.error('Error writing to stream: {}, error: {}'.format(self.stream_name, str(e)))
+                failed = records
+            else:
+                failed = failed_entries(records, response) if response.get('FailedRecordCount') else []
+            delay = retries.next_delay(failed)
+            if delay is not None:
+                logger.info('Retrying {} failed records (attempt {}).'.format(len(failed), retries.attempt + 1))
+                time.sleep(delay)
+        if retries.given_up:
+            logger.error('Giving up on {} records for stream {}'.format(len(retries.given_up), self.stream_name))
+        return len(retries.given_up)
+
+    def put_df(self, df, partition_key_col='name'):
+        """Writes every row of df, returns (records sent, records failed)."""
+        records = df_to_records(df, partition_key_col)
+        futures = [self.executor.submit(self.put_batch, batch) for batch in record_batches(records)]
+        failed = sum(future.result() for future in futures)
+        return len(records) - failed, failed
+
+    def close(self):
+        self.executor.shutdown()
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The handler creates its boto3 clients at import time
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+
+# lambda_runtime is shared between the handlers, stream_writer uses kinesis.throttling
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'shared', 'python'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', '..', 'python-lib'))
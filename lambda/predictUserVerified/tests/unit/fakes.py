@@ -0,0 +1,49 @@
+import io
+import hashlib
+
+from botocore.exceptions import ClientError
+
+
+def client_error(code, operation):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, operation)
+
+
+class FakeS3Client(object):
+    """In memory S3 with ETags and conditional puts."""
+    def __init__(self):
+        self.objects = {}
+        self.conflicting_keys = set()
+        self.ranges = []
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise client_error('404', 'HeadObject')
+        body, etag = self.objects[(Bucket, Key)]
+        return {'ETag': etag, 'ContentLength': len(body)}
+
+    def get_object(self, Bucket, Key, Range=None):
+        if (Bucket, Key) not in self.objects:
+            raise client_error('NoSuchKey', 'GetObject')
+        body, etag = self.objects[(Bucket, Key)]
+        if Range is not None:
+            self.ranges.append(Range)
+            start, end = Range.replace('bytes=', '').split('-')
+            body = body[int(start):int(end) + 1]
+        return {'Body': io.BytesIO(body), 'ETag': etag}
+
+    def put_object(self, Bucket, Key, Body, IfMatch=None, IfNoneMatch=None):
+        current = self.objects.get((Bucket, Key))
+        if Key in self.conflicting_keys:
+            raise client_error('PreconditionFailed', 'PutObject')
+        if IfNoneMatch == '*' and current is not None:
+            raise client_error('PreconditionFailed', 'PutObject')
+        if IfMatch is not None and (current is None or current[1] != IfMatch):
+            raise client_error('PreconditionFailed', 'PutObject')
+        body = Body.read() if hasattr(Body, 'read') else Body
+        etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+        self.objects[(Bucket, Key)] = (body, etag)
+        return {'ETag': etag}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+        return {}
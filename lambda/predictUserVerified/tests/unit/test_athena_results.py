@@ -0,0 +1,86 @@
+import pandas as pd
+import pytest
+
+import athena_results
+from athena_results import read_results, wait_for_query_execution
+
+from .fakes import FakeS3Client
+
+OUTPUT_LOCATION = 's3://query-results/abc.csv'
+
+
+class FakeAthenaClient(object):
+    """Reports each state in turn, then the last one forever."""
+    def __init__(self, *states):
+        self.states = list(states)
+        self.polls = 0
+
+    def get_query_execution(self, QueryExecutionId):
+        self.polls += 1
+        state = self.states.pop(0) if len(self.states) > 1 else self.states[0]
+        return {'QueryExecution': {
+            'Status': {'State': state, 'StateChangeReason': 'because'},
+            'ResultConfiguration': {'OutputLocation': OUTPUT_LOCATION},
+        }}
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(athena_results, 'time', clock)
+    return clock
+
+
+def test_wait_returns_the_output_location(clock):
+    athena = FakeAthenaClient('QUEUED', 'RUNNING', 'SUCCEEDED')
+    assert wait_for_query_execution(athena, 'q') == OUTPUT_LOCATION
+    assert athena.polls == 3
+
+
+@pytest.mark.parametrize('state', ['FAILED', 'CANCELLED'])
+def test_wait_raises_when_the_query_does_not_succeed(clock, state):
+    with pytest.raises(RuntimeError, match=state):
+        wait_for_query_execution(FakeAthenaClient('RUNNING', state), 'q')
+
+
+def test_wait_raises_at_the_deadline(clock):
+    with pytest.raises(RuntimeError, match='still RUNNING after 10s'):
+        wait_for_query_execution(FakeAthenaClient('RUNNING'), 'q', max_wait_secs=10)
+    assert clock.now == pytest.approx(10)
+
+
+def put_csv(s3, body):
+    bucket, key = athena_results.split_s3_uri(OUTPUT_LOCATION)
+    s3.put_object(Bucket=bucket, Key=key, Body=body)
+    return s3
+
+
+def test_read_results_returns_every_row_typed():
+    # Athena quotes every value, MaxResults=5 used to drop one of these
+    csv = b'"name","num_tweets"\n"a","1"\n"NA","2"\n"null","3"\n"","4"\n"e","5"\n'
+    df = read_results(put_csv(FakeS3Client(), csv), OUTPUT_LOCATION)
+
+    assert df['name'].tolist() == ['a', 'NA', 'null', '', 'e']
+    assert df['num_tweets'].tolist() == [1, 2, 3, 4, 5]
+    assert df['num_tweets'].dtype == 'int64'
+    assert pd.api.types.is_string_dtype(df['name'])
+
+
+def test_read_results_without_rows_is_typed_and_empty():
+    df = read_results(put_csv(FakeS3Client(), b'"name","num_tweets"\n'), OUTPUT_LOCATION)
+
+    assert len(df) == 0
+    assert list(df.columns) == ['name', 'num_tweets']
+    assert df['num_tweets'].dtype == 'int64'
+    assert pd.api.types.is_string_dtype(df['name'])
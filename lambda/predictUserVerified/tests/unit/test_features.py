@@ -0,0 +1,34 @@
+import pandas as pd
+
+from features import MODEL_FEATURES, RECORD_COLUMNS, SOURCE_COLUMNS, build_features
+
+
+def user_df():
+    return pd.DataFrame({
+        'name': ['LeBron James', 'fan', 'Someone Else Here'],
+        'location': ['Los Angeles', None, 'nowhere'],
+        'verified': [True, False, False],
+        'created_at': ['2009-06-01', '2015-01-01', '2018-01-01'],
+        'user_age_at_post': [3400, 1400, 300],
+        'tz': ['Pacific Time (US & Canada)', None, None],
+    })[RECORD_COLUMNS]
+
+
+def test_record_columns_include_feature_inputs():
+    assert set(SOURCE_COLUMNS) <= set(RECORD_COLUMNS)
+
+
+def test_build_features_projects_model_columns():
+    df = user_df()
+    counts = pd.DataFrame({'name': ['LeBron James'], 'num_tweets': [12]})
+    features = build_features(df, counts)
+
+    assert list(features.columns) == MODEL_FEATURES
+    assert features.values.tolist() == [[3400, 1, 1, 12], [1400, 0, 0, 0], [300, 0, 2, 0]]
+
+
+def test_pass_through_columns_are_kept_for_the_output():
+    df = user_df()
+    build_features(df, pd.DataFrame({'name': [], 'num_tweets': []}))
+    assert set(RECORD_COLUMNS) <= set(df.columns)
+    assert df['verified'].tolist() == [True, False, False]
@@ -0,0 +1,71 @@
+import threading
+import time
+
+import pytest
+
+from pipeline import run_pipelined
+
+
+class CountingLoader(object):
+    def __init__(self, num_chunks):
+        self.num_chunks = num_chunks
+        self.produced = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, item):
+        for n in range(self.num_chunks):
+            with self.lock:
+                self.produced += 1
+            yield (item, n)
+
+
+def test_chunks_are_processed_in_order():
+    seen = []
+
+    def process(item, chunks):
+        seen.extend(chunks)
+
+    assert run_pipelined(['a', 'b'], CountingLoader(3), process) == []
+    assert seen == [('a', 0), ('a', 1), ('a', 2), ('b', 0), ('b', 1), ('b', 2)]
+
+
+def test_at_most_prefetch_chunks_are_read_ahead():
+    load = CountingLoader(20)
+    ahead = []
+
+    def process(item, chunks):
+        for consumed, chunk in enumerate(chunks, 1):
+            time.sleep(0.005)
+            with load.lock:
+                ahead.append(load.produced - consumed)
+
+    run_pipelined(['a'], load, process, prefetch=2)
+    # Two queued and one waiting in the loader for a free slot
+    assert max(ahead) <= 3
+
+
+def test_unread_chunks_are_skipped():
+    seen = []
+
+    def process(item, chunks):
+        seen.append(next(iter(chunks)))
+
+    assert run_pipelined(['a', 'b', 'c'], CountingLoader(3), process) == []
+    assert seen == [('a', 0), ('b', 0), ('c', 0)]
+
+
+def test_returns_unfinished_items():
+    def process(item, chunks):
+        list(chunks)
+        return item != 'b'
+
+    assert run_pipelined(['a', 'b', 'c'], CountingLoader(2), process) == ['b', 'c']
+
+
+def test_load_errors_are_raised_by_the_item():
+    def load(item):
+        yield 1
+        raise IOError('broken object')
+
+    with pytest.raises(IOError):
+        run_pipelined(['a'], load, lambda item, chunks: list(chunks))
@@ -0,0 +1,149 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import predictUserVerified as handler
+from features import RECORD_COLUMNS
+from lambda_runtime import CheckpointStore
+from tweet_count_index import TweetCountIndex
+
+from .fakes import FakeS3Client
+
+
+class FakeStreamWriter(object):
+    def __init__(self):
+        self.sent = []
+
+    def put_df(self, df):
+        self.sent.extend(df['name'].tolist())
+        return len(df), 0
+
+
+class FakePredictor(object):
+    def predict(self, features):
+        return np.ones(len(features))
+
+
+def user_chunk(names):
+    return pd.DataFrame({
+        'name': names,
+        'location': [None] * len(names),
+        'verified': [False] * len(names),
+        'created_at': ['2018-01-01'] * len(names),
+        'user_age_at_post': [10] * len(names),
+        'tz': [None] * len(names),
+    })[RECORD_COLUMNS]
+
+
+@pytest.fixture
+def env(monkeypatch, tmp_path):
+    s3 = FakeS3Client()
+    writer = FakeStreamWriter()
+    chunks = [user_chunk(['a', 'b']), user_chunk(['a'])]
+    monkeypatch.setattr(handler, 's3', s3)
+    monkeypatch.setattr(handler, 'checkpoints', CheckpointStore(s3, 'checkpoints', 'predictUserVerified'))
+    monkeypatch.setattr(handler, 'stream_writer', writer)
+    monkeypatch.setattr(handler, 'predictor', FakePredictor())
+    monkeypatch.setattr(handler, 'USE_TWEET_COUNT_INDEX', True)
+    monkeypatch.setattr(handler, 'TWEET_COUNT_INDEX_BUCKET', 'index')
+    monkeypatch.setattr(handler, 'TWEET_COUNT_INDEX_PATH', str(tmp_path / '{database}.sqlite'))
+    monkeypatch.setattr(handler, 'tweet_count_indexes', {})
+    monkeypatch.setattr(handler, 'read_record', lambda rcd, columns=RECORD_COLUMNS: (df[columns] for df in chunks))
+
+    key = handler.TWEET_COUNT_INDEX_KEY.format(database='data')
+    TweetCountIndex(s3, 'index', key, path=str(tmp_path / 'seed.sqlite')).load().sync()
+    return s3, writer, key
+
+
+USER_KEY = 'bball-user/2018/11/22/16/bball-user-1-2018-11-22-16-00-00-abc.parquet'
+RAW_KEY = 'bball-user-raw/2018/11/22/16/bball-user-raw-1-2018-11-22-16-00-00-abc.gz'
+
+
+def s3_event(bucket, *keys):
+    return {'continuation': {'depth': 0, 'records': [{'s3': {'bucket': {'name': bucket}, 'object': {'key': key}}}
+                                                     for key in keys]}}
+
+
+def test_retry_after_a_failed_sync_does_not_resend(env, tmp_path):
+    s3, writer, key = env
+    s3.conflicting_keys.add(key)
+    with pytest.raises(RuntimeError):
+        handler.lambda_handler(s3_event('data', USER_KEY), None)
+    assert writer.sent == ['a', 'b', 'a']
+    assert handler.checkpoints.get('data/' + USER_KEY) == {'chunks_done': 2, 'rows_done': 3}
+
+    s3.conflicting_keys.discard(key)
+    handler.lambda_handler(s3_event('data', USER_KEY), None)
+    assert writer.sent == ['a', 'b', 'a']
+    # Deleted once the counts are synced
+    assert handler.checkpoints.get('data/' + USER_KEY) == {}
+
+    index = TweetCountIndex(s3, 'index', key, path=str(tmp_path / 'check.sqlite')).load()
+    assert dict(index.lookup(['a', 'b']).values.tolist()) == {'a': 2, 'b': 1}
+
+
+def test_raw_backups_are_scored_but_not_counted(env, tmp_path):
+    s3, writer, key = env
+    handler.lambda_handler(s3_event('data', USER_KEY, RAW_KEY), None)
+    # The same rows are scored from both objects
+    assert writer.sent == ['a', 'b', 'a'] * 2
+
+    index = TweetCountIndex(s3, 'index', key, path=str(tmp_path / 'check.sqlite')).load()
+    assert dict(index.lookup(['a', 'b']).values.tolist()) == {'a': 2, 'b': 1}
+
+
+class FakeContext(object):
+    invoked_function_arn = 'arn:aws:lambda:us-west-2:123456789012:function:predictUserVerified'
+
+    def __init__(self, remaining_millis):
+        self.remaining_millis = remaining_millis
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_millis
+
+
+class FakeLambdaClient(object):
+    def __init__(self):
+        self.invocations = []
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        self.invocations.append(Payload)
+
+
+def test_athena_path_checks_the_budget_before_reading_objects(env, monkeypatch):
+    lambda_client = FakeLambdaClient()
+    monkeypatch.setattr(handler, 'USE_TWEET_COUNT_INDEX', False)
+    monkeypatch.setattr(handler, 'lambda_client', lambda_client)
+    monkeypatch.setattr(handler, 'read_record', lambda rcd, columns=None: pytest.fail('object was read'))
+
+    handler.lambda_handler(s3_event('data', 'k1'), FakeContext(1000))
+    assert len(lambda_client.invocations) == 1
+
+
+def test_athena_path_only_queries_chunks_left_to_score(env, monkeypatch):
+    s3, writer, key = env
+    queried = []
+
+    def get_tweet_counts_from_athena(df, database):
+        queried.extend(df['name'])
+        return pd.DataFrame({'name': ['a'], 'num_tweets': [7]})
+
+    monkeypatch.setattr(handler, 'USE_TWEET_COUNT_INDEX', False)
+    monkeypatch.setattr(handler, 'get_tweet_counts_from_athena', get_tweet_counts_from_athena)
+    handler.checkpoints.put('data/k1', {'chunks_done': 1, 'rows_done': 2})
+
+    handler.lambda_handler(s3_event('data', 'k1'), None)
+    assert queried == ['a']
+    assert writer.sent == ['a']
+    assert handler.checkpoints.get('data/k1') == {}
+
+
+def test_compacted_objects_are_not_scored_again():
+    message = {'Records': [
+        {'s3': {'bucket': {'name': 'data'}, 'object': {'key': 'bball-user/2018/11/22/16/object.parquet'}}},
+        {'s3': {'bucket': {'name': 'data'}, 'object': {'key': 'compacted/bball-user/2018/11/22/16/run/part.parquet'}}},
+    ]}
+    event = {'Records': [{'Sns': {'Message': json.dumps(message)}}]}
+    assert handler.get_s3_records(event) == message['Records'][:1]
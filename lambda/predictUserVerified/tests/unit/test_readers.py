@@ -0,0 +1,84 @@
+import gzip
+import io
+import json
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from readers import S3RangeReader, iter_object_chunks
+
+from .fakes import FakeS3Client
+
+
+def users(num_rows):
+    return pd.DataFrame({
+        'name': ['user{}'.format(i) for i in range(num_rows)],
+        'verified': [i % 2 == 0 for i in range(num_rows)],
+        # Large enough that skipping it shows in the bytes fetched
+        'description': ['x' * 200 + str(i) for i in range(num_rows)],
+    })
+
+
+def put_parquet(s3, df, row_group_size):
+    buffer = io.BytesIO()
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), buffer, row_group_size=row_group_size,
+                   compression='none')
+    s3.put_object(Bucket='data', Key='users.parquet', Body=buffer.getvalue())
+    return len(buffer.getvalue())
+
+
+def test_range_reader_reads_like_a_file():
+    s3 = FakeS3Client()
+    data = bytes(bytearray(range(256))) * 10
+    s3.put_object(Bucket='data', Key='blob', Body=data)
+    reader = S3RangeReader(s3, 'data', 'blob', block_bytes=100)
+
+    assert reader.read(10) == data[:10]
+    # Served from the cached block
+    assert reader.read(20) == data[10:30]
+    assert s3.ranges == ['bytes=0-99']
+    reader.seek(-5, io.SEEK_END)
+    assert reader.read() == data[-5:]
+    assert reader.read(1) == b''
+    reader.seek(1000)
+    assert reader.read(300) == data[1000:1300]
+    assert s3.ranges[-1] == 'bytes=1000-1299'
+    assert reader.tell() == 1300
+
+
+def test_parquet_objects_come_back_in_chunks_of_the_requested_columns():
+    s3 = FakeS3Client()
+    df = users(250)
+    size = put_parquet(s3, df, row_group_size=100)
+
+    chunks = list(iter_object_chunks(s3, 'data', 'users.parquet', ['name', 'verified'], chunk_rows=60))
+    assert [len(chunk) for chunk in chunks] == [60, 60, 60, 60, 10]
+    assert all(list(chunk.columns) == ['name', 'verified'] for chunk in chunks)
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), df[['name', 'verified']])
+    assert s3.ranges
+
+
+def test_unread_parquet_columns_are_not_downloaded():
+    s3 = FakeS3Client()
+    # Well over the 64KB pyarrow reads speculatively for the footer
+    size = put_parquet(s3, users(2000), row_group_size=500)
+
+    reader = S3RangeReader(s3, 'data', 'users.parquet', block_bytes=1024)
+    assert pq.ParquetFile(reader).read(columns=['name', 'verified']).num_rows == 2000
+    assert reader.bytes_fetched < size / 4
+
+
+def test_gzipped_json_lines_are_reindexed_to_the_requested_columns():
+    s3 = FakeS3Client()
+    rows = [{'name': 'a', 'verified': True}, {'name': 'b'}, {'name': 'c', 'verified': False}]
+    body = gzip.compress(''.join(json.dumps(row) + '\n' for row in rows).encode('utf-8'))
+    s3.put_object(Bucket='data', Key='users.gz', Body=body)
+
+    chunks = list(iter_object_chunks(s3, 'data', 'users.gz', ['name', 'verified', 'location'], chunk_rows=2))
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+    df = pd.concat(chunks, ignore_index=True)
+    assert list(df.columns) == ['name', 'verified', 'location']
+    assert df['name'].tolist() == ['a', 'b', 'c']
+    assert df['verified'].isnull().tolist() == [False, True, False]
+    assert df['location'].isnull().all()
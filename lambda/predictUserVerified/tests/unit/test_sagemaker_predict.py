@@ -0,0 +1,56 @@
+import io
+
+import numpy as np
+
+from sagemaker_predict import MAX_PAYLOAD_BYTES, SageMakerPredictor, payload_batches, serialize_csv
+
+
+def joined_size(lines, start, end):
+    return len(b'\n'.join(lines[start:end]))
+
+
+def test_payload_batches_stay_within_the_limit_and_cover_every_row():
+    # ~1KB rows of varying width, about 3 payloads worth
+    rng = np.random.RandomState(0)
+    lines = [b'x' * int(n) for n in rng.randint(500, 1500, size=15000)]
+    batches = payload_batches(lines)
+
+    assert len(batches) > 1
+    assert batches[0][0] == 0 and batches[-1][1] == len(lines)
+    for (start, end), (next_start, _) in zip(batches, batches[1:]):
+        assert end == next_start
+    for start, end in batches:
+        assert joined_size(lines, start, end) <= MAX_PAYLOAD_BYTES
+    # Each payload is as full as it can be
+    for start, end in batches[:-1]:
+        assert joined_size(lines, start, end + 1) > MAX_PAYLOAD_BYTES
+
+
+def test_payload_batches_exact_fit_and_oversized_rows():
+    lines = [b'a' * 4, b'b' * 5, b'c' * 20, b'd']
+    # 4 + 1 + 5 == 10 fits exactly, a row over the limit goes on its own
+    assert payload_batches(lines, max_payload_bytes=10) == [(0, 2), (2, 3), (3, 4)]
+    assert payload_batches(lines, max_payload_bytes=100, max_batch_rows=3) == [(0, 3), (3, 4)]
+
+
+class FakeRuntimeClient(object):
+    def __init__(self):
+        self.payload_sizes = []
+
+    def invoke_endpoint(self, EndpointName, ContentType, Body):
+        self.payload_sizes.append(len(Body))
+        rows = Body.split(b'\n')
+        return {'Body': io.BytesIO(b','.join(row.split(b',')[0] for row in rows))}
+
+
+def test_predict_sends_bounded_payloads_in_order():
+    client = FakeRuntimeClient()
+    predictor = SageMakerPredictor(client, 'endpoint', max_payload_bytes=1000)
+    data = np.column_stack([np.arange(500), np.random.RandomState(1).rand(500, 3)])
+
+    preds = predictor.predict(data)
+
+    assert preds.tolist() == list(range(500))
+    assert len(client.payload_sizes) > 1
+    assert max(client.payload_sizes) <= 1000
+    assert sum(client.payload_sizes) == len(b'\n'.join(serialize_csv(data))) - (len(client.payload_sizes) - 1)
@@ -0,0 +1,33 @@
+import logging
+
+import stream_writer
+from stream_writer import StreamWriter
+
+
+class FlakyKinesisClient(object):
+    """Fails the first record of every request."""
+    def __init__(self):
+        self.requests = []
+
+    def put_records(self, StreamName, Records):
+        self.requests.append(len(Records))
+        results = [{'ErrorCode': 'ProvisionedThroughputExceededException'}] + [{}] * (len(Records) - 1)
+        return {'FailedRecordCount': 1, 'Records': results}
+
+
+def records(num):
+    return [{'Data': b'{}', 'PartitionKey': str(n)} for n in range(num)]
+
+
+def test_put_batch_retries_failures_and_gives_up(monkeypatch, caplog):
+    monkeypatch.setattr(stream_writer.time, 'sleep', lambda secs: None)
+    client = FlakyKinesisClient()
+    writer = StreamWriter(client, 'stream', max_retries=2)
+
+    with caplog.at_level(logging.INFO):
+        assert writer.put_batch(records(3)) == 1
+
+    assert client.requests == [3, 1, 1]
+    retries = [r.getMessage() for r in caplog.records if r.getMessage().startswith('Retrying')]
+    assert retries == ['Retrying 1 failed records (attempt 2).', 'Retrying 1 failed records (attempt 3).']
+    writer.close()
@@ -0,0 +1,65 @@
+import pandas as pd
+
+from tweet_count_index import TweetCountIndex
+
+from .fakes import FakeS3Client
+
+BUCKET = 'index-bucket'
+KEY = 'tweet-count-index/db/bball_user.sqlite'
+
+
+def make_index(s3, tmp_path, name):
+    return TweetCountIndex(s3, BUCKET, KEY, path=str(tmp_path / '{}.sqlite'.format(name))).load()
+
+
+def backfill_df():
+    return pd.DataFrame({
+        'path': ['s3://data/k1', 's3://data/k1', 's3://data/old'],
+        'name': ['a', 'b', 'a'],
+        'num_tweets': [2, 1, 3],
+    })
+
+
+def counts(index, names):
+    return dict(index.lookup(names).values.tolist())
+
+
+def test_objects_counted_by_the_backfill_are_not_counted_again(tmp_path):
+    index = make_index(FakeS3Client(), tmp_path, 'a')
+    assert index.etag is None
+    index.load_backfill('backfill/q/0', backfill_df())
+    assert counts(index, ['a', 'b']) == {'a': 5, 'b': 1}
+
+    # The object that triggered the backfill was already in S3
+    assert not index.add_counts('data/k1/0', pd.Series(['a', 'b']), object_source='data/k1')
+    assert index.add_counts('data/k2/0', pd.Series(['a']), object_source='data/k2')
+    assert not index.add_counts('data/k2/0', pd.Series(['a']), object_source='data/k2')
+    assert counts(index, ['a', 'b']) == {'a': 6, 'b': 1}
+
+
+def test_conflicting_backfills_keep_the_first_and_reapply_counts(tmp_path):
+    s3 = FakeS3Client()
+    first = make_index(s3, tmp_path, 'first')
+    second = make_index(s3, tmp_path, 'second')
+
+    first.load_backfill('backfill/q1/0', backfill_df())
+    first.add_counts('data/k2/0', pd.Series(['a', 'c']), object_source='data/k2')
+    second.load_backfill('backfill/q2/0', backfill_df())
+    second.sync()
+    first.sync()
+
+    assert first.pending == []
+    latest = make_index(s3, tmp_path, 'latest')
+    assert counts(latest, ['a', 'b', 'c']) == {'a': 6, 'b': 1, 'c': 1}
+
+
+def test_reset_drops_unsynced_counts(tmp_path):
+    s3 = FakeS3Client()
+    index = make_index(s3, tmp_path, 'a')
+    index.load_backfill('backfill/q/0', backfill_df())
+    index.sync()
+    index.add_counts('data/k2/0', pd.Series(['a']), object_source='data/k2')
+
+    index.reset()
+    index.load()
+    assert counts(index, ['a']) == {'a': 5}
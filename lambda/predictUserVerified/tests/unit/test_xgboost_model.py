@@ -0,0 +1,87 @@
+import io
+import json
+import tarfile
+
+import numpy as np
+import pytest
+
+from xgboost_model import XGBoostTreeModel, download_model, sigmoid
+
+NAN = float('nan')
+
+
+def tree(left, right, split_indices, split_conditions, default_left):
+    return {'left_children': left, 'right_children': right, 'split_indices': split_indices,
+            'split_conditions': split_conditions, 'default_left': default_left}
+
+
+def model_json(base_score='5E-1', objective='binary:logistic'):
+    """
+    Two trees over two features, in the layout of Booster.save_model('*.json').
+
+      tree 0: f0 < 1 (missing: left) ? 0.5 : (f1 < 2 (missing: right) ? -0.25 : 1.0)
+      tree 1: f1 < 0 (missing: right) ? 0.1 : -0.1
+    """
+    return {'learner': {
+        'objective': {'name': objective},
+        'learner_model_param': {'base_score': base_score, 'num_feature': '2'},
+        'gradient_booster': {'name': 'gbtree', 'model': {'trees': [
+            tree([1, -1, 3, -1, -1], [2, -1, 4, -1, -1], [0, 0, 1, 0, 0],
+                 [1.0, 0.5, 2.0, -0.25, 1.0], [1, 0, 0, 0, 0]),
+            tree([1, -1, -1], [2, -1, -1], [1, 0, 0], [0.0, 0.1, -0.1], [0, 0, 0]),
+        ]}},
+    }}
+
+
+ROWS = [
+    ([0.0, 5.0], 0.5 - 0.1),
+    ([2.0, 1.0], -0.25 - 0.1),
+    ([2.0, 3.0], 1.0 - 0.1),
+    # Splits are strictly less than
+    ([1.0, -5.0], -0.25 + 0.1),
+    # Missing values follow the default direction of each split
+    ([NAN, 3.0], 0.5 - 0.1),
+    ([2.0, NAN], 1.0 - 0.1),
+    ([NAN, -1.0], 0.5 + 0.1),
+]
+
+
+def test_tree_walk_matches_known_margins():
+    model = XGBoostTreeModel(model_json())
+    data = np.array([row for row, _ in ROWS])
+    expected = np.array([margin for _, margin in ROWS], dtype=np.float32)
+
+    assert model.max_depth == 2
+    np.testing.assert_allclose(model.predict_margin(data), expected, rtol=1e-6)
+    np.testing.assert_allclose(model.predict(data), sigmoid(expected.astype(np.float64)), rtol=1e-6)
+
+
+def test_base_score_list_format_and_raw_objective():
+    model = XGBoostTreeModel(model_json(base_score='[2E-1]', objective='reg:squarederror'))
+    np.testing.assert_allclose(model.predict([[0.0, 5.0]]), [0.2 + 0.4], rtol=1e-6)
+
+
+def test_rejects_wrong_number_of_features():
+    with pytest.raises(ValueError):
+        XGBoostTreeModel(model_json()).predict([[1.0, 2.0, 3.0]])
+
+
+def write_tar(path, name, body):
+    with tarfile.open(str(path), 'w:gz') as tar:
+        info = tarfile.TarInfo(name)
+        info.size = len(body)
+        tar.addfile(info, io.BytesIO(body))
+
+
+def test_download_model_extracts_json_from_tar(tmp_path):
+    artifact = tmp_path / 'model.tar.gz'
+    write_tar(artifact, 'model.json', json.dumps(model_json()).encode('utf-8'))
+    with open(download_model(None, str(artifact))) as f:
+        assert json.load(f) == model_json()
+
+
+def test_download_model_asks_for_an_export_of_sagemaker_artifacts(tmp_path):
+    artifact = tmp_path / 'model.tar.gz'
+    write_tar(artifact, 'xgboost-model', b'\x80\x02pickled booster')
+    with pytest.raises(ValueError, match='export_model.py'):
+        download_model(None, str(artifact))
@@ -0,0 +1,158 @@
+# Local user name -> tweet count index, kept as a SQLite file in S3.
+#
+# Each scored object adds its per user counts to the index before the counts are
+# looked up, which gives the same num_tweets feature as the Athena
+# `count(*) ... GROUP BY name` query without a query per file. Applied sources
+# are recorded so retried invocations don't double count, and uploads are
+# conditional on the ETag that was downloaded so concurrent invocations never
+# overwrite each other's counts.
+#
+# A new index is backfilled from Athena with per object counts, and every object
+# the backfill counted is recorded as applied, so objects that were already in
+# S3 (including the one being scored) are never counted twice.
+
+import os
+import sqlite3
+import logging
+logger = logging.getLogger()
+
+import pandas as pd
+from botocore.exceptions import ClientError
+
+LOCAL_INDEX_PATH = '/tmp/tweet_count_index.sqlite'
+MAX_SYNC_ATTEMPTS = 5
+# SQLite allows 999 parameters per statement
+LOOKUP_BATCH_SIZE = 900
+
+CONFLICT_ERROR_CODES = ('PreconditionFailed', 'ConditionalRequestConflict', '412')
+
+
+class TweetCountIndex(object):
+    def __init__(self, s3_client, bucket, key, path=LOCAL_INDEX_PATH):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.path = path
+        self.etag = None
+        self.connection = None
+        self.pending = []
+
+    def _connect(self):
+        if self.connection is not None:
+            self.connection.close()
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS user_tweets (name TEXT PRIMARY KEY, num_tweets INTEGER NOT NULL)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS applied_sources (source TEXT PRIMARY KEY)')
+        self.connection.commit()
+
+    def load(self):
+        """
+        Downloads the index unless the local copy from a previous (warm)
+        invocation is still current.
+        """
+        try:
+            etag = self.s3.head_object(Bucket=self.bucket, Key=self.key)['ETag']
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('404', 'NoSuchKey', 'NotFound'):
+                raise
+            logger.info('No tweet count index at s3://{}/{}, starting empty.'.format(self.bucket, self.key))
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.etag = None
+            self._connect()
+            return self
+
+        if etag != self.etag or not os.path.exists(self.path):
+            logger.info('Downloading tweet count index s3://{}/{}'.format(self.bucket, self.key))
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+            response = self.s3.get_object(Bucket=self.bucket, Key=self.key)
+            with open(self.path, 'wb') as f:
+                for chunk in iter(lambda: response['Body'].read(1024 * 1024), b''):
+                    f.write(chunk)
+            self.etag = response['ETag']
+        self._connect()
+        return self
+
+    def reset(self):
+        """Drops counts that were never synced, the next load downloads the index again."""
+        self.pending = []
+        self.etag = None
+
+    def is_applied(self, source):
+        return self.connection.execute('SELECT 1 FROM applied_sources WHERE source = ?',
+                                       (source,)).fetchone() is not None
+
+    def _apply(self, source, counts, object_source=None, covered_sources=()):
+        if self.is_applied(source) or (object_source is not None and self.is_applied(object_source)):
+            return False
+        cursor = self.connection.cursor()
+        cursor.executemany('INSERT OR IGNORE INTO user_tweets (name, num_tweets) VALUES (?, 0)',
+                           [(name,) for name in counts])
+        cursor.executemany('UPDATE user_tweets SET num_tweets = num_tweets + ? WHERE name = ?',
+                           [(int(count), name) for name, count in counts.items()])
+        cursor.executemany('INSERT OR IGNORE INTO applied_sources (source) VALUES (?)',
+                           [(s,) for s in [source] + list(covered_sources)])
+        self.connection.commit()
+        return True
+
+    def add_counts(self, source, names, object_source=None):
+        """
+        Adds one tweet per entry in names. source uniquely identifies the data
+        (e.g. object key and chunk number) so it is only ever counted once, and
+        nothing is added if the whole object_source was counted by the backfill.
+        """
+        counts = names.dropna().value_counts().to_dict()
+        self.pending.append((source, counts, object_source, ()))
+        return self._apply(source, counts, object_source)
+
+    def lookup(self, names):
+        """Returns a DataFrame of name, num_tweets for the names in the index."""
+        names = list(pd.unique(pd.Series(names).dropna()))
+        rows = []
+        for start in range(0, len(names), LOOKUP_BATCH_SIZE):
+            batch = names[start:start + LOOKUP_BATCH_SIZE]
+            rows.extend(self.connection.execute(
+                'SELECT name, num_tweets FROM user_tweets WHERE name IN ({})'.format(','.join('?' * len(batch))),
+                batch).fetchall())
+        return pd.DataFrame(rows, columns=['name', 'num_tweets'])
+
+    def load_backfill(self, source, counts_df):
+        """
+        Loads path, name, num_tweets rows from the Athena backfill query and
+        records each object path (without s3://) as applied.
+        """
+        counts = counts_df.groupby('name')['num_tweets'].sum().to_dict()
+        objects = [path.replace('s3://', '', 1) for path in counts_df['path'].unique()]
+        self.pending.append((source, counts, None, objects))
+        return self._apply(source, counts, covered_sources=objects)
+
+    def sync(self):
+        """
+        Uploads the index if nobody else has changed it since it was
+        downloaded. On a conflict the latest index is downloaded, this
+        invocation's counts are re-applied and the upload is retried.
+        """
+        for attempt in range(MAX_SYNC_ATTEMPTS):
+            self.connection.commit()
+            with open(self.path, 'rb') as f:
+                kwargs = {'IfMatch': self.etag} if self.etag else {'IfNoneMatch': '*'}
+                try:
+                    response = self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=f, **kwargs)
+                except ClientError as e:
+                    if e.response['Error']['Code'] not in CONFLICT_ERROR_CODES:
+                        raise
+                    logger.info('Tweet count index changed concurrently, retrying (attempt {}).'.format(attempt + 1))
+                    self.load()
+                    for source, counts, object_source, covered_sources in self.pending:
+                        # An index that exists in S3 was backfilled by whoever created it
+                        if covered_sources and self.etag is not None:
+                            continue
+                        self._apply(source, counts, object_source, covered_sources)
+                    continue
+            self.etag = response['ETag']
+            self.pending = []
+            logger.info('Tweet count index uploaded to s3://{}/{}'.format(self.bucket, self.key))
+            return
+        raise RuntimeError('Unable to sync tweet count index after {} attempts'.format(MAX_SYNC_ATTEMPTS))
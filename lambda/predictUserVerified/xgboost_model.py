@@ -0,0 +1,143 @@
+# In-process scoring of a trained XGBoost model without the xgboost package.
+#
+# The model is read from the JSON format written by Booster.save_model('*.json')
+# and every tree is flattened into NumPy arrays, so all trees are walked for all
+# rows at once, one tree level per step. This avoids the network round trip to
+# the SageMaker endpoint and keeps the Lambda package small.
+#
+# SageMaker's built-in XGBoost saves model.tar.gz with a pickled (or binary)
+# Booster rather than JSON, export it once with export_model.py and point
+# MODEL_PATH at the result.
+
+import json
+import os
+import tarfile
+import logging
+logger = logging.getLogger()
+
+import numpy as np
+
+LOCAL_MODEL_DIR = '/tmp/xgboost_model'
+
+# Models loaded by this container, keyed by model path
+loaded_models = {}
+
+
+def sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+# objective -> (base_score to margin, margin to prediction)
+OBJECTIVES = {
+    'binary:logistic': (lambda p: np.log(p / (1.0 - p)), sigmoid),
+    'reg:logistic': (lambda p: np.log(p / (1.0 - p)), sigmoid),
+    'binary:logitraw': (lambda p: p, lambda m: m),
+    'reg:squarederror': (lambda p: p, lambda m: m),
+    'reg:linear': (lambda p: p, lambda m: m),
+}
+
+
+class XGBoostTreeModel(object):
+    """Trees of a gbtree model stored in flat arrays, one row per node."""
+    def __init__(self, model_json):
+        learner = model_json['learner']
+        self.objective = learner['objective']['name']
+        if self.objective not in OBJECTIVES:
+            raise ValueError('Unsupported objective: {}'.format(self.objective))
+        booster = learner['gradient_booster']
+        if booster['name'] != 'gbtree':
+            raise ValueError('Unsupported booster: {}'.format(booster['name']))
+        to_margin, self.transform = OBJECTIVES[self.objective]
+        # Newer releases write base_score as a one element list, e.g. '[5E-1]'
+        base_score = float(learner['learner_model_param']['base_score'].strip('[]'))
+        self.base_margin = np.float32(to_margin(base_score))
+        self.num_features = int(learner['learner_model_param']['num_feature'])
+
+        trees = booster['model']['trees']
+        self.num_trees = len(trees)
+        # Node ids of each tree are offset so all trees share one set of arrays
+        offsets = np.cumsum([0] + [len(t['left_children']) for t in trees])
+        self.roots = offsets[:-1]
+        self.left = np.concatenate([np.array(t['left_children']) + o for t, o in zip(trees, offsets)])
+        self.right = np.concatenate([np.array(t['right_children']) + o for t, o in zip(trees, offsets)])
+        self.is_leaf = np.concatenate([np.array(t['left_children']) == -1 for t in trees])
+        self.split_index = np.concatenate([np.array(t['split_indices'], dtype=np.int64) for t in trees])
+        # Leaves store their value in split_conditions
+        self.split_condition = np.concatenate([np.array(t['split_conditions'], dtype=np.float32) for t in trees])
+        self.default_left = np.concatenate([np.array(t['default_left'], dtype=bool) for t in trees])
+        # Leaves point at themselves so finished trees stay put while others descend
+        leaves = np.flatnonzero(self.is_leaf)
+        self.left[leaves] = leaves
+        self.right[leaves] = leaves
+        self.split_index[leaves] = 0
+        self.max_depth = self._max_depth()
+
+    def _max_depth(self):
+        depth = 0
+        nodes = self.roots
+        while not self.is_leaf[nodes].all():
+            nodes = np.unique(np.concatenate([self.left[nodes], self.right[nodes]]))
+            depth += 1
+        return depth
+
+    def predict_margin(self, data):
+        data = np.asarray(data, dtype=np.float32)
+        if data.shape[1] != self.num_features:
+            raise ValueError('Model expects {} features, got {}'.format(self.num_features, data.shape[1]))
+        rows = np.arange(len(data))[:, None]
+        nodes = np.tile(self.roots, (len(data), 1))
+        for _ in range(self.max_depth):
+            values = data[rows, self.split_index[nodes]]
+            go_left = np.where(np.isnan(values), self.default_left[nodes], values < self.split_condition[nodes])
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return self.base_margin + self.split_condition[nodes].sum(axis=1, dtype=np.float32)
+
+    def predict(self, data):
+        return self.transform(self.predict_margin(data).astype(np.float64))
+
+
+def download_model(s3_client, model_path, local_dir=LOCAL_MODEL_DIR):
+    """
+    Returns a local path for model_path, downloading s3:// paths and
+    extracting the model JSON from SageMaker model.tar.gz artifacts.
+    """
+    if model_path.startswith('s3://'):
+        bucket, _, key = model_path.replace('s3://', '', 1).partition('/')
+        if not os.path.isdir(local_dir):
+            os.makedirs(local_dir)
+        local_path = os.path.join(local_dir, os.path.basename(key))
+        logger.info('Downloading model {} to {}'.format(model_path, local_path))
+        s3_client.download_file(bucket, key, local_path)
+        model_path = local_path
+    if model_path.endswith('.tar.gz'):
+        extract_dir = model_path[:-len('.tar.gz')]
+        with tarfile.open(model_path) as tar:
+            members = [m for m in tar.getmembers() if m.isfile() and m.name.endswith('.json')]
+            if not members:
+                raise ValueError('No JSON model found in {}, convert the SageMaker artifact with '
+                                 'export_model.py first'.format(model_path))
+            tar.extract(members[0], extract_dir)
+            model_path = os.path.join(extract_dir, members[0].name)
+    return model_path
+
+
+def load_model(model_path, s3_client=None):
+    """Loads the model once per container and reuses it on warm invocations."""
+    if model_path not in loaded_models:
+        with open(download_model(s3_client, model_path)) as f:
+            loaded_models[model_path] = XGBoostTreeModel(json.load(f))
+        logger.info('Loaded XGBoost model {} with {} trees.'.format(model_path, loaded_models[model_path].num_trees))
+    return loaded_models[model_path]
+
+
+class LocalXGBoostPredictor(object):
+    """Drop-in replacement for SageMakerPredictor that scores in-process."""
+    def __init__(self, model_path, s3_client=None):
+        self.model_path = model_path
+        self.s3 = s3_client
+
+    def predict(self, data):
+        return load_model(self.model_path, self.s3).predict(data)
+
+    def close(self):
+        pass
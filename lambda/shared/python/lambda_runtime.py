@@ -0,0 +1,94 @@
+# Runtime helpers shared by the Lambda handlers for work that may not fit in a
+# single invocation: a time budget based on the Lambda context, a small S3
+# checkpoint store and continuation invocations that pick up the remaining work.
+#
+# Deployed as the SharedRuntimeLayer Lambda layer (see lambda/README.md), the
+# python/ directory is the root of the layer zip so the module is importable.
+
+import json
+import time
+import logging
+from contextlib import contextmanager
+logger = logging.getLogger()
+
+from botocore.exceptions import ClientError
+
+# Left over when starting a unit of work, on top of the slowest unit so far.
+# Functions with short timeouts pass a smaller margin to TimeBudget.
+SAFETY_MARGIN_MILLIS = 30000
+# Stops a chain of continuations that makes no progress
+MAX_CONTINUATIONS = 50
+
+
+class TimeBudget(object):
+    """
+    Tracks how long units of work take so a handler can stop before the Lambda
+    times out. Units are grouped by kind (e.g. 'object', 'chunk').
+    """
+    def __init__(self, context, safety_margin_millis=SAFETY_MARGIN_MILLIS):
+        self.context = context
+        self.safety_margin_millis = safety_margin_millis
+        self.slowest_millis = {}
+
+    def remaining_millis(self):
+        if self.context is None:
+            return float('inf')
+        return self.context.get_remaining_time_in_millis()
+
+    def exhausted(self, kind):
+        """True if another unit of this kind is unlikely to finish in time."""
+        return self.remaining_millis() < self.slowest_millis.get(kind, 0) + self.safety_margin_millis
+
+    @contextmanager
+    def track(self, kind):
+        start = time.time()
+        yield
+        millis = (time.time() - start) * 1000
+        self.slowest_millis[kind] = max(self.slowest_millis.get(kind, 0), millis)
+
+
+class CheckpointStore(object):
+    """Progress of each unit of work, stored as a JSON object in S3."""
+    def __init__(self, s3_client, bucket, prefix):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.prefix = prefix.rstrip('/') + '/'
+
+    def key(self, work_id):
+        return self.prefix + work_id + '.json'
+
+    def get(self, work_id):
+        try:
+            body = self.s3.get_object(Bucket=self.bucket, Key=self.key(work_id))['Body'].read()
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+                raise
+            return {}
+        return json.loads(body.decode('utf-8'))
+
+    def put(self, work_id, state):
+        self.s3.put_object(Bucket=self.bucket, Key=self.key(work_id), Body=json.dumps(state).encode('utf-8'))
+
+    def delete(self, work_id):
+        self.s3.delete_object(Bucket=self.bucket, Key=self.key(work_id))
+
+
+def continuation_event(records, event=None):
+    """
+    Event for a continuation invocation carrying the records that are left.
+    Handlers recognise it by its 'continuation' key.
+    """
+    depth = (event or {}).get('continuation', {}).get('depth', 0) + 1
+    return {'continuation': {'depth': depth, 'records': records}}
+
+
+def invoke_continuation(lambda_client, context, records, event=None):
+    """Asynchronously invokes this function again with the remaining records."""
+    next_event = continuation_event(records, event)
+    depth = next_event['continuation']['depth']
+    if depth > MAX_CONTINUATIONS:
+        raise RuntimeError('Giving up after {} continuations with {} records left'.format(depth - 1, len(records)))
+    lambda_client.invoke(FunctionName=context.invoked_function_arn,
+                         InvocationType='Event',
+                         Payload=json.dumps(next_event).encode('utf-8'))
+    logger.info('Handed {} records to continuation {}'.format(len(records), depth))
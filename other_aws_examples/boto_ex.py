@@ -260,65 +260,18 @@ header
 data = [[n['VarCharValue'] for n in v['Data']] for v in rows[1:]]
 data = pd.DataFrame(data, columns=header)
 
-def location_is_major_city(row):
-    location = (row['location'] or 'n/a').lower()
-    major_cities = ['new york', 'chicago', 'miami', 'los angeles', 'boston', 'charlotte', 'dallas', 'houston']
-    return int(location in major_cities)
+# Share the feature definitions used by the predictUserVerified Lambda
+sys.path.append('lambda/predictUserVerified')
+from features import build_features
+from sagemaker_predict import SageMakerPredictor
 
-def name_has_multiple_spaces(row):
-    name = row['name']
-    if ' ' in name:
-        return len(name.split(' ')) - 1
-    else:
-        return 0
-
-df['loc_is_major_city'] = df.apply(location_is_major_city, axis=1)
-df['num_spacs_in_name'] = df.apply(name_has_multiple_spaces, axis=1)
-
-df2 = df.merge(data, on='name', how='left').fillna(0)
-final_table = df2[['user_age_at_post', 'loc_is_major_city', 'num_spacs_in_name', 'num_tweets']]
+final_table = build_features(df, data)
 
 
 runtime= boto3.client('runtime.sagemaker', region_name='us-west-2')
 
-# Simple function to create a csv from our numpy array
-
-def np2csv(arr):
-    return '\n'.join([','.join([str(s) for s in y ]) for y in arr])
-    # return '\n'.join([','.join([str(x) for x in y] for y in arr)])
-    # csv = io.BytesIO()
-    # np.savetxt(csv, arr, delimiter=',', fmt='%s')
-    # return csv.getvalue().decode().rstrip()
-
-# Function to generate prediction through sample data
-def do_predict(data, endpoint_name, content_type):
-    payload = np2csv(data)
-    response = runtime.invoke_endpoint(EndpointName=endpoint_name,
-                                   ContentType=content_type,
-                                   Body=payload)
-    result = response['Body'].read()
-    result = result.decode("utf-8")
-    result = result.split(',')
-    preds = [float((num)) for num in result]
-    return preds
-
-# Function to iterate through a larger data set and generate batch predictions
-def batch_predict(data, batch_size, endpoint_name, content_type):
-    items = len(data)
-    arrs = []
-    for offset in range(0, items, batch_size):
-        if offset+batch_size < items:
-            datav = data[offset:(offset+batch_size),:]
-            results = do_predict(datav, endpoint_name, content_type)
-            arrs.extend(results)
-        else:
-            datav = data[offset:items,:]
-            arrs.extend(do_predict(datav, endpoint_name, content_type))
-        sys.stdout.write('.')
-    return(arrs)
-
 endpoint_name = 'DEMO-XGBoostEndpoint-2018-11-22-16-21-28'
-results = batch_predict(final_table.values, 1000, endpoint_name, 'text/csv')
+results = SageMakerPredictor(runtime, endpoint_name).predict(final_table.values)
 
 final_table.values
 '\n'.join([','.join([str(s) for s in y ]) for y in final_table.values])
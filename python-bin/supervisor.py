@@ -0,0 +1,6 @@
+#PYTHONPATH=~/GitHub/aws_streams/python-lib/:PYTHONPATH bin/python ~/GitHub/aws_streams/python-bin/supervisor.py --keywords basketball,nba,lebron --credentials credentials.json --stats-port 8000
+
+from twitter import supervisor
+
+if __name__ == '__main__':
+    supervisor.main()
@@ -1 +1,10 @@
-from send_basketball import KinesisBasketballStreamer
+from .send_basketball import KinesisBasketballStreamer
+from .aggregation import RecordAggregator, deaggregate
+from .partitioners import (HotShardDetector, KeyPartitioner, RandomPartitioner, ShardRoundRobinPartitioner,
+                           StaticPartitioner)
+from .background_sender import BackgroundSender
+from .throttling import ShardRateLimiter, TokenBucket
+from .spool import DiskSpool, SpoolReplayer
+from .stream_metadata import StreamMetadataCache
+from .consumer import KinesisConsumer, ShardReader, SQLiteCheckpointStore
+from .fanout_consumer import FanOutConsumer
@@ -0,0 +1,258 @@
+"""
+Packs many small user records into a single Kinesis record using the KPL
+aggregated record format so consumers built on the KCL (or deaggregate below)
+can unpack them again.
+
+The format is: magic header + AggregatedRecord protobuf + MD5 of the protobuf
+
+    message AggregatedRecord {
+        repeated string partition_key_table     = 1;
+        repeated string explicit_hash_key_table = 2;
+        repeated Record records                 = 3;
+    }
+
+    message Record {
+        required uint64 partition_key_index     = 1;
+        optional uint64 explicit_hash_key_index = 2;
+        required bytes  data                    = 3;
+    }
+
+The protobuf encoding is written by hand since the message is tiny and this
+avoids shipping the protobuf library with the collector. User record data is
+bytes (see send_basketball.to_bytes), keys are text.
+
+Kinesis routes an aggregated record by its own partition key, so the producer
+keeps one aggregator per predicted shard and every aggregate carries the
+explicit hash key of its first user record. All user records in it then land
+on the shard their own keys map to.
+"""
+import hashlib
+
+from .partitioners import record_hash_key
+
+KPL_MAGIC = b'\xf3\x89\x9a\xc2'
+DIGEST_SIZE = 16
+
+# Same default as the KPL AggregationMaxSize / AggregationMaxCount settings
+__MAX_AGGREGATED_BYTES__ = 51200
+__MAX_AGGREGATED_RECORDS__ = 4294967295
+
+WIRE_VARINT = 0
+WIRE_LENGTH_DELIMITED = 2
+
+
+def varint_size(value):
+    size = 1
+    while value >= 0x80:
+        value >>= 7
+        size += 1
+    return size
+
+
+def encode_varint(value):
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def decode_varint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        b = bytearray(buf[pos:pos + 1])
+        if not b:
+            raise ValueError('Truncated varint')
+        b = b[0]
+        result |= (b & 0x7f) << shift
+        pos += 1
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def field_key(field_number, wire_type):
+    return encode_varint((field_number << 3) | wire_type)
+
+
+def length_delimited_size(payload_size):
+    # one byte for the field key (all field numbers here are < 16)
+    return 1 + varint_size(payload_size) + payload_size
+
+
+def encode_length_delimited(field_number, payload):
+    return field_key(field_number, WIRE_LENGTH_DELIMITED) + encode_varint(len(payload)) + payload
+
+
+def record_size(partition_key_index, explicit_hash_key_index, data):
+    size = 1 + varint_size(partition_key_index)
+    if explicit_hash_key_index is not None:
+        size += 1 + varint_size(explicit_hash_key_index)
+    size += length_delimited_size(len(data))
+    return size
+
+
+class RecordAggregator(object):
+    """
+    Accumulates user records until the aggregated record would exceed
+    max_bytes, at which point the finished Kinesis record is handed back to
+    the caller as a put_records entry.
+    """
+    def __init__(self, max_bytes=__MAX_AGGREGATED_BYTES__, max_records=__MAX_AGGREGATED_RECORDS__):
+        self.max_bytes = max_bytes
+        self.max_records = max_records
+        self.clear()
+
+    def clear(self):
+        self.partition_keys = []
+        self.partition_key_index = {}
+        self.explicit_hash_keys = []
+        self.explicit_hash_key_index = {}
+        self.records = []
+        self.message_size = 0
+
+    def __len__(self):
+        return len(self.records)
+
+    def size_bytes(self):
+        return len(KPL_MAGIC) + self.message_size + DIGEST_SIZE
+
+    def _size_increase(self, partition_key, explicit_hash_key, data):
+        increase = 0
+        pk_index = self.partition_key_index.get(partition_key)
+        if pk_index is None:
+            pk_index = len(self.partition_keys)
+            increase += length_delimited_size(len(partition_key.encode('utf-8')))
+        ehk_index = None
+        if explicit_hash_key is not None:
+            ehk_index = self.explicit_hash_key_index.get(explicit_hash_key)
+            if ehk_index is None:
+                ehk_index = len(self.explicit_hash_keys)
+                increase += length_delimited_size(len(explicit_hash_key.encode('utf-8')))
+        increase += length_delimited_size(record_size(pk_index, ehk_index, data))
+        return increase
+
+    def add_user_record(self, partition_key, data, explicit_hash_key=None):
+        """
+        Adds a user record. Returns a completed put_records entry when the
+        record did not fit into the current aggregate, otherwise None.
+        """
+        completed = None
+        increase = self._size_increase(partition_key, explicit_hash_key, data)
+        if self.records and (len(KPL_MAGIC) + self.message_size + increase + DIGEST_SIZE > self.max_bytes
+                             or len(self.records) >= self.max_records):
+            completed = self.get_entry()
+            increase = self._size_increase(partition_key, explicit_hash_key, data)
+
+        pk_index = self.partition_key_index.get(partition_key)
+        if pk_index is None:
+            pk_index = len(self.partition_keys)
+            self.partition_key_index[partition_key] = pk_index
+            self.partition_keys.append(partition_key)
+        ehk_index = None
+        if explicit_hash_key is not None:
+            ehk_index = self.explicit_hash_key_index.get(explicit_hash_key)
+            if ehk_index is None:
+                ehk_index = len(self.explicit_hash_keys)
+                self.explicit_hash_key_index[explicit_hash_key] = ehk_index
+                self.explicit_hash_keys.append(explicit_hash_key)
+        self.records.append((pk_index, ehk_index, data))
+        self.message_size += increase
+        return completed
+
+    def serialize(self):
+        message = bytearray()
+        for pk in self.partition_keys:
+            message += encode_length_delimited(1, pk.encode('utf-8'))
+        for ehk in self.explicit_hash_keys:
+            message += encode_length_delimited(2, ehk.encode('utf-8'))
+        for pk_index, ehk_index, data in self.records:
+            record = field_key(1, WIRE_VARINT) + encode_varint(pk_index)
+            if ehk_index is not None:
+                record += field_key(2, WIRE_VARINT) + encode_varint(ehk_index)
+            record += encode_length_delimited(3, data)
+            message += encode_length_delimited(3, record)
+        message = bytes(message)
+        return KPL_MAGIC + message + hashlib.md5(message).digest()
+
+    def get_entry(self):
+        """
+        Returns the aggregated put_records entry and resets the aggregator.
+        A single user record is sent as-is since aggregating it only adds
+        overhead. An aggregate is sent with the first user record's hash key
+        as its explicit hash key, so it goes to the shard that record maps to.
+        """
+        if not self.records:
+            return None
+        if len(self.records) == 1:
+            pk_index, ehk_index, data = self.records[0]
+            entry = {'Data': data, 'PartitionKey': self.partition_keys[pk_index]}
+            if ehk_index is not None:
+                entry['ExplicitHashKey'] = self.explicit_hash_keys[ehk_index]
+        else:
+            pk_index, ehk_index, _ = self.records[0]
+            explicit_hash_key = self.explicit_hash_keys[ehk_index] if ehk_index is not None else None
+            entry = {'Data': self.serialize(), 'PartitionKey': self.partition_keys[pk_index],
+                     'ExplicitHashKey': str(record_hash_key(self.partition_keys[pk_index], explicit_hash_key))}
+        self.clear()
+        return entry
+
+
+def is_aggregated(data):
+    if len(data) < len(KPL_MAGIC) + DIGEST_SIZE or not data.startswith(KPL_MAGIC):
+        return False
+    message = data[len(KPL_MAGIC):-DIGEST_SIZE]
+    return hashlib.md5(message).digest() == data[-DIGEST_SIZE:]
+
+
+def _iter_fields(buf):
+    pos = 0
+    while pos < len(buf):
+        key, pos = decode_varint(buf, pos)
+        field_number, wire_type = key >> 3, key & 0x7
+        if wire_type == WIRE_VARINT:
+            value, pos = decode_varint(buf, pos)
+        elif wire_type == WIRE_LENGTH_DELIMITED:
+            length, pos = decode_varint(buf, pos)
+            value = buf[pos:pos + length]
+            pos += length
+        else:
+            raise ValueError('Unsupported wire type {}'.format(wire_type))
+        yield field_number, value
+
+
+def deaggregate(data, partition_key=None):
+    """
+    Returns a list of (partition_key, explicit_hash_key, data) tuples for a
+    Kinesis record's data. Records that are not KPL aggregated are returned
+    as a single user record.
+    """
+    if not is_aggregated(data):
+        return [(partition_key, None, data)]
+
+    message = data[len(KPL_MAGIC):-DIGEST_SIZE]
+    partition_keys = []
+    explicit_hash_keys = []
+    records = []
+    for field_number, value in _iter_fields(message):
+        if field_number == 1:
+            partition_keys.append(value.decode('utf-8'))
+        elif field_number == 2:
+            explicit_hash_keys.append(value.decode('utf-8'))
+        elif field_number == 3:
+            pk_index, ehk_index, record_data = None, None, b''
+            for record_field, record_value in _iter_fields(value):
+                if record_field == 1:
+                    pk_index = record_value
+                elif record_field == 2:
+                    ehk_index = record_value
+                elif record_field == 3:
+                    record_data = record_value
+            records.append((pk_index, ehk_index, record_data))
+
+    return [(partition_keys[pk_index],
+             explicit_hash_keys[ehk_index] if ehk_index is not None else None,
+             record_data)
+            for pk_index, ehk_index, record_data in records]
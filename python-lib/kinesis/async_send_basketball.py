@@ -0,0 +1,168 @@
+"""
+Asyncio variant of KinesisBasketballStreamer built on aiobotocore. Batches are
+sent with put_records over a pooled keep-alive connection, with up to
+max_in_flight requests outstanding at once.
+
+This module needs Python 3 and aiobotocore, so it is not imported by the
+package __init__:
+
+    from kinesis.async_send_basketball import AsyncKinesisBasketballStreamer
+
+    async with AsyncKinesisBasketballStreamer() as kbs:
+        await kbs.send_msg_to_stream('TwitterBBallUserStream', msg, partition_key=name)
+"""
+import asyncio
+import time
+
+from .partitioners import KeyPartitioner
+from .send_basketball import (__REGION__, __MAX_BATCH_RECORDS__, __MAX_BATCH_BYTES__, __MAX_RECORD_BYTES__,
+                              __MAX_LINGER_SECONDS__, __MAX_PUT_RETRIES__, to_bytes)
+from .throttling import PutRetries, failed_entries
+
+__MAX_IN_FLIGHT__ = 16
+
+
+class AsyncKinesisBasketballStreamer(object):
+    def __init__(self, max_in_flight=__MAX_IN_FLIGHT__, max_linger_secs=__MAX_LINGER_SECONDS__,
+                 partitioner=None, region_name=__REGION__):
+        self.max_in_flight = max_in_flight
+        self.max_linger_secs = max_linger_secs
+        self.region_name = region_name
+        # Partitioners that need a StreamMetadataCache use a synchronous client, so only
+        # the key based partitioners are suitable here.
+        self.partitioner = partitioner or KeyPartitioner()
+        self.client = None
+        self.client_context = None
+
+        self.stream_msgs_sent = {}
+        self.stream_msgs_failed = {}
+        self.stream_msgs_retried = {}
+        self.stream_buffers = {}
+        self.stream_buffer_bytes = {}
+        self.stream_buffer_started = {}
+        self.in_flight = set()
+        self.in_flight_slots = None
+        self.linger_task = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def start(self):
+        from aiobotocore.config import AioConfig
+        from aiobotocore.session import get_session
+
+        # One connection per in-flight request keeps every call on a pooled,
+        # kept-alive connection.
+        config = AioConfig(max_pool_connections=self.max_in_flight)
+        self.client_context = get_session().create_client('kinesis', region_name=self.region_name, config=config)
+        self.client = await self.client_context.__aenter__()
+        self.in_flight_slots = asyncio.Semaphore(self.max_in_flight)
+        self.linger_task = asyncio.ensure_future(self._flush_lingering_buffers())
+
+    async def close(self):
+        if self.linger_task is not None:
+            self.linger_task.cancel()
+            self.linger_task = None
+        await self.flush()
+        if self.client_context is not None:
+            await self.client_context.__aexit__(None, None, None)
+            self.client_context = None
+            self.client = None
+
+    def msg_sent_to_stream(self, stream_name, num_msgs=1):
+        self.stream_msgs_sent[stream_name] = self.stream_msgs_sent.get(stream_name, 0) + num_msgs
+
+    def msg_failed_for_stream(self, stream_name, num_msgs=1):
+        self.stream_msgs_failed[stream_name] = self.stream_msgs_failed.get(stream_name, 0) + num_msgs
+
+    def msg_retried_for_stream(self, stream_name, num_msgs=1):
+        self.stream_msgs_retried[stream_name] = self.stream_msgs_retried.get(stream_name, 0) + num_msgs
+
+    async def send_msg_to_stream(self, stream_name, msg, partition_key=None):
+        """
+        Buffers a message for the stream. Returns once the message is buffered,
+        waiting for an in-flight slot when a full batch has to be sent.
+        """
+        partition_key, explicit_hash_key = self.partitioner.get_partition(stream_name, msg, partition_key)
+        entry = {'Data': to_bytes(msg), 'PartitionKey': partition_key}
+        if explicit_hash_key is not None:
+            entry['ExplicitHashKey'] = explicit_hash_key
+        entry_size = len(entry['Data']) + len(partition_key)
+        if entry_size > __MAX_RECORD_BYTES__:
+            print('Dropping record of {} bytes for {}, larger than the record limit'.format(entry_size, stream_name))
+            self.msg_failed_for_stream(stream_name)
+            return
+
+        if stream_name not in self.stream_buffers:
+            self.stream_buffers[stream_name] = []
+            self.stream_buffer_bytes[stream_name] = 0
+        if self.stream_buffer_bytes[stream_name] + entry_size > __MAX_BATCH_BYTES__:
+            await self.flush_stream(stream_name)
+        if not self.stream_buffers[stream_name]:
+            self.stream_buffer_started[stream_name] = time.time()
+        self.stream_buffers[stream_name].append(entry)
+        self.stream_buffer_bytes[stream_name] += entry_size
+        if len(self.stream_buffers[stream_name]) >= __MAX_BATCH_RECORDS__:
+            await self.flush_stream(stream_name)
+
+    async def flush_stream(self, stream_name):
+        """
+        Starts sending the stream's buffered batch without waiting for the
+        response, once an in-flight slot is free.
+        """
+        entries = self.stream_buffers.get(stream_name)
+        if not entries:
+            return
+        self.stream_buffers[stream_name] = []
+        self.stream_buffer_bytes[stream_name] = 0
+        await self.in_flight_slots.acquire()
+        task = asyncio.ensure_future(self._send_batch(stream_name, entries))
+        self.in_flight.add(task)
+        task.add_done_callback(self.in_flight.discard)
+
+    async def flush(self):
+        """Sends every buffered batch and waits for all in-flight requests."""
+        for stream_name in list(self.stream_buffers.keys()):
+            await self.flush_stream(stream_name)
+        if self.in_flight:
+            await asyncio.gather(*list(self.in_flight))
+
+    async def _flush_lingering_buffers(self):
+        while True:
+            await asyncio.sleep(self.max_linger_secs / 2.0)
+            now = time.time()
+            for stream_name, entries in list(self.stream_buffers.items()):
+                if entries and now - self.stream_buffer_started[stream_name] >= self.max_linger_secs:
+                    await self.flush_stream(stream_name)
+
+    async def _send_batch(self, stream_name, entries):
+        try:
+            await self.put_records_to_stream(stream_name, entries)
+        finally:
+            self.in_flight_slots.release()
+
+    async def put_records_to_stream(self, stream_name, entries):
+        retries = PutRetries(entries, max_retries=__MAX_PUT_RETRIES__)
+        while retries.entries:
+            entries = retries.entries
+            try:
+                response = await self.client.put_records(StreamName=stream_name, Records=entries)
+            except Exception as e:
+                print(e)
+                failed = entries
+            else:
+                failed = failed_entries(entries, response)
+                self.msg_sent_to_stream(stream_name, len(entries) - len(failed))
+
+            delay = retries.next_delay(failed)
+            if delay is not None:
+                self.msg_retried_for_stream(stream_name, len(failed))
+                await asyncio.sleep(delay)
+        if retries.given_up:
+            print('Dropping {} records for {} after {} attempts'.format(
+                len(retries.given_up), stream_name, retries.attempt + 1))
+            self.msg_failed_for_stream(stream_name, len(retries.given_up))
@@ -0,0 +1,196 @@
+"""
+Decouples producing messages from delivering them to Kinesis. Messages are put
+on a bounded queue and a pool of worker threads sends them with a
+KinesisBasketballStreamer, so a slow stream never blocks the producer thread.
+"""
+import base64
+import json
+import os
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+BLOCK = 'block'
+DROP_OLDEST = 'drop_oldest'
+SPILL = 'spill'
+BACKPRESSURE_POLICIES = (BLOCK, DROP_OLDEST, SPILL)
+
+__QUEUE_SIZE__ = 10000
+__NUM_WORKERS__ = 2
+__SPILL_PATH__ = 'kinesis_spill.jsonl'
+__POLL_SECONDS__ = 0.5
+
+
+def spill_line(item):
+    """
+    One JSON line per queued message. Bytes messages (the collector's records)
+    are base64 encoded so any payload survives the round trip.
+    """
+    stream_name, msg, partition_key = item
+    if isinstance(msg, bytes):
+        msg, encoding = base64.b64encode(msg).decode('ascii'), 'base64'
+    else:
+        encoding = 'text'
+    return json.dumps({'stream_name': stream_name, 'msg': msg, 'encoding': encoding,
+                       'partition_key': partition_key}) + '\n'
+
+
+def parse_spill_line(line):
+    """The (stream_name, msg, partition_key) item written by spill_line."""
+    entry = json.loads(line)
+    msg = entry['msg']
+    if entry['encoding'] == 'base64':
+        msg = base64.b64decode(msg)
+    return entry['stream_name'], msg, entry['partition_key']
+
+
+class BackgroundSender(object):
+    def __init__(self, kbs, num_workers=__NUM_WORKERS__, queue_size=__QUEUE_SIZE__,
+                 backpressure=BLOCK, spill_path=__SPILL_PATH__):
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError('Unknown backpressure policy: {}. Expected one of {}'.format(
+                backpressure, ', '.join(BACKPRESSURE_POLICIES)))
+        self.kbs = kbs
+        self.backpressure = backpressure
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stopping = threading.Event()
+        self.counter_lock = threading.Lock()
+        self.counters = {
+            'enqueued': 0,
+            'sent': 0,
+            'send_errors': 0,
+            'dropped': 0,
+            'spilled': 0,
+            'unspilled': 0,
+        }
+
+        self.spill_path = spill_path
+        self.spill_lock = threading.Lock()
+        self.spill_read_offset = 0
+        self.spill_pending = 0
+
+        self.workers = []
+        for n in range(num_workers):
+            worker = threading.Thread(target=self._run_worker, name='kinesis-sender-{}'.format(n))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def _incr(self, counter, num=1):
+        with self.counter_lock:
+            self.counters[counter] += num
+
+    def stats(self):
+        with self.counter_lock:
+            stats = dict(self.counters)
+        stats['queue_depth'] = self.queue.qsize()
+        with self.spill_lock:
+            stats['spill_pending'] = self.spill_pending
+        return stats
+
+    def send_msg_to_stream(self, stream_name, msg, partition_key=None):
+        """
+        Queues a message for delivery, applying the backpressure policy when
+        the queue is full.
+        """
+        item = (stream_name, msg, partition_key)
+        if self.backpressure == BLOCK:
+            self.queue.put(item)
+        elif self.backpressure == DROP_OLDEST:
+            while True:
+                try:
+                    self.queue.put_nowait(item)
+                    break
+                except queue.Full:
+                    try:
+                        self.queue.get_nowait()
+                        self.queue.task_done()
+                        self._incr('dropped')
+                    except queue.Empty:
+                        pass
+        else:
+            # Once anything is spilled, new messages go to the spill file too so
+            # that ordering is kept until the workers have drained it. The check
+            # and the enqueue happen under spill_lock so they can't interleave
+            # with _unspill moving older messages back onto the queue.
+            with self.spill_lock:
+                if self.spill_pending:
+                    self._spill(item)
+                else:
+                    try:
+                        self.queue.put_nowait(item)
+                    except queue.Full:
+                        self._spill(item)
+        self._incr('enqueued')
+
+    def _spill(self, item):
+        # Caller holds spill_lock
+        with open(self.spill_path, 'a') as f:
+            f.write(spill_line(item))
+        self.spill_pending += 1
+        self._incr('spilled')
+
+    def _unspill(self):
+        """
+        Moves spilled messages back onto the queue while it has room. The file
+        is truncated once it has been read to the end.
+        """
+        with self.spill_lock:
+            if not self.spill_pending:
+                return
+            room = self.queue.maxsize - self.queue.qsize()
+            if room <= 0:
+                return
+            moved = 0
+            with open(self.spill_path, 'r') as f:
+                f.seek(self.spill_read_offset)
+                while moved < room:
+                    line = f.readline()
+                    if not line:
+                        break
+                    try:
+                        self.queue.put_nowait(parse_spill_line(line))
+                    except queue.Full:
+                        break
+                    self.spill_read_offset = f.tell()
+                    moved += 1
+            self.spill_pending -= moved
+            if not self.spill_pending:
+                os.remove(self.spill_path)
+                self.spill_read_offset = 0
+        self._incr('unspilled', moved)
+
+    def _run_worker(self):
+        while True:
+            # Unlocked read is only a hint, _unspill checks again under the lock
+            if self.spill_pending and self.queue.qsize() < self.queue.maxsize // 2:
+                self._unspill()
+            try:
+                stream_name, msg, partition_key = self.queue.get(timeout=__POLL_SECONDS__)
+            except queue.Empty:
+                if self.stopping.is_set():
+                    with self.spill_lock:
+                        if not self.spill_pending:
+                            return
+                continue
+            try:
+                self.kbs.send_msg_to_stream(stream_name, msg, partition_key=partition_key)
+                self._incr('sent')
+            except Exception as e:
+                print('Error sending message to {}: {}'.format(stream_name, e))
+                self._incr('send_errors')
+            finally:
+                self.queue.task_done()
+
+    def close(self):
+        """
+        Waits for the queue (and any spilled messages) to drain, stops the
+        workers and flushes the underlying streamer.
+        """
+        self.stopping.set()
+        for worker in self.workers:
+            worker.join()
+        self.kbs.close()
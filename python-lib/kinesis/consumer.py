@@ -0,0 +1,275 @@
+"""
+Reads a Kinesis stream with one worker per shard and checkpoints progress so a
+restarted consumer continues where it stopped.
+
+    def score_users(shard_id, records):
+        for record in records:
+            user = json.loads(record['data'])
+            ...
+
+    consumer = KinesisConsumer('TwitterBBallUserStream', score_users)
+    consumer.run()
+
+The processor is called with batches of de-aggregated user records; once it
+returns, the batch's sequence number is checkpointed (delivery is
+at-least-once). Shards are only read once their parents are finished, so
+records for a key stay in order across shard splits and merges.
+"""
+import sqlite3
+import threading
+import time
+from concurrent import futures
+
+import boto3
+
+from .aggregation import deaggregate
+from .stream_metadata import StreamMetadataCache
+from .throttling import backoff_delay, is_throttling_error
+
+__CHECKPOINT_DB__ = 'kinesis_checkpoints.db'
+__GET_RECORDS_LIMIT__ = 10000
+# GetRecords allows 5 calls per second per shard
+__MIN_POLL_SECONDS__ = 0.2
+__MAX_POLL_SECONDS__ = 5.0
+__SHARD_SYNC_SECONDS__ = 30
+
+TRIM_HORIZON = 'TRIM_HORIZON'
+LATEST = 'LATEST'
+SHARD_END = 'SHARD_END'
+
+
+class SQLiteCheckpointStore(object):
+    """
+    Stores the last processed sequence number per shard in a local SQLite
+    file. Connections are opened per thread (and per process), so the store
+    can be shared by every shard worker.
+    """
+    def __init__(self, path=__CHECKPOINT_DB__):
+        self.path = path
+        self.local = threading.local()
+        self._connection().execute('''
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                stream_name TEXT NOT NULL,
+                shard_id TEXT NOT NULL,
+                sequence_number TEXT NOT NULL,
+                updated REAL NOT NULL,
+                PRIMARY KEY (stream_name, shard_id)
+            )
+        ''')
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self.local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self.local.connection = connection
+        return connection
+
+    def get_checkpoint(self, stream_name, shard_id):
+        row = self._connection().execute(
+            'SELECT sequence_number FROM checkpoints WHERE stream_name = ? AND shard_id = ?',
+            (stream_name, shard_id)).fetchone()
+        return row[0] if row else None
+
+    def set_checkpoint(self, stream_name, shard_id, sequence_number):
+        self._connection().execute(
+            'INSERT OR REPLACE INTO checkpoints (stream_name, shard_id, sequence_number, updated) VALUES (?, ?, ?, ?)',
+            (stream_name, shard_id, sequence_number, time.time()))
+
+    def is_finished(self, stream_name, shard_id):
+        return self.get_checkpoint(stream_name, shard_id) == SHARD_END
+
+
+def user_records(shard_id, records):
+    """Converts Kinesis records into de-aggregated user records for the processor."""
+    results = []
+    for record in records:
+        for partition_key, explicit_hash_key, data in deaggregate(record['Data'], record['PartitionKey']):
+            results.append({
+                'shard_id': shard_id,
+                'partition_key': partition_key,
+                'sequence_number': record['SequenceNumber'],
+                'arrival_timestamp': record.get('ApproximateArrivalTimestamp'),
+                'data': data,
+            })
+    return results
+
+
+class ShardReader(object):
+    """
+    Reads a single shard from its checkpoint until the shard is closed or
+    stop_event is set. Polling backs off while the shard is idle and speeds up
+    while the reader is behind the tip of the stream.
+    """
+    def __init__(self, stream_name, shard_id, processor, checkpoint_store, stop_event,
+                 initial_position=TRIM_HORIZON, region_name='us-west-2', client=None):
+        self.stream_name = stream_name
+        self.shard_id = shard_id
+        self.processor = processor
+        self.checkpoint_store = checkpoint_store
+        self.stop_event = stop_event
+        self.initial_position = initial_position
+        self.client = client or boto3.client('kinesis', region_name=region_name)
+        self.millis_behind_latest = None
+        self.records_processed = 0
+
+    def get_iterator(self):
+        checkpoint = self.checkpoint_store.get_checkpoint(self.stream_name, self.shard_id)
+        if checkpoint:
+            return self.client.get_shard_iterator(StreamName=self.stream_name,
+                                                  ShardId=self.shard_id,
+                                                  ShardIteratorType='AFTER_SEQUENCE_NUMBER',
+                                                  StartingSequenceNumber=checkpoint)['ShardIterator']
+        return self.client.get_shard_iterator(StreamName=self.stream_name,
+                                              ShardId=self.shard_id,
+                                              ShardIteratorType=self.initial_position)['ShardIterator']
+
+    def run(self):
+        if self.checkpoint_store.is_finished(self.stream_name, self.shard_id):
+            return self.shard_id
+        iterator = self.get_iterator()
+        poll_secs = __MIN_POLL_SECONDS__
+        attempt = 0
+        while iterator and not self.stop_event.is_set():
+            started = time.time()
+            try:
+                response = self.client.get_records(ShardIterator=iterator, Limit=__GET_RECORDS_LIMIT__)
+            except Exception as e:
+                code = (getattr(e, 'response', None) or {}).get('Error', {}).get('Code')
+                if code == 'ExpiredIteratorException':
+                    iterator = self.get_iterator()
+                    continue
+                if not is_throttling_error(e):
+                    raise
+                time.sleep(backoff_delay(attempt))
+                attempt += 1
+                continue
+            attempt = 0
+
+            records = response['Records']
+            if records:
+                self.processor(self.shard_id, user_records(self.shard_id, records))
+                self.records_processed += len(records)
+                self.checkpoint_store.set_checkpoint(self.stream_name, self.shard_id,
+                                                     records[-1]['SequenceNumber'])
+            iterator = response.get('NextShardIterator')
+            self.millis_behind_latest = response.get('MillisBehindLatest')
+
+            # Read as fast as allowed while behind, back off while idle
+            if records or self.millis_behind_latest:
+                poll_secs = __MIN_POLL_SECONDS__
+            else:
+                poll_secs = min(__MAX_POLL_SECONDS__, poll_secs * 2)
+            self.stop_event.wait(max(0, poll_secs - (time.time() - started)))
+
+        if not iterator:
+            # The shard was closed by a split or merge and is fully read
+            self.checkpoint_store.set_checkpoint(self.stream_name, self.shard_id, SHARD_END)
+        return self.shard_id
+
+
+def readable_shards(stream_name, stream_metadata, checkpoint_store):
+    """
+    Returns the shards that can be read now: not finished, and with every
+    parent that still exists in the stream already finished.
+    """
+    shards = stream_metadata.get(stream_name, refresh=True)['shards']
+    shard_ids = set(s['ShardId'] for s in shards)
+    readable = []
+    for shard in shards:
+        if checkpoint_store.is_finished(stream_name, shard['ShardId']):
+            continue
+        parents = [shard.get('ParentShardId'), shard.get('AdjacentParentShardId')]
+        if all(p is None or p not in shard_ids or checkpoint_store.is_finished(stream_name, p) for p in parents):
+            readable.append(shard['ShardId'])
+    return readable
+
+
+def shard_initial_position(stream_name, shard, checkpoint_store, initial_position):
+    """
+    Where to start a shard that has no checkpoint. Like the KCL, children of
+    shards this consumer finished start at TRIM_HORIZON, since with LATEST the
+    records written to them before their reader started would be skipped.
+    """
+    parents = [shard.get('ParentShardId'), shard.get('AdjacentParentShardId')]
+    if any(p is not None and checkpoint_store.is_finished(stream_name, p) for p in parents):
+        return TRIM_HORIZON
+    return initial_position
+
+
+def read_shard(stream_name, shard_id, processor, checkpoint_store, stop_event, initial_position, region_name):
+    # Module level so it can be pickled for a process pool
+    reader = ShardReader(stream_name, shard_id, processor, checkpoint_store, stop_event,
+                         initial_position=initial_position, region_name=region_name)
+    return reader.run()
+
+
+class KinesisConsumer(object):
+    """
+    Runs a ShardReader for every readable shard on a thread pool, or a process
+    pool when use_processes is set (the processor and checkpoint store must
+    then be picklable). max_workers should be at least the number of open
+    shards since each worker holds on to its shard.
+    """
+    def __init__(self, stream_name, processor, checkpoint_store=None, max_workers=8, use_processes=False,
+                 initial_position=TRIM_HORIZON, region_name='us-west-2'):
+        self.stream_name = stream_name
+        self.processor = processor
+        self.checkpoint_store = checkpoint_store or SQLiteCheckpointStore()
+        self.max_workers = max_workers
+        self.use_processes = use_processes
+        self.initial_position = initial_position
+        self.region_name = region_name
+        self.stream_metadata = StreamMetadataCache(boto3.client('kinesis', region_name=region_name),
+                                                   background_refresh=False)
+        if use_processes:
+            import multiprocessing
+            self.manager = multiprocessing.Manager()
+            self.stop_event = self.manager.Event()
+        else:
+            self.stop_event = threading.Event()
+        self.running = {}
+
+    def readable_shards(self):
+        return readable_shards(self.stream_name, self.stream_metadata, self.checkpoint_store)
+
+    def initial_position_for(self, shard_id):
+        shards = dict((s['ShardId'], s) for s in self.stream_metadata.get_all_shards(self.stream_name))
+        return shard_initial_position(self.stream_name, shards.get(shard_id, {}), self.checkpoint_store,
+                                      self.initial_position)
+
+    def run(self):
+        """Reads the stream until stop() is called or every shard is closed."""
+        if self.use_processes:
+            executor = futures.ProcessPoolExecutor(max_workers=self.max_workers)
+        else:
+            executor = futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            while not self.stop_event.is_set():
+                for shard_id in self.readable_shards():
+                    if shard_id not in self.running:
+                        self.running[shard_id] = executor.submit(
+                            read_shard, self.stream_name, shard_id, self.processor, self.checkpoint_store,
+                            self.stop_event, self.initial_position_for(shard_id), self.region_name)
+                if not self.running:
+                    break
+                done, _ = futures.wait(list(self.running.values()), timeout=__SHARD_SYNC_SECONDS__,
+                                       return_when=futures.FIRST_COMPLETED)
+                for shard_id, future in list(self.running.items()):
+                    if future in done:
+                        del self.running[shard_id]
+                        if future.exception() is not None:
+                            print('Reader for shard {} failed: {}'.format(shard_id, future.exception()))
+                            self.stop_event.wait(__MAX_POLL_SECONDS__)
+        finally:
+            self.stop_event.set()
+            executor.shutdown(wait=True)
+
+    def stop(self):
+        self.stop_event.set()
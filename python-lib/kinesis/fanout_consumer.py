@@ -0,0 +1,158 @@
+"""
+Enhanced fan-out consumer. Instead of polling GetRecords, each shard gets a
+SubscribeToShard HTTP/2 push stream with its own 2 MB/s of read throughput, so
+records arrive as soon as they are written. A subscription lasts at most five
+minutes, after which it is renewed from the last continuation sequence number.
+
+    consumer = FanOutConsumer('TwitterBBallUserStream', 'user-scorer', score_users)
+    consumer.run()
+
+Records are de-aggregated and checkpointed the same way as KinesisConsumer, and
+MillisBehindLatest is tracked per shard in shard_lag().
+"""
+import threading
+import time
+
+import boto3
+
+from .consumer import (SHARD_END, SQLiteCheckpointStore, TRIM_HORIZON, readable_shards, shard_initial_position,
+                       user_records)
+from .stream_metadata import StreamMetadataCache
+from .throttling import backoff_delay, is_throttling_error
+
+__CONSUMER_POLL_SECONDS__ = 2
+__SHARD_SYNC_SECONDS__ = 30
+
+
+class FanOutConsumer(object):
+    def __init__(self, stream_name, consumer_name, processor, checkpoint_store=None,
+                 initial_position=TRIM_HORIZON, region_name='us-west-2'):
+        self.stream_name = stream_name
+        self.consumer_name = consumer_name
+        self.processor = processor
+        self.checkpoint_store = checkpoint_store or SQLiteCheckpointStore()
+        self.initial_position = initial_position
+        self.client = boto3.client('kinesis', region_name=region_name)
+        self.stream_metadata = StreamMetadataCache(self.client, background_refresh=False)
+        self.stop_event = threading.Event()
+        self.consumer_arn = None
+        self.shard_threads = {}
+        self.lag_lock = threading.Lock()
+        self.shard_millis_behind = {}
+
+    def register(self):
+        """
+        Registers the stream consumer (or reuses an existing registration) and
+        waits until it is ACTIVE.
+        """
+        stream_arn = self.client.describe_stream_summary(
+            StreamName=self.stream_name)['StreamDescriptionSummary']['StreamARN']
+        try:
+            consumer = self.client.register_stream_consumer(StreamARN=stream_arn, ConsumerName=self.consumer_name)
+            consumer = consumer['Consumer']
+        except Exception as e:
+            code = (getattr(e, 'response', None) or {}).get('Error', {}).get('Code')
+            if code != 'ResourceInUseException':
+                raise
+            consumer = self.client.describe_stream_consumer(
+                StreamARN=stream_arn, ConsumerName=self.consumer_name)['ConsumerDescription']
+        while consumer['ConsumerStatus'] != 'ACTIVE':
+            time.sleep(__CONSUMER_POLL_SECONDS__)
+            consumer = self.client.describe_stream_consumer(
+                ConsumerARN=consumer['ConsumerARN'])['ConsumerDescription']
+        self.consumer_arn = consumer['ConsumerARN']
+        return self.consumer_arn
+
+    def deregister(self):
+        if self.consumer_arn is not None:
+            self.client.deregister_stream_consumer(ConsumerARN=self.consumer_arn)
+            self.consumer_arn = None
+
+    def shard_lag(self):
+        """Returns the latest MillisBehindLatest reported for each shard."""
+        with self.lag_lock:
+            return dict(self.shard_millis_behind)
+
+    def starting_position(self, shard_id):
+        checkpoint = self.checkpoint_store.get_checkpoint(self.stream_name, shard_id)
+        if checkpoint:
+            return {'Type': 'AFTER_SEQUENCE_NUMBER', 'SequenceNumber': checkpoint}
+        shards = dict((s['ShardId'], s) for s in self.stream_metadata.get_all_shards(self.stream_name))
+        return {'Type': shard_initial_position(self.stream_name, shards.get(shard_id, {}), self.checkpoint_store,
+                                               self.initial_position)}
+
+    def subscribe(self, shard_id, starting_position):
+        """
+        Reads one subscription until it expires. Returns the continuation
+        sequence number, SHARD_END once the shard is closed, or None if the
+        subscription ended before delivering any events.
+        """
+        response = self.client.subscribe_to_shard(ConsumerARN=self.consumer_arn,
+                                                  ShardId=shard_id,
+                                                  StartingPosition=starting_position)
+        continuation = None
+        for event in response['EventStream']:
+            if self.stop_event.is_set():
+                break
+            shard_event = event.get('SubscribeToShardEvent')
+            if shard_event is None:
+                continue
+            records = shard_event['Records']
+            if records:
+                self.processor(shard_id, user_records(shard_id, records))
+                self.checkpoint_store.set_checkpoint(self.stream_name, shard_id, records[-1]['SequenceNumber'])
+            with self.lag_lock:
+                self.shard_millis_behind[shard_id] = shard_event['MillisBehindLatest']
+            continuation = shard_event.get('ContinuationSequenceNumber')
+            if continuation is None:
+                return SHARD_END
+        return continuation
+
+    def read_shard(self, shard_id):
+        starting_position = self.starting_position(shard_id)
+        attempt = 0
+        while not self.stop_event.is_set():
+            try:
+                continuation = self.subscribe(shard_id, starting_position)
+            except Exception as e:
+                code = (getattr(e, 'response', None) or {}).get('Error', {}).get('Code')
+                # ResourceInUse: the previous subscription is still winding down
+                if not is_throttling_error(e) and code != 'ResourceInUseException':
+                    print('Subscription to shard {} failed: {}'.format(shard_id, e))
+                time.sleep(backoff_delay(attempt))
+                attempt += 1
+                starting_position = self.starting_position(shard_id)
+                continue
+            attempt = 0
+            if continuation == SHARD_END:
+                self.checkpoint_store.set_checkpoint(self.stream_name, shard_id, SHARD_END)
+                return
+            # No events, resubscribe from the same position
+            if continuation is None:
+                continue
+            # Subscriptions expire after 5 minutes, resubscribe from where this one ended
+            starting_position = {'Type': 'AFTER_SEQUENCE_NUMBER', 'SequenceNumber': continuation}
+
+    def readable_shards(self):
+        return readable_shards(self.stream_name, self.stream_metadata, self.checkpoint_store)
+
+    def run(self):
+        """Subscribes to every readable shard until stop() is called."""
+        if self.consumer_arn is None:
+            self.register()
+        while not self.stop_event.is_set():
+            for shard_id, thread in list(self.shard_threads.items()):
+                if not thread.is_alive():
+                    del self.shard_threads[shard_id]
+            for shard_id in self.readable_shards():
+                if shard_id not in self.shard_threads:
+                    thread = threading.Thread(target=self.read_shard, args=(shard_id,))
+                    thread.daemon = True
+                    thread.start()
+                    self.shard_threads[shard_id] = thread
+            self.stop_event.wait(__SHARD_SYNC_SECONDS__)
+        for thread in self.shard_threads.values():
+            thread.join()
+
+    def stop(self):
+        self.stop_event.set()
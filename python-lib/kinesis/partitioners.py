@@ -0,0 +1,117 @@
+"""
+Partitioners decide which shard a record lands on. Kinesis maps a record to
+the shard whose hash key range contains MD5(partition key), or the explicit
+hash key when one is given.
+
+Every partitioner implements get_partition(stream_name, msg, partition_key)
+and returns a (partition_key, explicit_hash_key) tuple where the explicit hash
+key may be None. Partitioners that need the shard map take a
+StreamMetadataCache.
+"""
+import hashlib
+import threading
+import uuid
+
+__MAX_PARTITION_KEY_LENGTH__ = 256
+
+
+def partition_key_hash(partition_key):
+    return int(hashlib.md5(partition_key.encode('utf-8')).hexdigest(), 16)
+
+
+def record_hash_key(partition_key, explicit_hash_key=None):
+    if explicit_hash_key is not None:
+        return int(explicit_hash_key)
+    return partition_key_hash(partition_key)
+
+
+class StaticPartitioner(object):
+    """Sends every record with the same partition key."""
+    def __init__(self, partition_key='partition1'):
+        self.partition_key = partition_key
+
+    def get_partition(self, stream_name, msg, partition_key=None):
+        return self.partition_key, None
+
+
+class RandomPartitioner(object):
+    """Spreads records uniformly over the shards with a random partition key."""
+    def get_partition(self, stream_name, msg, partition_key=None):
+        return uuid.uuid4().hex, None
+
+
+class KeyPartitioner(object):
+    """
+    Uses the key supplied by the caller (e.g. the user name) so all records for
+    a key stay ordered on one shard. Kinesis hashes the key with MD5, so no
+    additional hashing is needed. Records without a key are sent randomly.
+    """
+    def __init__(self):
+        self.random_partitioner = RandomPartitioner()
+
+    def get_partition(self, stream_name, msg, partition_key=None):
+        if not partition_key:
+            return self.random_partitioner.get_partition(stream_name, msg)
+        return partition_key[:__MAX_PARTITION_KEY_LENGTH__], None
+
+
+class ShardRoundRobinPartitioner(object):
+    """
+    Cycles through the open shards of a stream using each shard's starting
+    hash key as the explicit hash key, which gives an exactly even spread
+    regardless of the partition keys.
+    """
+    def __init__(self, stream_metadata):
+        self.stream_metadata = stream_metadata
+        self.stream_positions = {}
+        self.lock = threading.Lock()
+
+    def get_partition(self, stream_name, msg, partition_key=None):
+        shards = self.stream_metadata.get_shards(stream_name)
+        with self.lock:
+            position = self.stream_positions.get(stream_name, 0)
+            self.stream_positions[stream_name] = position + 1
+        shard = shards[position % len(shards)]
+        return partition_key or shard['ShardId'], shard['HashKeyRange']['StartingHashKey']
+
+
+class HotShardDetector(object):
+    """
+    Counts the records each shard receives so skewed partition keys can be
+    spotted. Skew is the busiest shard's count divided by the mean count.
+    """
+    def __init__(self, stream_metadata):
+        self.stream_metadata = stream_metadata
+        self.stream_shard_counts = {}
+        self.lock = threading.Lock()
+
+    def record(self, stream_name, partition_key, explicit_hash_key=None, num_records=1):
+        try:
+            shard_id = self.stream_metadata.shard_for_hash(stream_name, record_hash_key(partition_key, explicit_hash_key))
+        except Exception as e:
+            print('Unable to map record to a shard for {}: {}'.format(stream_name, e))
+            return
+        with self.lock:
+            counts = self.stream_shard_counts.setdefault(stream_name, {})
+            counts[shard_id] = counts.get(shard_id, 0) + num_records
+
+    def skew(self, stream_name):
+        shards = self.stream_metadata.get_shards(stream_name)
+        with self.lock:
+            counts = dict(self.stream_shard_counts.get(stream_name, {}))
+        total = sum(counts.values())
+        if not total:
+            return 0.0
+        mean = float(total) / len(shards)
+        return max(counts.values()) / mean
+
+    def report(self, skew_threshold=1.5):
+        report = {}
+        for stream_name in list(self.stream_shard_counts.keys()):
+            skew = self.skew(stream_name)
+            report[stream_name] = {
+                'shard_counts': dict(self.stream_shard_counts[stream_name]),
+                'skew': skew,
+                'hot': skew >= skew_threshold,
+            }
+        return report
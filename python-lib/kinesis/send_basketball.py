@@ -1,32 +1,93 @@
 
 import time
+import threading
 import boto3
 
+from .aggregation import RecordAggregator
+from .partitioners import HotShardDetector, KeyPartitioner, record_hash_key
+from .spool import SpoolReplayer
+from .stream_metadata import StreamMetadataCache
+from .throttling import THROTTLED_ERROR_CODES, PutRetries, ShardRateLimiter, is_throttling_error
+
 __STREAM_NAME__ = 'dog_stream'
 __REGION__ = 'us-west-2'
 __NUM_SHARDS__ = 3
 
+# PutRecords API limits
+__MAX_BATCH_RECORDS__ = 500
+__MAX_BATCH_BYTES__ = 5 * 1024 * 1024
+__MAX_RECORD_BYTES__ = 1024 * 1024
+
+__MAX_LINGER_SECONDS__ = 1.0
+__MAX_PUT_RETRIES__ = 5
+
+
+def to_bytes(msg):
+    if isinstance(msg, bytes):
+        return msg
+    return msg.encode('utf-8')
+
+
 class KinesisBasketballStreamer(object):
-    def __init__(self):
+    def __init__(self, buffered=False, max_linger_secs=__MAX_LINGER_SECONDS__, aggregate=False,
+                 partitioner=None, detect_hot_shards=False, rate_limit=False, spool=None):
         self.client = boto3.client(
             'kinesis',
             region_name='us-west-2'
         )
         self.stream_msgs_sent = {}
 
-    def get_stream_status(self, stream_name):
-        return self.client.describe_stream(StreamName=stream_name)['StreamDescription']['StreamStatus']
+        self.stream_metadata = StreamMetadataCache(self.client)
+        self.partitioner = partitioner or KeyPartitioner()
+        self.hot_shard_detector = HotShardDetector(self.stream_metadata) if detect_hot_shards else None
+        # Paces writes to each shard's 1 MB/s and 1000 records/s limits,
+        # backing off a shard's rate whenever it throttles.
+        self.rate_limiter = ShardRateLimiter() if rate_limit else None
+        self.stream_msgs_retried = {}
+
+        # Records that can't be delivered are written to the optional disk
+        # spool instead of being dropped, and replayed once the stream recovers.
+        self.spool = spool
+        self.stream_msgs_spooled = {}
+        self.replayer = None
+        if spool is not None:
+            self.replayer = SpoolReplayer(self, spool, batch_records=__MAX_BATCH_RECORDS__,
+                                          batch_bytes=__MAX_BATCH_BYTES__).start()
+
+        # When buffered, messages are accumulated per stream and sent through
+        # put_records once a batch is full or has lingered for max_linger_secs.
+        # Aggregation packs many user records into each Kinesis record (KPL
+        # format) and is only available on top of the buffered mode. There is
+        # one aggregator per predicted shard so records keep their shard.
+        self.aggregate = aggregate
+        self.buffered = buffered or aggregate
+        self.stream_aggregators = {}
+        self.stream_user_records_aggregated = {}
+        self.max_linger_secs = max_linger_secs
+        self.stream_buffers = {}
+        self.stream_buffer_bytes = {}
+        self.stream_buffer_started = {}
+        self.stream_msgs_failed = {}
+        self.buffer_lock = threading.RLock()
+        self.closed = threading.Event()
+        if self.buffered:
+            self.linger_thread = threading.Thread(target=self._flush_lingering_buffers)
+            self.linger_thread.daemon = True
+            self.linger_thread.start()
 
-    def wait_for_stream(stream_name):
+    def get_stream_status(self, stream_name, refresh=False):
+        return self.stream_metadata.get_stream_status(stream_name, refresh)
+
+    def wait_for_stream(self, stream_name):
         SLEEP_TIME_SECONDS = 3
-        status = self.get_stream_status(stream_name)
+        status = self.get_stream_status(stream_name, refresh=True)
         while status != 'ACTIVE':
             print('{stream_name} has status: {status}, sleeping for {secs} seconds'.format(
                     stream_name = stream_name,
                     status      = status,
                     secs        = SLEEP_TIME_SECONDS))
             time.sleep(SLEEP_TIME_SECONDS) # sleep for 3 seconds
-            status = self.get_stream_status(stream_name)
+            status = self.get_stream_status(stream_name, refresh=True)
         print('{} is active.'.format(stream_name))
 
     def is_stream_active(self, stream_name):
@@ -37,34 +98,283 @@ class KinesisBasketballStreamer(object):
             if self.is_stream_active(stream_name):
                 pass
             else:
-                print('Stream does not exist')
-        except:
-            pass
+                print('Stream {} is not active'.format(stream_name))
+        except Exception as e:
+            print('Unable to check status of stream {}: {}'.format(stream_name, e))
             # self.client.create_stream(StreamName=stream_name, ShardCount=__NUM_SHARDS__)
-            # while not self.is_stream_active(stream_name):
-            #     print('Stream not yet active. Sleeping for 5 seconds.')
-            #     time.sleep(5)
-            # print('Stream active.')
+            # self.wait_for_stream(stream_name)
 
-    def msg_sent_to_stream(self, stream_name):
+    def msg_sent_to_stream(self, stream_name, num_msgs=1):
         if stream_name not in self.stream_msgs_sent.keys():
             self.stream_msgs_sent[stream_name] = 0
-        self.stream_msgs_sent[stream_name] += 1
+        self.stream_msgs_sent[stream_name] += num_msgs
+
+    def msg_failed_for_stream(self, stream_name, num_msgs=1):
+        if stream_name not in self.stream_msgs_failed.keys():
+            self.stream_msgs_failed[stream_name] = 0
+        self.stream_msgs_failed[stream_name] += num_msgs
+
+    def get_entry(self, stream_name, msg, partition_key=None):
+        partition_key, explicit_hash_key = self.partitioner.get_partition(stream_name, msg, partition_key)
+        if self.hot_shard_detector is not None:
+            self.hot_shard_detector.record(stream_name, partition_key, explicit_hash_key)
+        entry = {'Data': to_bytes(msg), 'PartitionKey': partition_key}
+        if explicit_hash_key is not None:
+            entry['ExplicitHashKey'] = explicit_hash_key
+        return entry
+
+    def msg_retried_for_stream(self, stream_name, num_msgs=1):
+        if stream_name not in self.stream_msgs_retried.keys():
+            self.stream_msgs_retried[stream_name] = 0
+        self.stream_msgs_retried[stream_name] += num_msgs
+
+    def msg_spooled_for_stream(self, stream_name, num_msgs=1):
+        if stream_name not in self.stream_msgs_spooled.keys():
+            self.stream_msgs_spooled[stream_name] = 0
+        self.stream_msgs_spooled[stream_name] += num_msgs
+
+    def undeliverable_for_stream(self, stream_name, entries, spool_failures=True):
+        """
+        Spools entries that could not be delivered when a spool is configured,
+        otherwise they are dropped.
+        """
+        rejected = len(entries)
+        if self.spool is not None and spool_failures:
+            rejected = self.spool.append(stream_name, entries)
+            self.msg_spooled_for_stream(stream_name, len(entries) - rejected)
+        if rejected:
+            print('Dropping {} records for {}'.format(rejected, stream_name))
+            self.msg_failed_for_stream(stream_name, rejected)
+
+    def get_stats(self):
+        stats = {
+            'sent': dict(self.stream_msgs_sent),
+            'retried': dict(self.stream_msgs_retried),
+            'dropped': dict(self.stream_msgs_failed),
+            'spooled': dict(self.stream_msgs_spooled),
+        }
+        if self.replayer is not None:
+            stats['replayed'] = self.replayer.records_replayed
+        if self.rate_limiter is not None:
+            stats['shard_rate_factors'] = self.rate_limiter.rate_factors()
+        return stats
+
+    def send_msg_to_stream(self, stream_name, msg, partition_key=None):
+        entry = self.get_entry(stream_name, msg, partition_key)
+        if self.buffered:
+            self.buffer_msg_for_stream(stream_name, entry)
+        else:
+            self.put_msg_to_stream(stream_name, entry)
+
+    def buffer_msg_for_stream(self, stream_name, entry):
+        data = entry['Data']
+        entry_size = len(data) + len(entry['PartitionKey'])
+        if entry_size > __MAX_RECORD_BYTES__:
+            print('Dropping record of {} bytes for {}, larger than the record limit'.format(entry_size, stream_name))
+            self.msg_failed_for_stream(stream_name)
+            return
+
+        if not self.aggregate:
+            self.buffer_entry_for_stream(stream_name, entry, entry_size)
+            return
+
+        shard_id = self.predict_shard(stream_name, entry)
+        with self.buffer_lock:
+            if stream_name not in self.stream_aggregators:
+                self.stream_aggregators[stream_name] = {}
+                self.stream_user_records_aggregated[stream_name] = 0
+            if not self._has_aggregated(stream_name) and not self.stream_buffers.get(stream_name):
+                self.stream_buffer_started[stream_name] = time.time()
+            aggregator = self.stream_aggregators[stream_name].setdefault(shard_id, RecordAggregator())
+            completed = aggregator.add_user_record(entry['PartitionKey'], data, entry.get('ExplicitHashKey'))
+            self.stream_user_records_aggregated[stream_name] += 1
+            batches = self._buffer_entry(stream_name, completed) if completed is not None else []
+        self._send_batches(stream_name, batches)
 
-    def send_msg_to_stream(self, stream_name, msg):
+    def buffer_entry_for_stream(self, stream_name, entry, entry_size=None):
+        with self.buffer_lock:
+            batches = self._buffer_entry(stream_name, entry, entry_size)
+        self._send_batches(stream_name, batches)
+
+    def _buffer_entry(self, stream_name, entry, entry_size=None):
+        """
+        Adds the entry to the stream's buffer and returns the batches that
+        became full, which the caller sends once it has released buffer_lock.
+        """
+        if entry_size is None:
+            entry_size = len(entry['Data']) + len(entry['PartitionKey'])
+        if stream_name not in self.stream_buffers:
+            self.stream_buffers[stream_name] = []
+            self.stream_buffer_bytes[stream_name] = 0
+        batches = []
+        if self.stream_buffer_bytes[stream_name] + entry_size > __MAX_BATCH_BYTES__:
+            batches.append(self._take_batch(stream_name))
+        if not self.stream_buffers[stream_name] and not self._has_aggregated(stream_name):
+            self.stream_buffer_started[stream_name] = time.time()
+        self.stream_buffers[stream_name].append(entry)
+        self.stream_buffer_bytes[stream_name] += entry_size
+        if len(self.stream_buffers[stream_name]) >= __MAX_BATCH_RECORDS__:
+            batches.append(self._take_batch(stream_name))
+        return [batch for batch in batches if batch]
+
+    def _has_aggregated(self, stream_name):
+        return any(self.stream_aggregators.get(stream_name, {}).values())
+
+    def _take_batch(self, stream_name):
+        entries = self.stream_buffers.get(stream_name)
+        self.stream_buffers[stream_name] = []
+        self.stream_buffer_bytes[stream_name] = 0
+        return entries
+
+    def _send_batches(self, stream_name, batches):
+        # Called without buffer_lock so a slow or throttled put_records only
+        # blocks the thread that filled the batch, not every producer.
+        for entries in batches:
+            self.put_records_to_stream(stream_name, entries)
+
+    def flush_stream(self, stream_name):
+        with self.buffer_lock:
+            batches = []
+            for aggregator in self.stream_aggregators.get(stream_name, {}).values():
+                if aggregator:
+                    batches.extend(self._buffer_entry(stream_name, aggregator.get_entry()))
+            if self.stream_buffers.get(stream_name):
+                batches.append(self._take_batch(stream_name))
+        self._send_batches(stream_name, batches)
+
+    def flush(self):
+        with self.buffer_lock:
+            stream_names = set(self.stream_buffers.keys()) | set(self.stream_aggregators.keys())
+        for stream_name in stream_names:
+            self.flush_stream(stream_name)
+
+    def close(self):
+        self.closed.set()
+        self.stream_metadata.close()
+        if self.replayer is not None:
+            self.replayer.stop()
+        self.flush()
+        if self.spool is not None:
+            self.spool.flush()
+
+    def _flush_lingering_buffers(self):
+        while not self.closed.wait(self.max_linger_secs / 2.0):
+            now = time.time()
+            with self.buffer_lock:
+                pending = [s for s, entries in self.stream_buffers.items() if entries]
+                pending += [s for s in self.stream_aggregators if self._has_aggregated(s)]
+                lingering = set(s for s in pending
+                                if now - self.stream_buffer_started[s] >= self.max_linger_secs)
+            for stream_name in lingering:
+                self.flush_stream(stream_name)
+
+    def predict_shard(self, stream_name, entry):
         try:
-            if stream_name not in self.stream_msgs_sent.keys():
-                print('checking status')
-                # The line below will fail if the stream is not already created
-                # print(self.get_stream_status(stream_name))
-                self.check_or_create_stream(stream_name)
-
-            self.client.put_record(
-                    StreamName=stream_name,
-                    Data=msg,
-                    PartitionKey='partition1'
-            )
-            self.msg_sent_to_stream(stream_name)
+            return self.stream_metadata.shard_for_hash(
+                stream_name, record_hash_key(entry['PartitionKey'], entry.get('ExplicitHashKey')))
+        except Exception as e:
+            # Without a shard map records are aggregated per stream, and each
+            # aggregate goes to the shard of its first record
+            print('Unable to map record to a shard for {}: {}'.format(stream_name, e))
+            return None
 
+    def get_entry_shards(self, stream_name, entries):
+        try:
+            return [self.stream_metadata.shard_for_hash(stream_name,
+                                                  record_hash_key(entry['PartitionKey'], entry.get('ExplicitHashKey')))
+                    for entry in entries]
         except Exception as e:
-            print(e)
+            # Without a shard map the whole stream is limited as a single shard
+            print('Unable to map records to shards for {}: {}'.format(stream_name, e))
+            return [stream_name] * len(entries)
+
+    def acquire_shard_capacity(self, shard_ids, entries):
+        shard_usage = {}
+        for shard_id, entry in zip(shard_ids, entries):
+            num_records, num_bytes = shard_usage.get(shard_id, (0, 0))
+            shard_usage[shard_id] = (num_records + 1, num_bytes + len(entry['Data']) + len(entry['PartitionKey']))
+        self.rate_limiter.acquire(shard_usage)
+
+    def put_records_to_stream(self, stream_name, entries, spool_failures=True):
+        """
+        Sends a batch of entries with put_records and retries only the entries
+        that failed in the response, backing off with jitter between attempts.
+        Returns the entries that could not be delivered.
+        """
+        if stream_name not in self.stream_msgs_sent.keys():
+            self.check_or_create_stream(stream_name)
+            self.msg_sent_to_stream(stream_name, 0)
+
+        retries = PutRetries(entries, max_retries=__MAX_PUT_RETRIES__)
+        while retries.entries:
+            entries = retries.entries
+            shard_ids = None
+            if self.rate_limiter is not None:
+                shard_ids = self.get_entry_shards(stream_name, entries)
+                self.acquire_shard_capacity(shard_ids, entries)
+            try:
+                response = self.client.put_records(StreamName=stream_name, Records=entries)
+            except Exception as e:
+                print(e)
+                failed = entries
+                if shard_ids is not None and is_throttling_error(e):
+                    # The whole request was throttled, slow down every shard in it
+                    for shard_id in set(shard_ids):
+                        self.rate_limiter.on_throttled(shard_id)
+            else:
+                failed = []
+                throttled_shards = set()
+                for i, (entry, result) in enumerate(zip(entries, response['Records'])):
+                    if 'ErrorCode' in result:
+                        failed.append(entry)
+                        if shard_ids is not None and result['ErrorCode'] in THROTTLED_ERROR_CODES:
+                            throttled_shards.add(shard_ids[i])
+                self.msg_sent_to_stream(stream_name, len(entries) - len(failed))
+                if shard_ids is not None:
+                    for shard_id in throttled_shards:
+                        self.rate_limiter.on_throttled(shard_id)
+                    for shard_id in set(shard_ids) - throttled_shards:
+                        self.rate_limiter.on_success(shard_id)
+
+            delay = retries.next_delay(failed)
+            if delay is not None:
+                self.msg_retried_for_stream(stream_name, len(failed))
+                time.sleep(delay)
+        if retries.given_up:
+            print('{} records for {} failed after {} attempts'.format(
+                len(retries.given_up), stream_name, retries.attempt + 1))
+            self.undeliverable_for_stream(stream_name, retries.given_up, spool_failures)
+        return retries.given_up
+
+    def put_msg_to_stream(self, stream_name, entry):
+        if stream_name not in self.stream_msgs_sent.keys():
+            print('checking status')
+            # The line below will fail if the stream is not already created
+            # print(self.get_stream_status(stream_name))
+            self.check_or_create_stream(stream_name)
+
+        shard_ids = self.get_entry_shards(stream_name, [entry]) if self.rate_limiter is not None else None
+        retries = PutRetries([entry], max_retries=__MAX_PUT_RETRIES__)
+        while retries.entries:
+            if shard_ids is not None:
+                self.acquire_shard_capacity(shard_ids, [entry])
+            try:
+                self.client.put_record(
+                        StreamName=stream_name,
+                        **entry
+                )
+                self.msg_sent_to_stream(stream_name)
+                if shard_ids is not None:
+                    self.rate_limiter.on_success(shard_ids[0])
+                return
+            except Exception as e:
+                if shard_ids is not None and is_throttling_error(e):
+                    self.rate_limiter.on_throttled(shard_ids[0])
+                # Throttled records are retried, anything else is spooled or dropped
+                delay = retries.next_delay([entry]) if is_throttling_error(e) else None
+                if delay is None:
+                    print(e)
+                    self.undeliverable_for_stream(stream_name, [entry])
+                    return
+                self.msg_retried_for_stream(stream_name)
+                time.sleep(delay)
@@ -0,0 +1,296 @@
+"""
+Durable local spool for records that could not be delivered to Kinesis.
+
+Records are appended to fixed size, memory-mapped segment files and a replayer
+sends them back to their streams once Kinesis recovers. Each record is framed
+as
+
+    [length uint32][crc32 uint32][payload]
+
+where the payload holds the stream name, partition key, explicit hash key and
+data, each prefixed with its uint32 length. Segments are preallocated with
+zeros, so a zero length marks the end of the written data and a torn write
+after a crash is detected by its CRC. The reader's position is kept in an
+offsets file that is replaced atomically on every commit, so a crash replays
+at most the last uncommitted batch (delivery is at-least-once).
+"""
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+__SEGMENT_BYTES__ = 64 * 1024 * 1024
+__MAX_SPOOL_BYTES__ = 1024 * 1024 * 1024
+# PutRecords request limits, KinesisBasketballStreamer passes its own
+__REPLAY_BATCH_RECORDS__ = 500
+__REPLAY_BATCH_BYTES__ = 5 * 1024 * 1024
+__REPLAY_INTERVAL_SECONDS__ = 5
+
+FRAME_HEADER = struct.Struct('>II')
+FIELD_LENGTH = struct.Struct('>I')
+SEGMENT_FORMAT = 'segment-{:020d}.log'
+OFFSETS_FILE = 'offsets'
+
+
+def encode_record(stream_name, entry):
+    fields = [stream_name.encode('utf-8'),
+              entry['PartitionKey'].encode('utf-8'),
+              entry.get('ExplicitHashKey', '').encode('utf-8'),
+              entry['Data']]
+    payload = b''.join(FIELD_LENGTH.pack(len(f)) + f for f in fields)
+    return FRAME_HEADER.pack(len(payload), zlib.crc32(payload) & 0xffffffff) + payload
+
+
+def entry_size(entry):
+    # Counted the same way as the put_records batches in send_basketball
+    return len(entry['Data']) + len(entry['PartitionKey'])
+
+
+def decode_payload(payload):
+    fields = []
+    pos = 0
+    while pos < len(payload):
+        (length,) = FIELD_LENGTH.unpack_from(payload, pos)
+        pos += FIELD_LENGTH.size
+        fields.append(payload[pos:pos + length])
+        pos += length
+    stream_name, partition_key, explicit_hash_key, data = fields
+    entry = {'Data': bytes(data), 'PartitionKey': partition_key.decode('utf-8')}
+    if explicit_hash_key:
+        entry['ExplicitHashKey'] = explicit_hash_key.decode('utf-8')
+    return stream_name.decode('utf-8'), entry
+
+
+class Segment(object):
+    def __init__(self, path, size):
+        self.path = path
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.truncate(size)
+        self.file = open(path, 'r+b')
+        self.size = os.path.getsize(path)
+        self.mmap = mmap.mmap(self.file.fileno(), self.size)
+
+    def read_frame(self, offset):
+        """Returns (payload, next_offset), or (None, offset) at the end of the data."""
+        if offset + FRAME_HEADER.size > self.size:
+            return None, offset
+        length, crc = FRAME_HEADER.unpack_from(self.mmap, offset)
+        end = offset + FRAME_HEADER.size + length
+        if length == 0 or end > self.size:
+            return None, offset
+        payload = self.mmap[offset + FRAME_HEADER.size:end]
+        if zlib.crc32(payload) & 0xffffffff != crc:
+            return None, offset
+        return payload, end
+
+    def scan_end(self, offset=0):
+        payload, next_offset = self.read_frame(offset)
+        while payload is not None:
+            offset = next_offset
+            payload, next_offset = self.read_frame(offset)
+        return offset
+
+    def write(self, offset, frame):
+        self.mmap[offset:offset + len(frame)] = frame
+
+    def flush(self):
+        self.mmap.flush()
+
+    def close(self):
+        self.mmap.flush()
+        self.mmap.close()
+        self.file.close()
+
+
+class DiskSpool(object):
+    def __init__(self, directory, segment_bytes=__SEGMENT_BYTES__, max_bytes=__MAX_SPOOL_BYTES__):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_segments = max(2, max_bytes // segment_bytes)
+        self.lock = threading.RLock()
+        self.segments = {}
+        self.records_spooled = 0
+        self.records_rejected = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._recover()
+
+    def _segment_path(self, segment_id):
+        return os.path.join(self.directory, SEGMENT_FORMAT.format(segment_id))
+
+    def _segment(self, segment_id):
+        if segment_id not in self.segments:
+            self.segments[segment_id] = Segment(self._segment_path(segment_id), self.segment_bytes)
+        return self.segments[segment_id]
+
+    def _segment_ids(self):
+        return sorted(int(f[len('segment-'):-len('.log')]) for f in os.listdir(self.directory)
+                      if f.startswith('segment-') and f.endswith('.log'))
+
+    def _recover(self):
+        self.read_segment, self.read_offset = self._load_offsets()
+        segment_ids = [s for s in self._segment_ids() if s >= self.read_segment]
+        for segment_id in self._segment_ids():
+            if segment_id < self.read_segment:
+                os.remove(self._segment_path(segment_id))
+        if not segment_ids:
+            self.write_segment, self.write_offset = self.read_segment, self.read_offset
+        else:
+            self.write_segment = segment_ids[-1]
+            self.write_offset = self._segment(self.write_segment).scan_end(
+                self.read_offset if self.write_segment == self.read_segment else 0)
+
+    def _load_offsets(self):
+        path = os.path.join(self.directory, OFFSETS_FILE)
+        if not os.path.exists(path):
+            return 0, 0
+        with open(path) as f:
+            segment_id, offset = f.read().split()
+        return int(segment_id), int(offset)
+
+    def _store_offsets(self, segment_id, offset):
+        path = os.path.join(self.directory, OFFSETS_FILE)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write('{} {}'.format(segment_id, offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, path)
+
+    def append(self, stream_name, entries):
+        """
+        Appends entries for a stream. Returns the number of entries that were
+        rejected because the spool is full.
+        """
+        rejected = 0
+        with self.lock:
+            for entry in entries:
+                frame = encode_record(stream_name, entry)
+                if len(frame) > self.segment_bytes:
+                    rejected += 1
+                    continue
+                if self.write_offset + len(frame) > self.segment_bytes:
+                    if self.write_segment - self.read_segment + 1 >= self.max_segments:
+                        rejected += 1
+                        continue
+                    self._segment(self.write_segment).flush()
+                    self.write_segment += 1
+                    self.write_offset = 0
+                self._segment(self.write_segment).write(self.write_offset, frame)
+                self.write_offset += len(frame)
+            self.records_spooled += len(entries) - rejected
+            self.records_rejected += rejected
+        if rejected:
+            print('Spool at {} is full, rejected {} records'.format(self.directory, rejected))
+        return rejected
+
+    def is_empty(self):
+        with self.lock:
+            return (self.read_segment, self.read_offset) == (self.write_segment, self.write_offset)
+
+    def read_batch(self, max_records=__REPLAY_BATCH_RECORDS__, max_bytes=__REPLAY_BATCH_BYTES__):
+        """
+        Returns ([(stream_name, entry), ...], position) starting at the
+        committed read position, with at most max_records entries and
+        max_bytes of data (but always at least one entry). Pass position to
+        commit once delivered.
+        """
+        records = []
+        batch_bytes = 0
+        with self.lock:
+            segment_id, offset = self.read_segment, self.read_offset
+            while len(records) < max_records:
+                if segment_id > self.write_segment:
+                    break
+                payload, next_offset = self._segment(segment_id).read_frame(offset)
+                if payload is None:
+                    if segment_id == self.write_segment:
+                        break
+                    segment_id, offset = segment_id + 1, 0
+                    continue
+                stream_name, entry = decode_payload(payload)
+                if records and batch_bytes + entry_size(entry) > max_bytes:
+                    break
+                records.append((stream_name, entry))
+                batch_bytes += entry_size(entry)
+                offset = next_offset
+        return records, (segment_id, offset)
+
+    def commit(self, position):
+        """Persists the read position and deletes fully consumed segments."""
+        segment_id, offset = position
+        with self.lock:
+            for segment in self.segments.values():
+                segment.flush()
+            self._store_offsets(segment_id, offset)
+            for consumed in range(self.read_segment, segment_id):
+                segment = self.segments.pop(consumed, None)
+                if segment is not None:
+                    segment.close()
+                if os.path.exists(self._segment_path(consumed)):
+                    os.remove(self._segment_path(consumed))
+            self.read_segment, self.read_offset = segment_id, offset
+
+    def flush(self):
+        with self.lock:
+            for segment in self.segments.values():
+                segment.flush()
+
+    def close(self):
+        with self.lock:
+            for segment in self.segments.values():
+                segment.close()
+            self.segments = {}
+
+
+class SpoolReplayer(object):
+    """
+    Drains a DiskSpool back into Kinesis in large batches. A batch is only
+    committed once every record in it was delivered, otherwise it is retried
+    on the next pass.
+    """
+    def __init__(self, kbs, spool, interval_secs=__REPLAY_INTERVAL_SECONDS__,
+                 batch_records=__REPLAY_BATCH_RECORDS__, batch_bytes=__REPLAY_BATCH_BYTES__):
+        self.kbs = kbs
+        self.spool = spool
+        self.interval_secs = interval_secs
+        self.batch_records = batch_records
+        self.batch_bytes = batch_bytes
+        self.records_replayed = 0
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def replay_batch(self):
+        """Replays one batch. Returns True when the batch was fully delivered."""
+        records, position = self.spool.read_batch(self.batch_records, self.batch_bytes)
+        if not records:
+            # Skip past the unused tail of a rotated segment
+            if not self.spool.is_empty():
+                self.spool.commit(position)
+            return False
+        stream_entries = {}
+        for stream_name, entry in records:
+            stream_entries.setdefault(stream_name, []).append(entry)
+        for stream_name, entries in stream_entries.items():
+            failed = self.kbs.put_records_to_stream(stream_name, entries, spool_failures=False)
+            if failed:
+                return False
+        self.spool.commit(position)
+        self.records_replayed += len(records)
+        return True
+
+    def _run(self):
+        while not self.stopping.is_set():
+            if self.spool.is_empty() or not self.replay_batch():
+                self.stopping.wait(self.interval_secs)
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
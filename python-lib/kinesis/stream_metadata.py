@@ -0,0 +1,157 @@
+"""
+Caches stream status and shard maps so producers don't hit the Kinesis control
+plane on every send. DescribeStreamSummary and ListShards are tightly rate
+limited per account, so entries are refreshed in the background before they
+expire (with jitter, so many producers restarted together spread their calls)
+and throttled control plane calls are retried with backoff. Threads that miss
+the cache together share a single refresh.
+"""
+import bisect
+import random
+import threading
+import time
+
+from .throttling import backoff_delay, is_throttling_error
+
+__METADATA_TTL_SECONDS__ = 60
+__MAX_DESCRIBE_RETRIES__ = 5
+
+READABLE_STATUSES = ('ACTIVE', 'UPDATING')
+
+
+class PendingRefresh(object):
+    """A refresh in progress that other threads wait on instead of repeating it."""
+    def __init__(self):
+        self.done = threading.Event()
+        self.metadata = None
+        self.error = None
+
+
+class StreamMetadataCache(object):
+    def __init__(self, client, ttl_secs=__METADATA_TTL_SECONDS__, background_refresh=True):
+        self.client = client
+        self.ttl_secs = ttl_secs
+        self.background_refresh = background_refresh
+        self.streams = {}
+        self.pending_refreshes = {}
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.refresh_thread = None
+
+    def list_shards(self, stream_name):
+        shards = []
+        response = self.client.list_shards(StreamName=stream_name)
+        shards.extend(response['Shards'])
+        while response.get('NextToken'):
+            response = self.client.list_shards(NextToken=response['NextToken'])
+            shards.extend(response['Shards'])
+        return shards
+
+    def describe(self, stream_name):
+        """
+        Fetches the stream's status and open shards, retrying when the control
+        plane throttles.
+        """
+        attempt = 0
+        while True:
+            try:
+                summary = self.client.describe_stream_summary(StreamName=stream_name)['StreamDescriptionSummary']
+                status = summary['StreamStatus']
+                shards = self.list_shards(stream_name) if status in READABLE_STATUSES else []
+                break
+            except Exception as e:
+                if not is_throttling_error(e) or attempt >= __MAX_DESCRIBE_RETRIES__:
+                    raise
+                time.sleep(backoff_delay(attempt))
+                attempt += 1
+
+        # Closed shards (from splits and merges) have an ending sequence number
+        # and no longer accept writes.
+        open_shards = sorted([s for s in shards if 'EndingSequenceNumber' not in s['SequenceNumberRange']],
+                             key=lambda s: int(s['HashKeyRange']['StartingHashKey']))
+        return {
+            'status': status,
+            'shards': shards,
+            'open_shards': open_shards,
+            'shard_starts': [int(s['HashKeyRange']['StartingHashKey']) for s in open_shards],
+            'fetched': time.time(),
+        }
+
+    def refresh(self, stream_name):
+        with self.lock:
+            pending = self.pending_refreshes.get(stream_name)
+            leader = pending is None
+            if leader:
+                pending = self.pending_refreshes[stream_name] = PendingRefresh()
+        if not leader:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.metadata
+
+        try:
+            pending.metadata = self.describe(stream_name)
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self.lock:
+                if pending.metadata is not None:
+                    self.streams[stream_name] = pending.metadata
+                del self.pending_refreshes[stream_name]
+            pending.done.set()
+        return pending.metadata
+
+    def get(self, stream_name, refresh=False):
+        self._start_refresh_thread()
+        with self.lock:
+            metadata = self.streams.get(stream_name)
+        if refresh or metadata is None or time.time() - metadata['fetched'] >= self.ttl_secs:
+            try:
+                metadata = self.refresh(stream_name)
+            except Exception as e:
+                # Serve stale metadata rather than failing the caller
+                if metadata is None or refresh:
+                    raise
+                print('Unable to refresh metadata for {}, using cached: {}'.format(stream_name, e))
+        return metadata
+
+    def get_stream_status(self, stream_name, refresh=False):
+        return self.get(stream_name, refresh)['status']
+
+    def get_shards(self, stream_name):
+        """Returns the open shards of the stream, sorted by hash key range."""
+        return self.get(stream_name)['open_shards']
+
+    def get_all_shards(self, stream_name):
+        """Returns every shard of the stream, including closed parents."""
+        return self.get(stream_name)['shards']
+
+    def shard_for_hash(self, stream_name, hash_key):
+        metadata = self.get(stream_name)
+        index = bisect.bisect_right(metadata['shard_starts'], hash_key) - 1
+        return metadata['open_shards'][max(index, 0)]['ShardId']
+
+    def _start_refresh_thread(self):
+        if not self.background_refresh or self.refresh_thread is not None:
+            return
+        with self.lock:
+            if self.refresh_thread is None:
+                self.refresh_thread = threading.Thread(target=self._refresh_stale_streams)
+                self.refresh_thread.daemon = True
+                self.refresh_thread.start()
+
+    def _refresh_stale_streams(self):
+        while not self.stopping.wait(self.ttl_secs * random.uniform(0.25, 0.5)):
+            now = time.time()
+            with self.lock:
+                stale = [s for s, metadata in self.streams.items()
+                         if now - metadata['fetched'] >= self.ttl_secs / 2.0]
+            for stream_name in stale:
+                try:
+                    self.refresh(stream_name)
+                except Exception as e:
+                    print('Unable to refresh metadata for {}: {}'.format(stream_name, e))
+
+    def close(self):
+        self.stopping.set()
@@ -0,0 +1,153 @@
+"""
+Client side rate limiting for Kinesis writes. Each shard accepts up to
+1 MB/s and 1000 records/s; anything above that is rejected with
+ProvisionedThroughputExceededException. ShardRateLimiter keeps a pair of token
+buckets per shard and adapts their rate AIMD style: the rate is halved when a
+shard throttles and recovers additively on success.
+"""
+import random
+import threading
+import time
+
+__SHARD_RECORDS_PER_SECOND__ = 1000
+__SHARD_BYTES_PER_SECOND__ = 1024 * 1024
+
+__MIN_RATE_FACTOR__ = 0.1
+__RATE_DECREASE_FACTOR__ = 0.5
+__RATE_INCREASE_STEP__ = 0.05
+
+__BACKOFF_BASE_SECONDS__ = 0.1
+__BACKOFF_MAX_SECONDS__ = 5.0
+__MAX_RETRIES__ = 5
+
+THROTTLED_ERROR_CODES = ('ProvisionedThroughputExceededException', 'ThrottlingException',
+                         'LimitExceededException')
+
+
+def backoff_delay(attempt, base=__BACKOFF_BASE_SECONDS__, cap=__BACKOFF_MAX_SECONDS__):
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def is_throttling_error(e):
+    response = getattr(e, 'response', None) or {}
+    return response.get('Error', {}).get('Code') in THROTTLED_ERROR_CODES
+
+
+def failed_entries(entries, response):
+    """The entries of a put_records request whose result has an ErrorCode."""
+    return [entry for entry, result in zip(entries, response['Records']) if 'ErrorCode' in result]
+
+
+class PutRetries(object):
+    """
+    The retry loop shared by the Kinesis writers, sync and asyncio alike:
+
+        retries = PutRetries(entries)
+        while retries.entries:
+            failed = ...send retries.entries...
+            delay = retries.next_delay(failed)
+            if delay is not None:
+                time.sleep(delay)
+
+    next_delay returns None once nothing failed or the retries are used up,
+    in which case the entries that were given up on are in retries.given_up.
+    """
+    def __init__(self, entries, max_retries=__MAX_RETRIES__, base=__BACKOFF_BASE_SECONDS__,
+                 cap=__BACKOFF_MAX_SECONDS__):
+        self.entries = entries
+        self.max_retries = max_retries
+        self.base = base
+        self.cap = cap
+        self.attempt = 0
+        self.given_up = []
+
+    def next_delay(self, failed):
+        if failed and self.attempt >= self.max_retries:
+            self.given_up = failed
+            failed = []
+        self.entries = failed
+        if not failed:
+            return None
+        delay = backoff_delay(self.attempt, self.base, self.cap)
+        self.attempt += 1
+        return delay
+
+
+class TokenBucket(object):
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.tokens = self.capacity
+        self.updated = time.time()
+
+    def refill(self):
+        now = time.time()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, amount):
+        """
+        Takes amount tokens and returns how long the caller must wait before
+        they are actually available. Requests larger than the capacity are
+        allowed to drive the bucket negative so they are never starved.
+        """
+        self.refill()
+        self.tokens -= amount
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+
+class ShardRateLimiter(object):
+    def __init__(self, records_per_second=__SHARD_RECORDS_PER_SECOND__,
+                 bytes_per_second=__SHARD_BYTES_PER_SECOND__):
+        self.records_per_second = records_per_second
+        self.bytes_per_second = bytes_per_second
+        self.shard_buckets = {}
+        self.shard_rate_factors = {}
+        self.lock = threading.Lock()
+
+    def _buckets(self, shard_id):
+        if shard_id not in self.shard_buckets:
+            self.shard_buckets[shard_id] = (TokenBucket(self.records_per_second),
+                                            TokenBucket(self.bytes_per_second))
+            self.shard_rate_factors[shard_id] = 1.0
+        return self.shard_buckets[shard_id]
+
+    def _set_rate_factor(self, shard_id, factor):
+        record_bucket, byte_bucket = self._buckets(shard_id)
+        self.shard_rate_factors[shard_id] = factor
+        record_bucket.rate = self.records_per_second * factor
+        byte_bucket.rate = self.bytes_per_second * factor
+
+    def acquire(self, shard_usage):
+        """
+        Blocks until every shard in shard_usage, a dict of
+        shard_id -> (num_records, num_bytes), has capacity for the batch.
+        """
+        with self.lock:
+            wait = 0.0
+            for shard_id, (num_records, num_bytes) in shard_usage.items():
+                record_bucket, byte_bucket = self._buckets(shard_id)
+                wait = max(wait, record_bucket.take(num_records), byte_bucket.take(num_bytes))
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def on_throttled(self, shard_id):
+        with self.lock:
+            self._buckets(shard_id)
+            factor = max(__MIN_RATE_FACTOR__, self.shard_rate_factors[shard_id] * __RATE_DECREASE_FACTOR__)
+            self._set_rate_factor(shard_id, factor)
+
+    def on_success(self, shard_id):
+        with self.lock:
+            self._buckets(shard_id)
+            factor = self.shard_rate_factors[shard_id]
+            if factor < 1.0:
+                self._set_rate_factor(shard_id, min(1.0, factor + __RATE_INCREASE_STEP__))
+
+    def rate_factors(self):
+        with self.lock:
+            return dict(self.shard_rate_factors)
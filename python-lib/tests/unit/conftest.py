@@ -0,0 +1,27 @@
+import pytest
+
+from kinesis import send_basketball
+
+from .fakes import FakeKinesisClient
+
+
+@pytest.fixture()
+def kinesis_client():
+    return FakeKinesisClient()
+
+
+@pytest.fixture()
+def make_streamer(monkeypatch, kinesis_client):
+    """Builds KinesisBasketballStreamers that talk to kinesis_client."""
+    monkeypatch.setattr(send_basketball.boto3, 'client', lambda *args, **kwargs: kinesis_client)
+    streamers = []
+
+    def make(**kwargs):
+        streamer = send_basketball.KinesisBasketballStreamer(**kwargs)
+        streamers.append(streamer)
+        return streamer
+
+    yield make
+    for streamer in streamers:
+        streamer.closed.set()
+        streamer.stream_metadata.close()
@@ -0,0 +1,59 @@
+import threading
+
+MAX_HASH_KEY = 2 ** 128 - 1
+
+
+def make_shard(shard_id, start, end):
+    return {
+        'ShardId': shard_id,
+        'HashKeyRange': {'StartingHashKey': str(start), 'EndingHashKey': str(end)},
+        'SequenceNumberRange': {'StartingSequenceNumber': '0'},
+    }
+
+
+class ClientError(Exception):
+    """Looks like a botocore ClientError to is_throttling_error."""
+    def __init__(self, code):
+        super(ClientError, self).__init__(code)
+        self.response = {'Error': {'Code': code}}
+
+
+class FakeKinesisClient(object):
+    """
+    Records the put_records/put_record calls it receives. put_records_errors and
+    put_record_errors are exceptions raised by the next calls, before any succeed.
+    """
+    def __init__(self, num_shards=1):
+        width = (MAX_HASH_KEY + 1) // num_shards
+        self.shards = [make_shard('shardId-{:012d}'.format(i), i * width,
+                                  MAX_HASH_KEY if i == num_shards - 1 else (i + 1) * width - 1)
+                       for i in range(num_shards)]
+        self.put_records_calls = []
+        self.put_record_calls = []
+        self.put_records_errors = []
+        self.put_record_errors = []
+        self.on_put_records = None
+        self.lock = threading.Lock()
+
+    def describe_stream_summary(self, StreamName):
+        return {'StreamDescriptionSummary': {'StreamName': StreamName, 'StreamStatus': 'ACTIVE'}}
+
+    def list_shards(self, StreamName=None, NextToken=None):
+        return {'Shards': self.shards}
+
+    def put_records(self, StreamName, Records):
+        if self.on_put_records is not None:
+            self.on_put_records(StreamName, Records)
+        with self.lock:
+            self.put_records_calls.append((StreamName, list(Records)))
+            if self.put_records_errors:
+                raise self.put_records_errors.pop(0)
+        return {'FailedRecordCount': 0,
+                'Records': [{'SequenceNumber': '1', 'ShardId': 'shardId-000000000000'} for _ in Records]}
+
+    def put_record(self, StreamName, **entry):
+        with self.lock:
+            self.put_record_calls.append((StreamName, entry))
+            if self.put_record_errors:
+                raise self.put_record_errors.pop(0)
+        return {'SequenceNumber': '1', 'ShardId': 'shardId-000000000000'}
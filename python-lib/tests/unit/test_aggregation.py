@@ -0,0 +1,76 @@
+from kinesis import aggregation
+from kinesis.partitioners import record_hash_key
+
+from .fakes import FakeKinesisClient
+
+
+def test_round_trip():
+    aggregator = aggregation.RecordAggregator()
+    records = [('user{}'.format(i % 3), None, '{{"n": {}}}\n'.format(i).encode('utf-8')) for i in range(10)]
+    records.append(('user0', '12345', b'explicit'))
+    for partition_key, explicit_hash_key, data in records:
+        assert aggregator.add_user_record(partition_key, data, explicit_hash_key) is None
+
+    entry = aggregator.get_entry()
+    assert aggregation.is_aggregated(entry['Data'])
+    assert aggregation.deaggregate(entry['Data'], entry['PartitionKey']) == records
+    assert not aggregator
+
+
+def test_size_bytes_matches_serialized_size():
+    aggregator = aggregation.RecordAggregator()
+    for i in range(200):
+        aggregator.add_user_record('key{}'.format(i % 7), b'x' * (i % 50))
+    assert aggregator.size_bytes() == len(aggregator.serialize())
+
+
+def test_aggregates_stay_within_max_bytes():
+    aggregator = aggregation.RecordAggregator()
+    records = [('user{}'.format(i), None, b'x' * 900) for i in range(200)]
+    entries = []
+    for partition_key, explicit_hash_key, data in records:
+        completed = aggregator.add_user_record(partition_key, data)
+        if completed is not None:
+            entries.append(completed)
+    entries.append(aggregator.get_entry())
+
+    assert len(entries) > 1
+    assert all(len(entry['Data']) <= aggregation.__MAX_AGGREGATED_BYTES__ for entry in entries)
+    unpacked = [r for entry in entries for r in aggregation.deaggregate(entry['Data'], entry['PartitionKey'])]
+    assert unpacked == records
+
+
+def test_single_record_is_not_aggregated():
+    aggregator = aggregation.RecordAggregator()
+    aggregator.add_user_record('user', b'data')
+    entry = aggregator.get_entry()
+    assert entry == {'Data': b'data', 'PartitionKey': 'user'}
+    assert aggregation.deaggregate(entry['Data'], 'user') == [('user', None, b'data')]
+
+
+def test_aggregate_is_routed_by_its_first_record():
+    aggregator = aggregation.RecordAggregator()
+    aggregator.add_user_record('first', b'a')
+    aggregator.add_user_record('second', b'b')
+    entry = aggregator.get_entry()
+    assert int(entry['ExplicitHashKey']) == record_hash_key('first')
+
+
+def test_producer_aggregates_per_shard(make_streamer, kinesis_client):
+    kinesis_client.shards = FakeKinesisClient(num_shards=4).shards
+    streamer = make_streamer(aggregate=True, max_linger_secs=60)
+    names = ['user{}'.format(i) for i in range(100)]
+    for name in names:
+        streamer.send_msg_to_stream('stream', name, name)
+    streamer.flush()
+
+    metadata = streamer.stream_metadata
+    records = [r for _, batch in kinesis_client.put_records_calls for r in batch]
+    assert len(records) == 4
+    for record in records:
+        shard_id = metadata.shard_for_hash('stream', record_hash_key(record['PartitionKey'],
+                                                                     record.get('ExplicitHashKey')))
+        user_records = aggregation.deaggregate(record['Data'], record['PartitionKey'])
+        assert all(metadata.shard_for_hash('stream', record_hash_key(pk)) == shard_id for pk, _, _ in user_records)
+    assert sorted(data.decode('utf-8') for record in records
+                  for _, _, data in aggregation.deaggregate(record['Data'])) == sorted(names)
@@ -0,0 +1,85 @@
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from kinesis.background_sender import SPILL, BackgroundSender, parse_spill_line, spill_line
+
+
+class RecordingStreamer(object):
+    def __init__(self):
+        self.sent = []
+
+    def send_msg_to_stream(self, stream_name, msg, partition_key=None):
+        self.sent.append((stream_name, msg, partition_key))
+
+    def close(self):
+        pass
+
+
+def drain(sender):
+    items = []
+    while True:
+        try:
+            items.append(sender.queue.get_nowait())
+        except queue.Empty:
+            return items
+        sender.queue.task_done()
+
+
+def test_spilled_messages_keep_their_order(tmp_path):
+    sender = BackgroundSender(RecordingStreamer(), num_workers=0, queue_size=2, backpressure=SPILL,
+                              spill_path=str(tmp_path / 'spill.jsonl'))
+    for i in range(5):
+        sender.send_msg_to_stream('stream', 'msg {}'.format(i), 'user{}'.format(i))
+    assert sender.stats()['spill_pending'] == 3
+
+    received = drain(sender)
+    sender._unspill()
+    # Still spilling until the file is drained, so this goes behind msg 4
+    sender.send_msg_to_stream('stream', 'msg 5', 'user5')
+    received += drain(sender)
+    sender._unspill()
+    received += drain(sender)
+
+    assert [msg for _, msg, _ in received] == ['msg {}'.format(i) for i in range(6)]
+    assert sender.stats()['spill_pending'] == 0
+    assert not (tmp_path / 'spill.jsonl').exists()
+
+
+def test_workers_deliver_everything_on_close(tmp_path):
+    streamer = RecordingStreamer()
+    sender = BackgroundSender(streamer, num_workers=1, queue_size=4, backpressure=SPILL,
+                              spill_path=str(tmp_path / 'spill.jsonl'))
+    for i in range(50):
+        sender.send_msg_to_stream('stream', 'msg {}'.format(i), 'user{}'.format(i))
+    sender.close()
+
+    assert [msg for _, msg, _ in streamer.sent] == ['msg {}'.format(i) for i in range(50)]
+    assert sender.stats()['sent'] == 50
+
+
+def test_spill_lines_round_trip_bytes_and_text():
+    items = [
+        ('stream', b'{"name": "fan"}\n', 'user0'),
+        ('stream', b'\xf3\x89\x9a\xc2\x00\xff', None),
+        ('stream', u'caf\xe9 text', 'user2'),
+    ]
+    for item in items:
+        line = spill_line(item)
+        assert line.endswith('\n') and '\n' not in line[:-1]
+        assert parse_spill_line(line) == item
+
+
+def test_spilled_bytes_are_unspilled_unchanged(tmp_path):
+    sender = BackgroundSender(RecordingStreamer(), num_workers=0, queue_size=1, backpressure=SPILL,
+                              spill_path=str(tmp_path / 'spill.jsonl'))
+    msgs = [b'{"name": "user0"}\n', b'\xf3\x89\x9a\xc2\x00\xff']
+    for i, msg in enumerate(msgs):
+        sender.send_msg_to_stream('stream', msg, 'user{}'.format(i))
+    assert sender.stats()['spilled'] == 1
+
+    received = drain(sender)
+    sender._unspill()
+    received += drain(sender)
+    assert received == [('stream', msgs[0], 'user0'), ('stream', msgs[1], 'user1')]
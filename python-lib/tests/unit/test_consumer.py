@@ -0,0 +1,60 @@
+import threading
+
+from kinesis import consumer
+from kinesis.consumer import LATEST, SHARD_END, TRIM_HORIZON, KinesisConsumer, SQLiteCheckpointStore
+
+from .fakes import FakeKinesisClient, make_shard
+
+
+class ReshardedClient(FakeKinesisClient):
+    """A parent shard that was split into two children."""
+    def __init__(self):
+        super(ReshardedClient, self).__init__()
+        parent = make_shard('shardId-parent', 0, 99)
+        parent['SequenceNumberRange']['EndingSequenceNumber'] = '10'
+        left = dict(make_shard('shardId-left', 0, 49), ParentShardId='shardId-parent')
+        right = dict(make_shard('shardId-right', 50, 99), ParentShardId='shardId-parent')
+        self.shards = [parent, left, right]
+        self.iterator_requests = []
+
+    def get_shard_iterator(self, StreamName, ShardId, ShardIteratorType, StartingSequenceNumber=None):
+        self.iterator_requests.append((ShardId, ShardIteratorType, StartingSequenceNumber))
+        return {'ShardIterator': ShardId}
+
+
+def make_consumer(monkeypatch, client, tmp_path, initial_position=LATEST):
+    monkeypatch.setattr(consumer.boto3, 'client', lambda *args, **kwargs: client)
+    store = SQLiteCheckpointStore(str(tmp_path / 'checkpoints.db'))
+    return KinesisConsumer('stream', lambda shard_id, records: None, checkpoint_store=store,
+                           initial_position=initial_position), store
+
+
+def test_children_of_finished_shards_start_at_trim_horizon(monkeypatch, tmp_path):
+    client = ReshardedClient()
+    kinesis_consumer, store = make_consumer(monkeypatch, client, tmp_path)
+    assert kinesis_consumer.readable_shards() == ['shardId-parent']
+    assert kinesis_consumer.initial_position_for('shardId-parent') == LATEST
+
+    store.set_checkpoint('stream', 'shardId-parent', SHARD_END)
+    assert sorted(kinesis_consumer.readable_shards()) == ['shardId-left', 'shardId-right']
+    assert kinesis_consumer.initial_position_for('shardId-left') == TRIM_HORIZON
+    assert kinesis_consumer.initial_position_for('shardId-right') == TRIM_HORIZON
+
+
+def test_shard_reader_uses_the_position_it_is_given(tmp_path):
+    client = ReshardedClient()
+    store = SQLiteCheckpointStore(str(tmp_path / 'checkpoints.db'))
+    reader = consumer.ShardReader('stream', 'shardId-left', None, store, threading.Event(),
+                                  initial_position=TRIM_HORIZON, client=client)
+    reader.get_iterator()
+    store.set_checkpoint('stream', 'shardId-left', '5')
+    reader.get_iterator()
+
+    assert client.iterator_requests == [('shardId-left', TRIM_HORIZON, None),
+                                        ('shardId-left', 'AFTER_SEQUENCE_NUMBER', '5')]
+
+
+def test_shards_without_known_parents_use_initial_position(tmp_path):
+    store = SQLiteCheckpointStore(str(tmp_path / 'checkpoints.db'))
+    shard = dict(make_shard('shardId-child', 0, 99), ParentShardId='shardId-expired')
+    assert consumer.shard_initial_position('stream', shard, store, LATEST) == LATEST
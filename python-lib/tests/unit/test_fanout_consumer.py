@@ -0,0 +1,66 @@
+from kinesis import fanout_consumer
+from kinesis.consumer import SHARD_END, SQLiteCheckpointStore, TRIM_HORIZON
+from kinesis.fanout_consumer import FanOutConsumer
+
+from .fakes import FakeKinesisClient
+
+SHARD_ID = 'shardId-000000000000'
+
+
+def shard_event(sequence_numbers, continuation):
+    event = {'Records': [{'Data': b'tweet', 'PartitionKey': 'pk', 'SequenceNumber': s} for s in sequence_numbers],
+             'MillisBehindLatest': 0}
+    if continuation is not None:
+        event['ContinuationSequenceNumber'] = continuation
+    return {'SubscribeToShardEvent': event}
+
+
+class FakeSubscribeClient(FakeKinesisClient):
+    """Each subscribe_to_shard call streams the next list of events, the last one stops the consumer."""
+    def __init__(self, subscriptions):
+        super(FakeSubscribeClient, self).__init__()
+        self.subscriptions = subscriptions
+        self.starting_positions = []
+        self.consumer = None
+
+    def subscribe_to_shard(self, ConsumerARN, ShardId, StartingPosition):
+        self.starting_positions.append(StartingPosition)
+        if not self.subscriptions:
+            self.consumer.stop()
+            return {'EventStream': []}
+        return {'EventStream': self.subscriptions.pop(0)}
+
+
+def make_consumer(monkeypatch, client, tmp_path):
+    monkeypatch.setattr(fanout_consumer.boto3, 'client', lambda *args, **kwargs: client)
+    store = SQLiteCheckpointStore(str(tmp_path / 'checkpoints.db'))
+    processed = []
+    consumer = FanOutConsumer('stream', 'scorer', lambda shard_id, records: processed.extend(records),
+                              checkpoint_store=store, initial_position=TRIM_HORIZON)
+    consumer.consumer_arn = 'arn:consumer'
+    client.consumer = consumer
+    return consumer, store, processed
+
+
+def test_subscription_without_events_does_not_close_the_shard(monkeypatch, tmp_path):
+    client = FakeSubscribeClient([[], [shard_event(['1', '2'], '2')]])
+    consumer, store, processed = make_consumer(monkeypatch, client, tmp_path)
+    consumer.read_shard(SHARD_ID)
+
+    assert store.get_checkpoint('stream', SHARD_ID) == '2'
+    assert [r['sequence_number'] for r in processed] == ['1', '2']
+    assert client.starting_positions == [
+        {'Type': TRIM_HORIZON},
+        {'Type': TRIM_HORIZON},
+        {'Type': 'AFTER_SEQUENCE_NUMBER', 'SequenceNumber': '2'},
+    ]
+
+
+def test_closed_shard_is_checkpointed_at_shard_end(monkeypatch, tmp_path):
+    client = FakeSubscribeClient([[shard_event(['1'], '1')], [shard_event(['2'], None)]])
+    consumer, store, processed = make_consumer(monkeypatch, client, tmp_path)
+    consumer.read_shard(SHARD_ID)
+
+    assert store.get_checkpoint('stream', SHARD_ID) == SHARD_END
+    assert [r['sequence_number'] for r in processed] == ['1', '2']
+    assert len(client.starting_positions) == 2
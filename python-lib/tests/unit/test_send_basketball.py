@@ -0,0 +1,103 @@
+import threading
+
+from kinesis import send_basketball, throttling
+
+from .fakes import ClientError
+
+
+def lock_is_free(lock):
+    # Tried from another thread, since buffer_lock is reentrant
+    free = []
+
+    def try_acquire():
+        if lock.acquire(False):
+            free.append(True)
+            lock.release()
+
+    thread = threading.Thread(target=try_acquire)
+    thread.start()
+    thread.join()
+    return bool(free)
+
+
+def test_full_batch_is_sent_outside_buffer_lock(make_streamer, kinesis_client):
+    streamer = make_streamer(buffered=True, max_linger_secs=60)
+    lock_free_during_put = []
+    kinesis_client.on_put_records = lambda stream_name, records: lock_free_during_put.append(
+        lock_is_free(streamer.buffer_lock))
+
+    for i in range(send_basketball.__MAX_BATCH_RECORDS__):
+        streamer.send_msg_to_stream('stream', 'msg {}'.format(i), 'user{}'.format(i))
+
+    assert len(kinesis_client.put_records_calls) == 1
+    assert len(kinesis_client.put_records_calls[0][1]) == send_basketball.__MAX_BATCH_RECORDS__
+    assert lock_free_during_put == [True]
+
+
+def test_flush_sends_partial_batch_outside_buffer_lock(make_streamer, kinesis_client):
+    streamer = make_streamer(buffered=True, max_linger_secs=60)
+    lock_free_during_put = []
+    kinesis_client.on_put_records = lambda stream_name, records: lock_free_during_put.append(
+        lock_is_free(streamer.buffer_lock))
+
+    for i in range(3):
+        streamer.send_msg_to_stream('stream', 'msg {}'.format(i), 'user{}'.format(i))
+    assert kinesis_client.put_records_calls == []
+    streamer.flush()
+
+    assert [len(records) for _, records in kinesis_client.put_records_calls] == [3]
+    assert lock_free_during_put == [True]
+    assert streamer.get_stats()['sent'] == {'stream': 3}
+
+
+def test_batches_split_at_request_byte_limit(make_streamer, kinesis_client):
+    streamer = make_streamer(buffered=True, max_linger_secs=60)
+    msg = 'x' * (512 * 1024)
+    for i in range(11):
+        streamer.send_msg_to_stream('stream', msg, 'user{}'.format(i))
+    streamer.flush()
+
+    sizes = [sum(len(r['Data']) + len(r['PartitionKey']) for r in records)
+             for _, records in kinesis_client.put_records_calls]
+    assert sum(len(records) for _, records in kinesis_client.put_records_calls) == 11
+    assert all(size <= send_basketball.__MAX_BATCH_BYTES__ for size in sizes)
+
+
+def test_rate_limiter_waits_outside_buffer_lock(make_streamer, kinesis_client):
+    streamer = make_streamer(buffered=True, max_linger_secs=60, rate_limit=True)
+    lock_free_during_acquire = []
+    acquire = streamer.rate_limiter.acquire
+
+    def checked_acquire(shard_usage):
+        lock_free_during_acquire.append(lock_is_free(streamer.buffer_lock))
+        return acquire(shard_usage)
+
+    streamer.rate_limiter.acquire = checked_acquire
+    for i in range(send_basketball.__MAX_BATCH_RECORDS__):
+        streamer.send_msg_to_stream('stream', 'msg {}'.format(i), 'user{}'.format(i))
+
+    assert lock_free_during_acquire == [True]
+
+
+def test_whole_request_throttle_slows_shards(make_streamer, kinesis_client):
+    streamer = make_streamer(buffered=True, max_linger_secs=60, rate_limit=True)
+    kinesis_client.put_records_errors.append(ClientError('ProvisionedThroughputExceededException'))
+    streamer.put_records_to_stream('stream', [{'Data': b'msg', 'PartitionKey': 'user'}])
+
+    factors = streamer.rate_limiter.rate_factors()
+    assert len(kinesis_client.put_records_calls) == 2
+    assert list(factors.values()) == [0.5 + throttling.__RATE_INCREASE_STEP__]
+
+
+def test_put_record_is_rate_limited(make_streamer, kinesis_client):
+    streamer = make_streamer(rate_limit=True)
+    kinesis_client.put_record_errors = [ClientError('ProvisionedThroughputExceededException')]
+    acquired = []
+    acquire = streamer.rate_limiter.acquire
+    streamer.rate_limiter.acquire = lambda shard_usage: acquired.append(shard_usage) or acquire(shard_usage)
+
+    streamer.send_msg_to_stream('stream', 'msg', 'user')
+
+    assert len(kinesis_client.put_record_calls) == 2
+    assert acquired == [{'shardId-000000000000': (1, len('msg') + len('user'))}] * 2
+    assert streamer.rate_limiter.rate_factors() == {'shardId-000000000000': 0.5 + throttling.__RATE_INCREASE_STEP__}
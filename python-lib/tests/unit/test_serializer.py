@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import datetime as dt
+import json
+from collections import namedtuple
+
+from twitter.serializer import RecordSerializer, strip_emoji
+
+User = namedtuple('User', 'name location verified created_at time_zone')
+Tweet = namedtuple('Tweet', 'user text source retweet_count created_at')
+
+NOW = dt.datetime(2018, 11, 22, 16, 30, 5)
+
+
+class FixedClock(object):
+    def now(self):
+        return NOW
+
+
+def legacy_user_record(tweet, now):
+    # The collector's format before RecordSerializer, without its emoji regex
+    user = tweet.user
+    return json.dumps({
+        'name': user.name,
+        'location': user.location,
+        'verified': user.verified,
+        'created_at': user.created_at.strftime('%Y-%m-%d'),
+        'user_age_at_post': (now - user.created_at).days,
+        'tz': user.time_zone
+    }) + '\n'
+
+
+def legacy_tweet_record(tweet):
+    return json.dumps({
+        'text': tweet.text,
+        'about_lebron': 'lebron' in tweet.text.lower(),
+        'source': tweet.source,
+        'retweet_cnt': tweet.retweet_count,
+        'created_at': tweet.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+    }) + '\n'
+
+
+def tweets():
+    return [
+        Tweet(User(u'Hoops Daily', u'Los Angeles', False, dt.datetime(2015, 3, 1, 8, 15),
+                   u'Pacific Time (US & Canada)'),
+              u'LeBron with the dunk', u'Twitter for iPhone', 12, dt.datetime(2018, 11, 22, 16, 29, 59, 123000)),
+        Tweet(User(u'Jos\xe9 Ball', None, True, dt.datetime(2009, 6, 1), None),
+              u'no mention here', u'Twitter Web Client', 0, dt.datetime(2018, 11, 22, 16, 0)),
+    ]
+
+
+def test_user_records_match_the_old_format():
+    serializer = RecordSerializer(clock=FixedClock())
+    for tweet in tweets():
+        record = serializer.user_record(tweet)
+        assert isinstance(record, bytes) and record.endswith(b'\n')
+        assert json.loads(record.decode('utf-8')) == json.loads(legacy_user_record(tweet, NOW))
+
+
+def test_tweet_records_match_the_old_format():
+    serializer = RecordSerializer()
+    for tweet in tweets():
+        record = serializer.tweet_record(tweet)
+        assert record.endswith(b'\n')
+        assert json.loads(record.decode('utf-8')) == json.loads(legacy_tweet_record(tweet))
+
+
+def test_emoji_are_stripped_from_names():
+    assert strip_emoji(u'LeBron Fan \U0001F3C0\U0001F525') == u'LeBron Fan '
+    assert strip_emoji(u'Jos\xe9 \U0001F1FA\U0001F1F8 Ball') == u'Jos\xe9  Ball'
+    assert strip_emoji(None) is None
@@ -0,0 +1,100 @@
+import os
+
+from kinesis import spool
+from kinesis.spool import DiskSpool, SpoolReplayer
+
+
+def make_entries(num, size=10, prefix='user'):
+    return [{'Data': 'x{}'.format(i).encode('utf-8').ljust(size, b'x'), 'PartitionKey': '{}{}'.format(prefix, i)}
+            for i in range(num)]
+
+
+class FakeStreamer(object):
+    """Accepts put_records batches within the request limits, rejects the rest."""
+    def __init__(self, max_bytes=spool.__REPLAY_BATCH_BYTES__, max_records=spool.__REPLAY_BATCH_RECORDS__):
+        self.max_bytes = max_bytes
+        self.max_records = max_records
+        self.delivered = []
+
+    def put_records_to_stream(self, stream_name, entries, spool_failures=True):
+        if len(entries) > self.max_records or sum(spool.entry_size(e) for e in entries) > self.max_bytes:
+            return entries
+        self.delivered.extend((stream_name, e) for e in entries)
+        return []
+
+
+def test_round_trip_with_explicit_hash_key(tmp_path):
+    disk_spool = DiskSpool(str(tmp_path))
+    entries = make_entries(3) + [{'Data': b'ehk', 'PartitionKey': 'user', 'ExplicitHashKey': '42'}]
+    assert disk_spool.append('stream', entries) == 0
+
+    records, position = disk_spool.read_batch()
+    assert records == [('stream', e) for e in entries]
+    disk_spool.commit(position)
+    assert disk_spool.is_empty()
+
+
+def test_recovers_uncommitted_records_after_crash(tmp_path):
+    disk_spool = DiskSpool(str(tmp_path), segment_bytes=4096)
+    entries = make_entries(100)
+    disk_spool.append('stream', entries)
+    records, position = disk_spool.read_batch(max_records=40)
+    disk_spool.commit(position)
+    disk_spool.flush()
+    # No close(), as if the process died
+
+    recovered = DiskSpool(str(tmp_path), segment_bytes=4096)
+    records, position = recovered.read_batch(max_records=1000)
+    assert [e for _, e in records] == entries[40:]
+    # Consumed segments are removed once committed
+    recovered.commit(position)
+    assert recovered.is_empty()
+    assert len([f for f in os.listdir(str(tmp_path)) if f.startswith('segment-')]) == 1
+
+
+def test_torn_write_is_ignored_on_recovery(tmp_path):
+    disk_spool = DiskSpool(str(tmp_path))
+    entries = make_entries(5)
+    disk_spool.append('stream', entries)
+    end = disk_spool.write_offset
+    # A frame whose payload never made it to disk: right length, wrong CRC
+    frame = bytearray(spool.encode_record('stream', make_entries(1, prefix='torn')[0]))
+    frame[-1] ^= 0xff
+    disk_spool._segment(disk_spool.write_segment).write(end, bytes(frame))
+    disk_spool.flush()
+
+    recovered = DiskSpool(str(tmp_path))
+    assert recovered.write_offset == end
+    records, _ = recovered.read_batch()
+    assert [e for _, e in records] == entries
+    recovered.append('stream', make_entries(1, prefix='after'))
+    records, _ = recovered.read_batch()
+    assert [e['PartitionKey'] for _, e in records][-1] == 'after0'
+
+
+def test_read_batch_is_bounded_by_bytes(tmp_path):
+    disk_spool = DiskSpool(str(tmp_path))
+    disk_spool.append('stream', make_entries(10, size=1000))
+    records, _ = disk_spool.read_batch(max_records=500, max_bytes=3000)
+    assert len(records) == 2
+    # A single entry over max_bytes is still returned on its own
+    records, _ = disk_spool.read_batch(max_records=500, max_bytes=10)
+    assert len(records) == 1
+
+
+def test_replayer_drains_large_aggregated_entries(tmp_path):
+    disk_spool = DiskSpool(str(tmp_path))
+    # 500 aggregated records of ~50 KB are ~25 MB, five times the request limit
+    entries = make_entries(500, size=50 * 1024)
+    disk_spool.append('stream', entries)
+    streamer = FakeStreamer()
+    replayer = SpoolReplayer(streamer, disk_spool)
+
+    batches = 0
+    while not disk_spool.is_empty():
+        assert replayer.replay_batch()
+        batches += 1
+        assert batches <= 10
+
+    assert [e for _, e in streamer.delivered] == entries
+    assert replayer.records_replayed == 500
@@ -0,0 +1,63 @@
+import threading
+import time
+
+from kinesis.stream_metadata import StreamMetadataCache
+
+from .fakes import ClientError, FakeKinesisClient
+
+
+class SlowDescribeClient(FakeKinesisClient):
+    def __init__(self, error=None):
+        super(SlowDescribeClient, self).__init__(num_shards=2)
+        self.error = error
+        self.describe_calls = 0
+
+    def describe_stream_summary(self, StreamName):
+        with self.lock:
+            self.describe_calls += 1
+        time.sleep(0.2)
+        if self.error is not None:
+            raise self.error
+        return super(SlowDescribeClient, self).describe_stream_summary(StreamName)
+
+
+def get_concurrently(cache, num_threads=10):
+    results = []
+    errors = []
+
+    def get():
+        try:
+            results.append(cache.get_shards('stream'))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=get) for _ in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def test_concurrent_misses_share_one_describe():
+    client = SlowDescribeClient()
+    cache = StreamMetadataCache(client, background_refresh=False)
+    results, errors = get_concurrently(cache)
+
+    assert client.describe_calls == 1
+    assert errors == []
+    assert len(results) == 10 and all(r == results[0] for r in results)
+    assert [s['ShardId'] for s in results[0]] == ['shardId-000000000000', 'shardId-000000000001']
+
+
+def test_waiters_see_the_refresh_error():
+    client = SlowDescribeClient(error=ClientError('ResourceNotFoundException'))
+    cache = StreamMetadataCache(client, background_refresh=False)
+    results, errors = get_concurrently(cache)
+
+    assert client.describe_calls == 1
+    assert results == [] and len(errors) == 10
+    # The failed refresh isn't cached, the next caller tries again
+    client.error = None
+    assert len(cache.get_shards('stream')) == 2
+    assert client.describe_calls == 2
@@ -0,0 +1,45 @@
+import multiprocessing
+import sys
+
+import pytest
+
+from twitter.supervisor import CollectorSupervisor, reconnect_delay, shard_credentials, shard_keywords
+
+
+def test_shard_keywords_splits_round_robin():
+    assert shard_keywords(['a', 'b', 'c', 'd', 'e'], 2) == [['a', 'c', 'e'], ['b', 'd']]
+
+
+def test_shard_keywords_drops_empty_shards():
+    assert shard_keywords(['a', 'b'], 4) == [['a'], ['b']]
+
+
+def test_reconnect_delay_for_errors():
+    assert [reconnect_delay(a) for a in range(8)] == [5, 10, 20, 40, 80, 160, 320, 320]
+
+
+def test_reconnect_delay_after_rate_limiting():
+    assert [reconnect_delay(a, 420) for a in range(6)] == [60, 120, 240, 480, 960, 960]
+
+
+def test_shard_credentials_fails_fast():
+    with pytest.raises(ValueError):
+        shard_credentials([{'consumer_key': 'a'}], 2)
+    assert shard_credentials(['a', 'b', 'c'], 2) == ['a', 'b']
+
+
+def test_supervisor_needs_a_credential_set_per_process():
+    with pytest.raises(ValueError):
+        CollectorSupervisor(['a', 'b'], num_processes=2)
+
+
+def test_supervisor_processes_limited_by_credentials(monkeypatch):
+    monkeypatch.setattr(multiprocessing, 'cpu_count', lambda: 8)
+    supervisor = CollectorSupervisor(['a', 'b', 'c', 'd'], credentials=['x', 'y'])
+    assert supervisor.shards == [['a', 'c'], ['b', 'd']]
+    assert supervisor.credentials == ['x', 'y']
+
+
+def test_supervisor_does_not_import_tweepy():
+    # tweepy is only imported in the collector processes
+    assert 'twitter.collector' not in sys.modules
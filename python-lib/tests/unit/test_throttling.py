@@ -0,0 +1,27 @@
+from kinesis.throttling import PutRetries, failed_entries
+
+
+def test_put_retries_stops_when_nothing_fails():
+    retries = PutRetries(['a', 'b', 'c'], max_retries=3)
+    assert retries.next_delay(['b']) is not None
+    assert retries.entries == ['b']
+    assert retries.next_delay([]) is None
+    assert retries.entries == [] and retries.given_up == []
+
+
+def test_put_retries_gives_up_without_a_final_delay():
+    retries = PutRetries(['a'], max_retries=2, base=0.1, cap=5.0)
+    delays = []
+    while retries.entries:
+        delay = retries.next_delay(retries.entries)
+        if delay is not None:
+            delays.append(delay)
+    assert len(delays) == 2
+    assert 0 <= delays[0] <= 0.1 and 0 <= delays[1] <= 0.2
+    assert retries.attempt == 2
+    assert retries.given_up == ['a']
+
+
+def test_failed_entries():
+    response = {'Records': [{'SequenceNumber': '1'}, {'ErrorCode': 'InternalFailure'}]}
+    assert failed_entries(['a', 'b'], response) == ['b']
@@ -0,0 +1,63 @@
+"""
+Single core records/sec of the collector's record serialization, comparing the
+original per record json.dumps + datetime.now() with RecordSerializer.
+
+    PYTHONPATH=python-lib python python-lib/twitter/benchmark_serializer.py [num_tweets]
+"""
+import datetime as dt
+import json
+import re
+import sys
+import timeit
+from collections import namedtuple
+
+from twitter.serializer import RecordSerializer, orjson
+
+User = namedtuple('User', 'name location verified created_at time_zone')
+Tweet = namedtuple('Tweet', 'user text source retweet_count created_at')
+
+NAMES = [u'LeBron Fan \U0001F3C0\U0001F525', u'Hoops Daily', u'NBA News Now', u'Jos\xe9 \U0001F1FA\U0001F1F8 Ball']
+
+legacy_emoji_pattern = re.compile(
+    u"(\ud83d[\ude00-\ude4f])|"
+    u"(\ud83c[\udf00-\uffff])|"
+    u"(\ud83d[\u0000-\uddff])|"
+    u"(\ud83d[\ude80-\udeff])|"
+    u"(\ud83c[\udde0-\uddff])"
+    "+", flags=re.UNICODE)
+
+
+def legacy_user_record(tweet):
+    user = tweet.user
+    return_val = {
+        'name': legacy_emoji_pattern.sub(r'', user.name),
+        'location': user.location,
+        'verified': user.verified,
+        'created_at': user.created_at.strftime('%Y-%m-%d'),
+        'user_age_at_post': (dt.datetime.now() - user.created_at).days,
+        'tz': user.time_zone
+    }
+    return json.dumps(return_val) + '\n'
+
+
+def synthetic_tweets(num_tweets):
+    created_at = dt.datetime(2015, 3, 1)
+    return [Tweet(User(NAMES[i % len(NAMES)], 'Los Angeles' if i % 3 else None, i % 20 == 0,
+                       created_at + dt.timedelta(days=i % 1000), 'Pacific Time (US & Canada)'),
+                  u'LeBron with the dunk #{}'.format(i), 'Twitter for iPhone', i % 50, created_at)
+            for i in range(num_tweets)]
+
+
+if __name__ == '__main__':
+    num_tweets = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    tweets = synthetic_tweets(num_tweets)
+    serializer = RecordSerializer()
+
+    runs = [
+        ('legacy json.dumps', lambda: [legacy_user_record(t) for t in tweets]),
+        ('user_record', lambda: [serializer.user_record(t) for t in tweets]),
+    ]
+    print('encoder: {}'.format('orjson' if orjson is not None else 'json'))
+    for name, run in runs:
+        secs = min(timeit.repeat(run, number=1, repeat=3))
+        print('{:20s} {:>10,.0f} records/sec'.format(name, num_tweets / secs))
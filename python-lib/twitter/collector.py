@@ -1,71 +1,101 @@
-import re
 import datetime as dt
-import json
 import tweepy
 import time
 
 import sys
 sys.path.append('.')
 from kinesis import KinesisBasketballStreamer as KBS
+from kinesis.background_sender import BackgroundSender, BLOCK
+from twitter.serializer import RecordSerializer
 
 consumer_key = "..."
 consumer_secret = "..."
 access_token = "..."
 access_token_secret = "..."
 
+default_credentials = {
+    'consumer_key': consumer_key,
+    'consumer_secret': consumer_secret,
+    'access_token': access_token,
+    'access_token_secret': access_token_secret,
+}
+
+def make_auth(credentials):
+    auth = tweepy.OAuthHandler(credentials['consumer_key'], credentials['consumer_secret'])
+    auth.set_access_token(credentials['access_token'], credentials['access_token_secret'])
+    return auth
+
 # Tweepy API
-auth = tweepy.OAuthHandler(consumer_key, consumer_secret)
-auth.set_access_token(access_token, access_token_secret)
+auth = make_auth(default_credentials)
 api = tweepy.API(auth)
 
-emoji_pattern = re.compile(
-    u"(\ud83d[\ude00-\ude4f])|"  # emoticons
-    u"(\ud83c[\udf00-\uffff])|"  # symbols & pictographs (1 of 2)
-    u"(\ud83d[\u0000-\uddff])|"  # symbols & pictographs (2 of 2)
-    u"(\ud83d[\ude80-\udeff])|"  # transport & map symbols
-    u"(\ud83c[\udde0-\uddff])"  # flags (iOS)
-    "+", flags=re.UNICODE)
-
 class MyStreamListener(tweepy.StreamListener):
-    def __init__(self):
+    def __init__(self, num_sender_workers=2, queue_size=10000, backpressure=BLOCK, verbose=False):
         super(MyStreamListener, self).__init__()
-        self.kbs = KBS()
+        self.kbs = KBS(buffered=True)
+        # Delivery to Kinesis happens on the sender's worker threads so the
+        # tweepy stream thread only has to build and queue each message.
+        self.sender = BackgroundSender(self.kbs,
+                                       num_workers=num_sender_workers,
+                                       queue_size=queue_size,
+                                       backpressure=backpressure)
+        self.serializer = RecordSerializer()
+        self.verbose = verbose
+        self.tweets_received = 0
+        self.lag_secs = None
+        self.last_error = None
+        # Status code the current connection was closed with, reset on reconnect
+        self.disconnect_status = None
 
     def on_status(self, status):
+        self.tweets_received += 1
+        # tweepy's created_at is naive UTC
+        self.lag_secs = (dt.datetime.utcnow() - status.created_at).total_seconds()
         self.get_user_tweet_info(status)
 
+    def on_error(self, status_code):
+        self.last_error = status_code
+        self.disconnect_status = status_code
+        print('Stream error: {}'.format(status_code))
+        # Disconnect, the caller reconnects with backoff
+        return False
+
+    def stats(self):
+        return {
+            'tweets': self.tweets_received,
+            'lag_secs': self.lag_secs,
+            'last_error': self.last_error,
+            'sender': self.sender.stats(),
+            'kinesis': self.kbs.get_stats(),
+        }
+
     def get_user_tweet_info(self, status):
         user_string = self.get_user_info_from_tweet(status)
-        tweet_string = self.get_tweet_info(status)
-        self.kbs.send_msg_to_stream('TwitterBBallUserStream', user_string)
-        # self.kbs.send_msg_to_stream('bball_tweet_info', tweet_string)
-        print(user_string)
-        print(tweet_string)
+        self.sender.send_msg_to_stream('TwitterBBallUserStream', user_string, partition_key=status.user.screen_name)
+        # self.sender.send_msg_to_stream('bball_tweet_info', self.get_tweet_info(status))
+        if self.verbose:
+            print(user_string.decode('utf-8'))
+            print(self.get_tweet_info(status).decode('utf-8'))
+
+    def close(self):
+        self.sender.close()
 
     def get_user_info_from_tweet(self, tweet):
-        user = tweet.user
-        return_val = {
-            'name': emoji_pattern.sub(r'', user.name),
-            'location': user.location,
-            'verified': user.verified,
-            'created_at': user.created_at.strftime('%Y-%m-%d'),
-            'user_age_at_post': (dt.datetime.now() - user.created_at).days,
-            'tz': user.time_zone
-        }
-        return json.dumps(return_val) + '\n'
+        return self.serializer.user_record(tweet)
 
     def get_tweet_info(self, tweet):
-        return_val = {
-            'text': tweet.text,
-            'about_lebron': 'lebron' in tweet.text.lower(),
-            'source': tweet.source,
-            'retweet_cnt': tweet.retweet_count,
-            'created_at': tweet.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-        }
-        return json.dumps(return_val) + '\n'
+        return self.serializer.tweet_record(tweet)
 
 
-def run():
-    myStreamListener = MyStreamListener()
+def run(num_sender_workers=2, queue_size=10000, backpressure=BLOCK, verbose=False, track=None):
+    myStreamListener = MyStreamListener(num_sender_workers=num_sender_workers,
+                                        queue_size=queue_size,
+                                        backpressure=backpressure,
+                                        verbose=verbose)
     myStream = tweepy.Stream(auth = api.auth, listener=myStreamListener)
-    myStream.filter(track=['basketball'])
+    try:
+        myStream.filter(track=track or ['basketball'])
+    finally:
+        print(myStreamListener.sender.stats())
+        print(myStreamListener.kbs.get_stats())
+        myStreamListener.close()
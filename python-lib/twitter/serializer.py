@@ -0,0 +1,92 @@
+"""
+Serializes tweets into the newline delimited JSON records sent to Kinesis.
+
+    serializer = RecordSerializer()
+    data = serializer.user_record(status)          # one record, as bytes
+
+Emoji are stripped from user names with one compiled regex over code points,
+records are encoded with orjson when it is installed (falling back to the
+standard json encoder), and the current time is sampled once per
+__CLOCK_SAMPLE_SECONDS__ instead of per record.
+"""
+import datetime as dt
+import json
+import re
+import sys
+import time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+__CLOCK_SAMPLE_SECONDS__ = 1.0
+
+if sys.maxunicode > 0xFFFF:
+    # Flags, symbols & pictographs, emoticons and transport & map symbols
+    EMOJI_PATTERN = re.compile(u'[\U0001F1E0-\U0001F1FF\U0001F300-\U0001F64F\U0001F680-\U0001F6FF]+')
+else:
+    # Narrow (UCS-2) Python 2 builds store these code points as surrogate pairs
+    EMOJI_PATTERN = re.compile(u'(?:\ud83c[\udde0-\uddff\udf00-\udfff]|\ud83d[\udc00-\ude4f\ude80-\udeff])+')
+
+
+def strip_emoji(text):
+    return EMOJI_PATTERN.sub(u'', text) if text else text
+
+
+if orjson is not None:
+    encode_json = orjson.dumps
+else:
+    _encoder = json.JSONEncoder()
+
+    def encode_json(obj):
+        return _encoder.encode(obj).encode('utf-8')
+
+
+class Clock(object):
+    """A datetime.now() sample that is refreshed at most every max_age_secs."""
+    def __init__(self, max_age_secs=__CLOCK_SAMPLE_SECONDS__):
+        self.max_age_secs = max_age_secs
+        self.sampled_at = 0
+        self.sample = None
+
+    def now(self):
+        now = time.time()
+        if self.sample is None or now - self.sampled_at >= self.max_age_secs:
+            self.sample = dt.datetime.now()
+            self.sampled_at = now
+        return self.sample
+
+
+class RecordSerializer(object):
+    def __init__(self, clock=None):
+        self.clock = clock or Clock()
+
+    def user_info(self, tweet, now):
+        user = tweet.user
+        created_at = user.created_at
+        return {
+            'name': strip_emoji(user.name),
+            'location': user.location,
+            'verified': user.verified,
+            # isoformat is several times faster than strftime for the same output
+            'created_at': created_at.date().isoformat(),
+            'user_age_at_post': (now - created_at).days,
+            'tz': user.time_zone
+        }
+
+    def tweet_info(self, tweet):
+        text = tweet.text
+        return {
+            'text': text,
+            'about_lebron': 'lebron' in text.lower(),
+            'source': tweet.source,
+            'retweet_cnt': tweet.retweet_count,
+            'created_at': tweet.created_at.replace(microsecond=0).isoformat(' '),
+        }
+
+    def user_record(self, tweet, now=None):
+        return encode_json(self.user_info(tweet, now or self.clock.now())) + b'\n'
+
+    def tweet_record(self, tweet):
+        return encode_json(self.tweet_info(tweet)) + b'\n'
@@ -0,0 +1,293 @@
+"""
+Runs several collector processes, each tracking its own share of the keywords
+with its own Kinesis producer, so one box isn't limited to a single core.
+
+    supervisor = CollectorSupervisor(['basketball', 'nba', 'lebron', 'warriors'],
+                                     credentials=[creds1, creds2], stats_port=8000)
+    supervisor.run()
+
+Twitter allows one standing streaming connection per set of credentials, so
+every process needs its own (dicts of consumer_key, consumer_secret,
+access_token and access_token_secret). Without credentials a single process
+uses the ones in twitter/collector.py.
+
+Each process reconnects its stream with Twitter's backoff when it disconnects,
+and the supervisor restarts processes that exit. Every process reports its stats
+to the supervisor, which aggregates them (tweets/sec, lag, Kinesis counters) and
+prints them to stdout and serves them as JSON on http://localhost:<stats_port>/.
+On stop each process disconnects its stream and flushes its producer.
+"""
+import argparse
+import json
+import multiprocessing
+import signal
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from kinesis.background_sender import BLOCK
+from kinesis.throttling import backoff_delay
+
+__STATS_INTERVAL_SECONDS__ = 10
+# Twitter asks clients to back off exponentially from 5s, up to 320s, on errors
+__RECONNECT_BASE_SECONDS__ = 5
+__RECONNECT_MAX_SECONDS__ = 320
+# and from a minute after 420 (rate limited) responses
+__RATE_LIMITED_STATUS__ = 420
+__RATE_LIMITED_BASE_SECONDS__ = 60
+__RATE_LIMITED_MAX_SECONDS__ = 960
+# A connection that lasted this long resets the backoff
+__HEALTHY_CONNECTION_SECONDS__ = 60
+# Disconnecting waits for the next keep-alive (every 30s) before the producer is flushed
+__STOP_TIMEOUT_SECONDS__ = 90
+
+
+def shard_keywords(keywords, num_processes):
+    """Splits the keywords round robin into at most num_processes non-empty lists."""
+    shards = [keywords[i::num_processes] for i in range(num_processes)]
+    return [shard for shard in shards if shard]
+
+
+def shard_credentials(credentials, num_shards):
+    """One credential set per shard, failing fast if there aren't enough."""
+    if len(credentials) < num_shards:
+        raise ValueError('{} collector processes need {} credential sets, got {}. Twitter allows one '
+                         'streaming connection per set.'.format(num_shards, num_shards, len(credentials)))
+    return credentials[:num_shards]
+
+
+def reconnect_delay(attempt, status_code=None):
+    """
+    Twitter's reconnect schedule: exponential from 60s after a 420, from 5s
+    after anything else. No jitter, these are the minimum waits.
+    """
+    if status_code == __RATE_LIMITED_STATUS__:
+        base, cap = __RATE_LIMITED_BASE_SECONDS__, __RATE_LIMITED_MAX_SECONDS__
+    else:
+        base, cap = __RECONNECT_BASE_SECONDS__, __RECONNECT_MAX_SECONDS__
+    return min(cap, base * (2 ** attempt))
+
+
+def collect(index, track, credentials, stats_queue, stop_event, stats_interval=__STATS_INTERVAL_SECONDS__,
+            num_sender_workers=2, queue_size=10000, backpressure=BLOCK):
+    """
+    Process entry point: streams tweets matching track with its own credentials
+    until stop_event is set, reconnecting with backoff, and reports stats every
+    stats_interval seconds.
+    """
+    # Imported in the child so every process has its own clients and connections
+    import tweepy
+    from twitter import collector
+
+    # The supervisor stops children through stop_event so they can flush first
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    auth = collector.make_auth(credentials) if credentials else collector.api.auth
+
+    # One producer per process, kept across reconnects
+    listener = collector.MyStreamListener(num_sender_workers=num_sender_workers,
+                                          queue_size=queue_size,
+                                          backpressure=backpressure)
+    reconnects = [0]
+    current_stream = [None]
+
+    def report():
+        while not stop_event.wait(stats_interval):
+            stats = listener.stats()
+            stats['reconnects'] = reconnects[0]
+            stats['track'] = track
+            stats_queue.put((index, time.time(), stats))
+        # filter() only returns once its stream is disconnected
+        if current_stream[0] is not None:
+            current_stream[0].disconnect()
+
+    reporter = threading.Thread(target=report)
+    reporter.daemon = True
+    reporter.start()
+
+    attempt = 0
+    try:
+        while not stop_event.is_set():
+            stream = tweepy.Stream(auth=auth, listener=listener)
+            current_stream[0] = stream
+            if stop_event.is_set():
+                break
+            listener.disconnect_status = None
+            connected_at = time.time()
+            try:
+                stream.filter(track=track)
+            except Exception as e:
+                print('Collector {} disconnected: {}'.format(index, e))
+            if stop_event.is_set():
+                break
+            if time.time() - connected_at >= __HEALTHY_CONNECTION_SECONDS__:
+                attempt = 0
+            reconnects[0] += 1
+            stop_event.wait(reconnect_delay(attempt, listener.disconnect_status))
+            attempt += 1
+    finally:
+        listener.close()
+
+
+class CollectorSupervisor(object):
+    def __init__(self, keywords, credentials=None, num_processes=None, stats_port=None,
+                 stats_interval=__STATS_INTERVAL_SECONDS__, **collector_kwargs):
+        # None stands for the credentials in twitter/collector.py
+        credentials = list(credentials) if credentials else [None]
+        num_processes = num_processes or min(len(keywords), multiprocessing.cpu_count(), len(credentials))
+        self.shards = shard_keywords(list(keywords), num_processes)
+        self.credentials = shard_credentials(credentials, len(self.shards))
+        self.stats_port = stats_port
+        self.stats_interval = stats_interval
+        self.collector_kwargs = collector_kwargs
+        self.stats_queue = multiprocessing.Queue()
+        self.stop_event = multiprocessing.Event()
+        self.processes = {}
+        self.restarts = dict((index, 0) for index in range(len(self.shards)))
+        self.restart_at = {}
+        self.stats_lock = threading.Lock()
+        self.process_stats = {}
+        self.tweet_rates = {}
+        self.http_server = None
+
+    def start_process(self, index):
+        process = multiprocessing.Process(target=collect,
+                                          args=(index, self.shards[index], self.credentials[index],
+                                                self.stats_queue, self.stop_event, self.stats_interval),
+                                          kwargs=self.collector_kwargs)
+        process.daemon = True
+        process.start()
+        self.processes[index] = process
+
+    def check_processes(self):
+        """Restarts processes that exited, backing off when they keep dying."""
+        now = time.time()
+        for index, process in list(self.processes.items()):
+            if process.is_alive():
+                continue
+            if index not in self.restart_at:
+                print('Collector {} exited with {}, restarting'.format(index, process.exitcode))
+                self.restart_at[index] = now + backoff_delay(self.restarts[index], __RECONNECT_BASE_SECONDS__,
+                                                             __RECONNECT_MAX_SECONDS__)
+            elif now >= self.restart_at.pop(index):
+                self.restarts[index] += 1
+                self.start_process(index)
+
+    def drain_stats(self):
+        while True:
+            try:
+                index, reported_at, stats = self.stats_queue.get_nowait()
+            except queue.Empty:
+                return
+            with self.stats_lock:
+                previous = self.process_stats.get(index)
+                if previous is not None and reported_at > previous[0]:
+                    self.tweet_rates[index] = (stats['tweets'] - previous[1]['tweets']) / (reported_at - previous[0])
+                self.process_stats[index] = (reported_at, stats)
+
+    def stats(self):
+        """Per process stats and their totals."""
+        with self.stats_lock:
+            processes = dict((index, dict(stats, tweets_per_sec=self.tweet_rates.get(index, 0.0),
+                                          restarts=self.restarts[index]))
+                             for index, (_, stats) in self.process_stats.items())
+        lags = [p['lag_secs'] for p in processes.values() if p.get('lag_secs') is not None]
+        sent = {}
+        for p in processes.values():
+            for stream_name, count in p['kinesis']['sent'].items():
+                sent[stream_name] = sent.get(stream_name, 0) + count
+        return {
+            'processes': processes,
+            'total': {
+                'processes': len(self.shards),
+                'alive': sum(1 for p in self.processes.values() if p.is_alive()),
+                'tweets': sum(p['tweets'] for p in processes.values()),
+                'tweets_per_sec': sum(p['tweets_per_sec'] for p in processes.values()),
+                'max_lag_secs': max(lags) if lags else None,
+                'reconnects': sum(p['reconnects'] for p in processes.values()),
+                'sent': sent,
+            },
+        }
+
+    def serve_stats(self, port):
+        supervisor = self
+
+        class StatsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(supervisor.stats(), sort_keys=True).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.http_server = HTTPServer(('localhost', port), StatsHandler)
+        thread = threading.Thread(target=self.http_server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def run(self):
+        """Runs the collectors until interrupted."""
+        for index in range(len(self.shards)):
+            print('Collector {} tracking {}'.format(index, self.shards[index]))
+            self.start_process(index)
+        if self.stats_port:
+            self.serve_stats(self.stats_port)
+        next_report = time.time() + self.stats_interval
+        try:
+            while not self.stop_event.is_set():
+                time.sleep(1)
+                self.drain_stats()
+                self.check_processes()
+                if time.time() >= next_report:
+                    print(json.dumps(self.stats()['total'], sort_keys=True))
+                    next_report += self.stats_interval
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self, timeout=__STOP_TIMEOUT_SECONDS__):
+        """
+        Asks every process to disconnect and flush its producer, only
+        terminating the ones that haven't exited within timeout.
+        """
+        self.stop_event.set()
+        if self.http_server is not None:
+            self.http_server.shutdown()
+        deadline = time.time() + timeout
+        for index, process in self.processes.items():
+            process.join(max(deadline - time.time(), 0))
+            if process.is_alive():
+                print('Collector {} did not stop within {}s, terminating it'.format(index, timeout))
+                process.terminate()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run sharded tweet collectors.')
+    parser.add_argument('--keywords', default='basketball', help='comma separated track keywords')
+    parser.add_argument('--credentials', default=None,
+                        help='JSON file with a list of Twitter credential sets, one per process')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='defaults to one per keyword, up to one per core and credential set')
+    parser.add_argument('--stats-port', type=int, default=None, help='serve JSON stats on this local port')
+    parser.add_argument('--stats-interval', type=int, default=__STATS_INTERVAL_SECONDS__)
+    args = parser.parse_args(argv)
+    keywords = [k.strip() for k in args.keywords.split(',') if k.strip()]
+    credentials = None
+    if args.credentials:
+        with open(args.credentials) as f:
+            credentials = json.load(f)
+    CollectorSupervisor(keywords, credentials=credentials, num_processes=args.processes,
+                        stats_port=args.stats_port, stats_interval=args.stats_interval).run()